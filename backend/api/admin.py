@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Textbook, Listing, SchoolProfile, BookshopProfile, BookList, Review, Conversation, Message, Cart, CartItem, SwapRequest, Order, Delivery, Payment, Wallet, WalletTransaction
+from .models import User, Textbook, Listing, SchoolProfile, BookshopProfile, BookList, Child, Review, Conversation, Message, Cart, CartItem, SwapMatch, SwapRequest, Order, Delivery, Payment, PaymentCallback, Wallet, WalletTransaction, WalletDailyRollup, ArchivedRecord
 
 # Register the custom User model
 admin.site.register(User, UserAdmin)
@@ -11,14 +11,19 @@ admin.site.register(Listing)
 admin.site.register(SchoolProfile)
 admin.site.register(BookshopProfile)
 admin.site.register(BookList)
+admin.site.register(Child)
 admin.site.register(Review)
 admin.site.register(Conversation)
 admin.site.register(Message)
 admin.site.register(Cart)
 admin.site.register(CartItem)
 admin.site.register(SwapRequest)
+admin.site.register(SwapMatch)
 admin.site.register(Order)
 admin.site.register(Delivery)
 admin.site.register(Payment)
+admin.site.register(PaymentCallback)
 admin.site.register(Wallet)
 admin.site.register(WalletTransaction)
+admin.site.register(WalletDailyRollup)
+admin.site.register(ArchivedRecord)
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.conf import settings
+        from . import metrics
+
+        if getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            metrics.instrument_serializers()
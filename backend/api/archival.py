@@ -0,0 +1,107 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import ArchivedRecord, Conversation, Delivery, Listing, Message, Payment
+
+# Moves cold rows out of the hot tables. Each policy picks rows that nothing
+# live needs any more, copies them (serialized, as `manage.py dumpdata` would)
+# into ArchivedRecord and deletes them, one batch per transaction.
+# `manage.py archive_cold_rows` runs every policy; `manage.py purge_archive`
+# drops archived rows once they're past ARCHIVE_RETENTION_DAYS.
+#
+# Orders outlive their archived delivery, so each one also gets an
+# ORDER_DELIVERY record (keyed by order id) holding the delivery's tracking
+# code and status for the order exports.
+
+ORDER_DELIVERY = Delivery.orders.through._meta.label_lower
+
+def _cutoff(setting, default_days):
+    return timezone.now() - timedelta(days=getattr(settings, setting, default_days))
+
+def _archive(rows):
+    ArchivedRecord.objects.bulk_create([
+        ArchivedRecord(model=row['model'], object_id=row['pk'], data=row['fields'], created_at=row['fields']['created_at'])
+        for row in serializers.serialize('python', rows)
+    ], ignore_conflicts=True)
+
+def cold_messages():
+    return Message.all_objects.filter(timestamp__lt=_cutoff('ARCHIVE_MESSAGES_AFTER_DAYS', 365))
+
+def cold_deliveries():
+    return Delivery.all_objects.filter(
+        status__in=['delivered', 'cancelled'],
+        created_at__lt=_cutoff('ARCHIVE_DELIVERIES_AFTER_DAYS', 180),
+    )
+
+def cold_listings():
+    # Unsold and gone for a while. Sold listings stay: orders and reviews point at them.
+    return Listing.all_objects.filter(
+        Q(is_active=False) | Q(is_deleted=True),
+        updated_at__lt=_cutoff('ARCHIVE_LISTINGS_AFTER_DAYS', 180),
+        order__isnull=True,
+        reviews__isnull=True,
+        swap_requests_received__isnull=True,
+        swap_requests_sent__isnull=True,
+    )
+
+def _archive_messages(ids):
+    _archive(Message.all_objects.filter(id__in=ids))
+    return Message.all_objects.filter(id__in=ids).delete()
+
+def _archive_deliveries(ids):
+    _archive(Delivery.all_objects.filter(id__in=ids).prefetch_related('orders'))
+    _archive(Payment.all_objects.filter(delivery_id__in=ids))
+    links = Delivery.orders.through.objects.filter(delivery_id__in=ids).select_related('delivery')
+    ArchivedRecord.objects.bulk_create([
+        ArchivedRecord(
+            model=ORDER_DELIVERY, object_id=link.order_id, created_at=link.delivery.created_at,
+            data={'delivery': link.delivery_id, 'tracking_code': link.delivery.tracking_code, 'status': link.delivery.status},
+        )
+        for link in links
+    ], ignore_conflicts=True)
+    # Keep the chat, just not its link to the delivery
+    Conversation.all_objects.filter(delivery_id__in=ids).update(delivery=None)
+    return Delivery.all_objects.filter(id__in=ids).delete()
+
+def _archive_listings(ids):
+    _archive(Listing.all_objects.filter(id__in=ids))
+    Conversation.all_objects.filter(listing_id__in=ids).update(listing=None)
+    return Listing.all_objects.filter(id__in=ids).delete()
+
+POLICIES = [
+    ('messages', cold_messages, _archive_messages),
+    ('deliveries', cold_deliveries, _archive_deliveries),
+    ('listings', cold_listings, _archive_listings),
+]
+
+def archive_cold_rows(batch_size=500, dry_run=False):
+    """Archive every policy's cold rows in batches. Returns {policy: rows archived (or eligible)}."""
+    counts = {}
+    for name, select, archive in POLICIES:
+        if dry_run:
+            counts[name] = select().values('id').distinct().count()
+            continue
+        counts[name] = 0
+        while True:
+            with transaction.atomic():
+                ids = list(select().values_list('id', flat=True).distinct()[:batch_size])
+                if not ids:
+                    break
+                archive(ids)
+            counts[name] += len(ids)
+    return counts
+
+def purge_archive(batch_size=5000, dry_run=False):
+    """Delete archived rows older than ARCHIVE_RETENTION_DAYS. Returns the number deleted."""
+    expired = ArchivedRecord.objects.filter(archived_at__lt=_cutoff('ARCHIVE_RETENTION_DAYS', 730))
+    if dry_run:
+        return expired.count()
+    total = 0
+    while True:
+        ids = list(expired.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return total
+        total += ArchivedRecord.objects.filter(id__in=ids).delete()[0]
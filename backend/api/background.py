@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+
+# Small in-process worker pool for jobs that shouldn't hold up a request
+# (payment callbacks, swap matching). Work is queued with submit(), normally
+# from a transaction.on_commit() hook. Set BACKGROUND_TASKS_ASYNC = False to
+# run jobs inline instead.
+
+_executor = None
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+            thread_name_prefix='background',
+        )
+    return _executor
+
+def _run(func, args, kwargs):
+    close_old_connections()
+    try:
+        func(*args, **kwargs)
+    except Exception as e:
+        print(f"Background task {func.__name__} failed: {e}")
+    finally:
+        close_old_connections()
+
+def submit(func, *args, **kwargs):
+    if getattr(settings, 'BACKGROUND_TASKS_ASYNC', True):
+        _get_executor().submit(_run, func, args, kwargs)
+    else:
+        func(*args, **kwargs)
+
+# Saves often come in bursts (a bulk book list upload adds rows one by one),
+# so a job that is already queued for the same key isn't queued again.
+_queued = set()
+_queued_lock = threading.Lock()
+
+def submit_once(func, key):
+    with _queued_lock:
+        if (func, key) in _queued:
+            return
+        _queued.add((func, key))
+    submit(_run_queued, func, key)
+
+def _run_queued(func, key):
+    with _queued_lock:
+        _queued.discard((func, key))
+    func(key)
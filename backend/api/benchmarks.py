@@ -0,0 +1,303 @@
+import platform
+import random
+import subprocess
+from collections import defaultdict
+from decimal import Decimal
+from time import perf_counter
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .metrics import RequestMetrics, percentile
+from .models import (
+    User, Wallet, WalletTransaction, Textbook, Listing, SchoolProfile, BookshopProfile, BookList, Child,
+    Conversation, Message, Order, Delivery
+)
+
+# Seeded benchmark suite for the API hot paths. seed() fills the database
+# with deterministic synthetic data; run_scenarios() times the endpoints
+# in-process through the DRF test client and returns a JSON-ready report.
+# `manage.py benchmark_api` runs both against a throwaway database.
+
+BASE_COUNTS = {
+    'parents': 200,
+    'bookshops': 10,
+    'schools': 5,
+    'riders': 10,
+    'textbooks': 300,
+    'listings': 2000,
+    'conversations': 400,
+    'deliveries': 300,
+}
+MESSAGES_PER_CONVERSATION = 20
+GRADES_PER_SCHOOL = 8
+BOOKS_PER_LIST = 15
+
+TOWNS = ['Nyeri', 'Karatina', 'Othaya', 'Mukurweini', 'Naro Moru', 'Chaka', 'Kiganjo', 'Mweiga']
+SUBJECTS = ['Mathematics', 'English', 'Kiswahili', 'Science', 'Social Studies', 'CRE', 'Agriculture', 'Art']
+
+def scaled_counts(scale):
+    return {name: max(1, int(count * scale)) for name, count in BASE_COUNTS.items()}
+
+def seed(scale=1.0, seed=42):
+    """Create a deterministic synthetic dataset. Returns the row counts."""
+    rng = random.Random(seed)
+    counts = scaled_counts(scale)
+    password = make_password('benchmark')
+
+    def make_users(user_type, count):
+        return User.objects.bulk_create([
+            User(
+                email=f'{user_type}{i}@bench.test', username=f'{user_type}{i}', password=password,
+                user_type=user_type, location=rng.choice(TOWNS), phone_number=f'07{rng.randrange(10 ** 8):08d}',
+            )
+            for i in range(count)
+        ])
+
+    parents = make_users('parent', counts['parents'])
+    shops = make_users('bookshop', counts['bookshops'])
+    school_users = make_users('school', counts['schools'])
+    riders = make_users('rider', counts['riders'])
+    all_users = parents + shops + school_users + riders
+
+    wallets = Wallet.objects.bulk_create([
+        Wallet(user=user, balance=Decimal(rng.randrange(0, 20000)))
+        for user in all_users
+    ])
+    WalletTransaction.objects.bulk_create([
+        WalletTransaction(wallet=wallet, amount=Decimal(rng.randrange(100, 2000)), transaction_type='credit', description='Seed credit')
+        for wallet in wallets if wallet.user.user_type in ('bookshop', 'rider')
+        for _ in range(10)
+    ])
+
+    BookshopProfile.objects.bulk_create([
+        BookshopProfile(user=user, shop_name=f'{user.username} Books', address=user.location, phone_number=user.phone_number, opening_hours='Mon-Sat 8am-6pm')
+        for user in shops
+    ])
+    schools = SchoolProfile.objects.bulk_create([
+        SchoolProfile(user=user, school_name=f'{user.location} School {i}', address=user.location)
+        for i, user in enumerate(school_users)
+    ])
+
+    textbooks = Textbook.objects.bulk_create([
+        Textbook(
+            title=f'{SUBJECTS[i % len(SUBJECTS)]} Grade {i % GRADES_PER_SCHOOL + 1} Book {i}',
+            author=f'Author {i % 40}', grade=str(i % GRADES_PER_SCHOOL + 1), subject=SUBJECTS[i % len(SUBJECTS)],
+        )
+        for i in range(counts['textbooks'])
+    ])
+
+    book_lists = BookList.objects.bulk_create([
+        BookList(school=school, grade=f'Grade {grade}', academic_year='2025')
+        for school in schools for grade in range(1, GRADES_PER_SCHOOL + 1)
+    ])
+    BookList.textbooks.through.objects.bulk_create([
+        BookList.textbooks.through(booklist_id=book_list.id, textbook_id=textbook.id)
+        for book_list in book_lists
+        for textbook in rng.sample(textbooks, min(BOOKS_PER_LIST, len(textbooks)))
+    ])
+    Child.objects.bulk_create([
+        Child(parent=parent, school=rng.choice(schools), grade=f'Grade {rng.randint(1, GRADES_PER_SCHOOL)}')
+        for parent in parents for _ in range(rng.randint(1, 2))
+    ])
+
+    listings = []
+    for i in range(counts['listings']):
+        from_shop = rng.random() < 0.6
+        listings.append(Listing(
+            listed_by=rng.choice(shops if from_shop else parents),
+            textbook=rng.choice(textbooks),
+            listing_type='sell' if from_shop or rng.random() < 0.5 else 'exchange',
+            condition='new' if from_shop else rng.choice(['good', 'fair']),
+            price=Decimal(rng.randrange(150, 1500)),
+            description=f'Seed listing {i}',
+        ))
+    listings = Listing.objects.bulk_create(listings, batch_size=1000)
+
+    conversations = Conversation.objects.bulk_create([
+        Conversation(listing=rng.choice(listings)) for _ in range(counts['conversations'])
+    ])
+    Conversation.participants.through.objects.bulk_create([
+        Conversation.participants.through(conversation_id=conversation.id, user_id=user.id)
+        for conversation in conversations
+        for user in {rng.choice(parents), conversation.listing.listed_by}
+    ])
+    Message.objects.bulk_create([
+        Message(conversation=conversation, sender=conversation.listing.listed_by, content=f'Message {n}')
+        for conversation in conversations for n in range(MESSAGES_PER_CONVERSATION)
+    ], batch_size=2000)
+
+    # Deliveries take sold listings out of the pool
+    sell_listings = [listing for listing in listings if listing.listing_type == 'sell']
+    rng.shuffle(sell_listings)
+    deliveries, orders, links, sold = [], [], [], []
+    for i in range(counts['deliveries']):
+        batch = [sell_listings.pop() for _ in range(min(rng.randint(1, 4), len(sell_listings)))]
+        if not batch:
+            break
+        status = rng.choice(['pending', 'paid', 'shipped', 'delivered'])
+        rider = rng.choice(riders) if status in ('shipped', 'delivered') else None
+        buyer = rng.choice(parents)
+        delivery = Delivery(
+            pickup_location=batch[0].listed_by.location, dropoff_location=buyer.location,
+            tracking_code=f'BENCH-{i:06d}', status=status, transport_cost=Decimal('200.00'),
+            rider=rider, rider_phone=rider.phone_number if rider else None,
+        )
+        deliveries.append(delivery)
+        for listing in batch:
+            order = Order(buyer=buyer, listing=listing, amount_paid=listing.price)
+            orders.append(order)
+            links.append((delivery, order))
+            sold.append(listing.id)
+    Delivery.objects.bulk_create(deliveries)
+    Order.objects.bulk_create(orders, batch_size=1000)
+    Delivery.orders.through.objects.bulk_create([
+        Delivery.orders.through(delivery_id=delivery.id, order_id=order.id) for delivery, order in links
+    ], batch_size=2000)
+    Listing.objects.filter(id__in=sold).update(is_active=False)
+
+    return {
+        'users': len(all_users),
+        'textbooks': len(textbooks),
+        'listings': len(listings),
+        'book_lists': len(book_lists),
+        'children': Child.objects.count(),
+        'conversations': len(conversations),
+        'messages': len(conversations) * MESSAGES_PER_CONVERSATION,
+        'deliveries': len(deliveries),
+        'orders': len(orders),
+        'wallets': len(wallets),
+    }
+
+
+# Benchmarks run against a private in-process cache, so clearing it before
+# each timed call can't flush the shared cache (response-cache versions,
+# replica pins) when run with --in-place
+def private_cache():
+    return override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+        RESPONSE_CACHE_ALIAS='default',
+    )
+
+def _client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+def _timed(calls):
+    """Run each zero-arg call once; return (durations ms, query counts, status codes)."""
+    durations, queries, statuses = [], [], []
+    for call in calls:
+        cache.clear()  # measure the real work, not the response cache (private_cache() only)
+        counter = RequestMetrics()
+        with connection.execute_wrapper(counter.execute_wrapper):
+            start = perf_counter()
+            response = call()
+            durations.append((perf_counter() - start) * 1000)
+        queries.append(counter.queries)
+        statuses.append(response.status_code)
+    return durations, queries, statuses
+
+def _summary(durations, queries, statuses):
+    ordered = sorted(durations)
+    return {
+        'runs': len(durations),
+        'mean_ms': round(sum(durations) / len(durations), 2) if durations else None,
+        'p50_ms': round(percentile(ordered, 50), 2),
+        'p95_ms': round(percentile(ordered, 95), 2),
+        'min_ms': round(ordered[0], 2) if ordered else None,
+        'max_ms': round(ordered[-1], 2) if ordered else None,
+        'queries': max(queries) if queries else None,
+        'status_codes': sorted(set(statuses)),
+    }
+
+def scenarios(repeat, rng):
+    """Yield (name, list of zero-arg calls). Calls for write paths each use fresh rows."""
+    parent = (
+        User.objects.filter(user_type='parent')
+        .annotate(conversation_count=Count('conversations'))
+        .order_by('-conversation_count', 'id')
+        .first()
+    )
+    parent_client = _client(parent)
+    yield 'listing_search', [
+        lambda: parent_client.get('/api/listings/', {'search': rng.choice(SUBJECTS)}) for _ in range(repeat)
+    ]
+
+    book_list_ids = list(BookList.objects.values_list('id', flat=True))
+    anonymous = APIClient()
+    yield 'check_availability', [
+        (lambda pk=rng.choice(book_list_ids): anonymous.get(f'/api/booklists/{pk}/check_availability/'))
+        for _ in range(repeat)
+    ]
+
+    yield 'conversation_list', [lambda: parent_client.get('/api/conversations/') for _ in range(repeat)]
+
+    buyer = User.objects.filter(orders__isnull=False).order_by('id').first()
+    buyer_client = _client(buyer)
+    yield 'delivery_list', [lambda: buyer_client.get('/api/deliveries/') for _ in range(repeat)]
+
+    rider = User.objects.filter(user_type='rider', deliveries_assigned__isnull=False).order_by('id').first()
+    rider_client = _client(rider)
+    yield 'delivery_list_rider', [lambda: rider_client.get('/api/deliveries/') for _ in range(repeat)]
+
+    # Three books from different shops per checkout
+    by_shop = defaultdict(list)
+    for listing_id, shop_id in Listing.objects.filter(is_active=True, listing_type='sell', listed_by__user_type='bookshop').values_list('id', 'listed_by_id'):
+        by_shop[shop_id].append(listing_id)
+    baskets = []
+    for _ in range(repeat):
+        shops = [shop for shop in by_shop if by_shop[shop]]
+        if len(shops) < 3:
+            break
+        baskets.append([str(by_shop[shop].pop()) for shop in rng.sample(shops, 3)])
+    yield 'checkout', [
+        (lambda basket=basket: buyer_client.post('/api/orders/', {'listing_ids': basket}, format='json'))
+        for basket in baskets
+    ]
+
+    shipped = list(Delivery.objects.filter(status='shipped').select_related('rider')[:repeat])
+    yield 'complete_job', [
+        (lambda delivery=delivery: _client(delivery.rider).post(f'/api/deliveries/{delivery.id}/complete_job/'))
+        for delivery in shipped
+    ]
+
+    shop = User.objects.filter(user_type='bookshop').order_by('id').first()
+    shop_client = _client(shop)
+
+    def upload(n):
+        rows = ['title,author,subject,price'] + [
+            f'Upload {n} Book {i},Author {i},{SUBJECTS[i % len(SUBJECTS)]},{rng.randrange(150, 1500)}'
+            for i in range(50)
+        ]
+        csv_file = SimpleUploadedFile(f'stock-{n}.csv', '\n'.join(rows).encode(), content_type='text/csv')
+        return shop_client.post('/api/listings/bulk_upload/', {'file': csv_file}, format='multipart')
+    yield 'bulk_upload_50_rows', [(lambda n=n: upload(n)) for n in range(max(1, repeat // 4))]
+
+def run_scenarios(repeat=20, seed=42):
+    rng = random.Random(seed)
+    results = {}
+    with private_cache():
+        for name, calls in scenarios(repeat, rng):
+            results[name] = _summary(*_timed(calls))
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+    }
@@ -0,0 +1,260 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import Counter, defaultdict, deque
+import msgpack
+from channels.layers import BaseChannelLayer
+
+# Channel layer for several worker processes on one host. Every worker
+# connects to a broker process (`manage.py run_channel_broker`) over a Unix
+# socket and exchanges length-prefixed msgpack frames with it.
+#
+# Each worker connection gets an id that is part of the channel names it
+# creates ("specific.<id>!<random>"), so the broker routes a message for a
+# consumer straight to the worker that owns it, and group_send costs one
+# frame per worker rather than one per channel. Message bodies are packed
+# once by the sender and forwarded by the broker as opaque bytes.
+#
+# Plain channel names (no "!") are queued in the broker and handed to
+# whichever worker asks to receive from them.
+
+DEFAULT_SOCKET = '/tmp/textbook-exchange-channels.sock'
+
+def _pack(frame):
+    body = msgpack.packb(frame, use_bin_type=True)
+    return len(body).to_bytes(4, 'big') + body
+
+async def _read_frame(reader):
+    size = int.from_bytes(await reader.readexactly(4), 'big')
+    return msgpack.unpackb(await reader.readexactly(size), raw=False)
+
+def _connection_id(channel):
+    # "specific.<connection id>!<random>" -> "<connection id>"
+    return channel.split('!', 1)[0].rsplit('.', 1)[-1]
+
+
+class Broker:
+    def __init__(self, capacity=100, group_expiry=86400):
+        self.capacity = capacity
+        self.group_expiry = group_expiry
+        self.workers = {}                  # connection id -> writer
+        self.groups = defaultdict(dict)    # group -> {channel: expires at}
+        self.queues = defaultdict(deque)   # plain channel -> packed messages
+        self.waiters = defaultdict(deque)  # plain channel -> writers waiting to receive
+
+    async def handle(self, reader, writer):
+        connection_id = None
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                op = frame['op']
+                if op == 'hello':
+                    connection_id = frame['id']
+                    self.workers[connection_id] = writer
+                elif op == 'send':
+                    self.send(frame['channel'], frame['message'])
+                elif op == 'group_add':
+                    self.groups[frame['group']][frame['channel']] = time.time() + self.group_expiry
+                elif op == 'group_discard':
+                    members = self.groups.get(frame['group'])
+                    if members is not None:
+                        members.pop(frame['channel'], None)
+                        if not members:
+                            del self.groups[frame['group']]
+                elif op == 'group_send':
+                    self.group_send(frame['group'], frame['message'])
+                elif op == 'receive':
+                    self.waiters[frame['channel']].append(writer)
+                    self._hand_out(frame['channel'])
+                elif op == 'flush':
+                    self.groups.clear()
+                    self.queues.clear()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Worker went away
+            pass
+        except asyncio.CancelledError:
+            # Broker shutting down: forget the worker below, then let the cancellation through
+            raise
+        finally:
+            if connection_id is not None:
+                self.forget(connection_id)
+            writer.close()
+
+    def forget(self, connection_id):
+        # The worker is gone, and so are all of its consumers
+        self.workers.pop(connection_id, None)
+        for group in list(self.groups):
+            members = self.groups[group]
+            for channel in [channel for channel in members if _connection_id(channel) == connection_id]:
+                del members[channel]
+            if not members:
+                del self.groups[group]
+
+    def send(self, channel, message):
+        if '!' in channel:
+            writer = self.workers.get(_connection_id(channel))
+            if writer is not None:
+                writer.write(_pack({'op': 'deliver', 'channels': [channel], 'message': message}))
+            return
+        queue = self.queues[channel]
+        if len(queue) < self.capacity:
+            queue.append(message)
+            self._hand_out(channel)
+
+    def group_send(self, group, message):
+        members = self.groups.get(group)
+        if not members:
+            return
+        now = time.time()
+        by_worker = defaultdict(list)
+        for channel, expires_at in list(members.items()):
+            if expires_at < now:
+                del members[channel]
+            elif '!' in channel:
+                by_worker[_connection_id(channel)].append(channel)
+            else:
+                self.send(channel, message)
+        for connection_id, channels in by_worker.items():
+            writer = self.workers.get(connection_id)
+            if writer is not None:
+                writer.write(_pack({'op': 'deliver', 'channels': channels, 'message': message}))
+
+    def _hand_out(self, channel):
+        queue, waiters = self.queues[channel], self.waiters[channel]
+        while queue and waiters:
+            writer = waiters.popleft()
+            if not writer.is_closing():
+                writer.write(_pack({'op': 'deliver', 'channels': [channel], 'message': queue.popleft()}))
+
+async def serve(path=DEFAULT_SOCKET, **options):
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = Broker(**options)
+    server = await asyncio.start_unix_server(broker.handle, path)
+    os.chmod(path, 0o660)
+    async with server:
+        await server.serve_forever()
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """Client side of the local broker. One connection per event loop."""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=DEFAULT_SOCKET, expiry=60, capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.path = path
+        self.connections = {}   # event loop -> task resolving to (connection id, writer, dispatch task)
+        self.queues = {}        # channel -> asyncio.Queue of (expires at, message)
+        self.receiving = Counter()   # channel -> receive() calls waiting on it
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        for other in [other for other in self.connections if other.is_closed()]:
+            del self.connections[other]
+        task = self.connections.get(loop)
+        if task is None:
+            task = self.connections[loop] = loop.create_task(self._connect())
+        try:
+            return await task
+        except OSError:
+            self.connections.pop(loop, None)
+            raise
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        connection_id = uuid.uuid4().hex
+        writer.write(_pack({'op': 'hello', 'id': connection_id}))
+        dispatch = asyncio.get_running_loop().create_task(self._dispatch(reader))
+        return connection_id, writer, dispatch
+
+    async def _dispatch(self, reader):
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                self._clean_expired()
+                expires_at = time.time() + self.expiry
+                for channel in frame['channels']:
+                    queue = self._queue(channel)
+                    # Over capacity means the consumer isn't keeping up; drop like the other layers
+                    if queue.qsize() < self.get_capacity(channel):
+                        queue.put_nowait((expires_at, msgpack.unpackb(frame['message'], raw=False)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            print(f"Lost connection to channel broker at {self.path}")
+            self.connections.pop(asyncio.get_running_loop(), None)
+
+    def _clean_expired(self):
+        # Messages nobody received within `expiry` (their consumer has gone)
+        # are dropped, and so are the queues they leave behind
+        now = time.time()
+        for channel, queue in list(self.queues.items()):
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+            if queue.empty() and channel not in self.receiving:
+                del self.queues[channel]
+
+    def _queue(self, channel):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue()
+        return queue
+
+    async def _write(self, frame):
+        _, writer, _ = await self._connection()
+        writer.write(_pack(frame))
+        await writer.drain()
+
+    async def new_channel(self, prefix='specific'):
+        connection_id, _, _ = await self._connection()
+        return f'{prefix}.{connection_id}!{uuid.uuid4().hex}'
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        await self._write({'op': 'send', 'channel': channel, 'message': msgpack.packb(message, use_bin_type=True)})
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        if '!' not in channel:
+            await self._write({'op': 'receive', 'channel': channel})
+        queue = self._queue(channel)
+        self.receiving[channel] += 1
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at >= time.time():
+                    return message
+        finally:
+            self.receiving[channel] -= 1
+            if not self.receiving[channel]:
+                del self.receiving[channel]
+            # Consumers stop receiving when they disconnect; don't keep their queues
+            if queue.empty() and channel not in self.receiving and self.queues.get(channel) is queue:
+                del self.queues[channel]
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._write({'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self._write({'op': 'group_discard', 'group': group, 'channel': channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_group_name(group)
+        await self._write({'op': 'group_send', 'group': group, 'message': msgpack.packb(message, use_bin_type=True)})
+
+    async def flush(self):
+        self.queues.clear()
+        await self._write({'op': 'flush'})
+
+    async def close(self):
+        task = self.connections.pop(asyncio.get_running_loop(), None)
+        if task is not None and task.done() and not task.exception():
+            _, writer, dispatch = task.result()
+            dispatch.cancel()
+            writer.close()
@@ -1,17 +1,37 @@
+import asyncio
 import json
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db.models import Subquery
 from .models import Conversation, Message
+from . import notifications, presence
 
 
-User = get_user_model()
-
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    One chat room. Besides chat messages ({"message": ...}), clients send
+        {"type": "read", "message_id": ...}     read everything up to this message
+        {"type": "typing", "is_typing": true}
+    and receive "message", "read", "typing" and "presence" events. Read markers
+    are collected for READ_RECEIPT_DELAY seconds and applied as one UPDATE;
+    typing and presence never touch the database (api/presence.py).
+    """
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.room_group_name = f'chat_{self.room_id}'
-        
+        self.user = self.scope.get('user')
+        self.read_up_to = None
+        self.read_flush = None
+        self.joined = False
+
+        # Only the conversation's participants may listen in or mark messages read
+        if not self.identified or not await self.is_participant():
+            await self.close()
+            return
+        self.joined = True
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
@@ -19,43 +39,131 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+        members = await presence.store().join(self.room_id, str(self.user.id))
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'chat_presence', 'user_ids': members})
+
     async def disconnect(self, close_code):
+        if not self.joined:
+            return
+        if self.read_flush is not None:
+            self.read_flush.cancel()
+            await self.flush_read()
+
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
+        members = await presence.store().leave(self.room_id, str(self.user.id))
+        await self.channel_layer.group_send(self.room_group_name, {'type': 'chat_presence', 'user_ids': members})
+
+    @property
+    def identified(self):
+        return self.user is not None and self.user.is_authenticated
+
     async def receive(self, text_data):
         data = json.loads(text_data)
+        kind = data.get('type', 'message')
+
+        if kind == 'read':
+            self.queue_read(data.get('message_id'))
+            return
+        if kind == 'typing':
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_typing',
+                'user_id': str(self.user.id),
+                'is_typing': bool(data.get('is_typing')),
+            })
+            return
+
+        # The sender is whoever this socket authenticated as, never what the frame claims
         message = data['message']
-        sender_id = data['sender_id']
+        sender_id = str(self.user.id)
 
-        await self.save_message(sender_id, message)
+        saved, participant_ids = await self.save_message(message)
 
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
                 'message': message,
-                'sender_id': sender_id
+                'sender_id': sender_id,
+                # Clients sync history from the last id they saw (MessageListView ?since=)
+                'id': str(saved.id),
+                'timestamp': saved.timestamp.isoformat(),
             }
         )
+        await notifications.publish_now(
+            [user_id for user_id in participant_ids if user_id != self.user.id], 'message',
+            conversation_id=self.room_id, message_id=str(saved.id), sender_id=sender_id, preview=message[:100],
+        )
 
     async def chat_message(self, event):
-        message = event['message']
-        sender_id = event['sender_id']
-
         await self.send(text_data=json.dumps({
-            'message': message,
-            'sender_id': sender_id
+            'type': 'message',
+            'message': event['message'],
+            'sender_id': event['sender_id'],
+            'id': event.get('id'),
+            'timestamp': event.get('timestamp'),
         }))
 
+    async def chat_read(self, event):
+        await self.send(text_data=json.dumps({'type': 'read', 'user_id': event['user_id'], 'message_id': event['message_id']}))
+
+    async def chat_typing(self, event):
+        await self.send(text_data=json.dumps({'type': 'typing', 'user_id': event['user_id'], 'is_typing': event['is_typing']}))
+
+    async def chat_presence(self, event):
+        await self.send(text_data=json.dumps({'type': 'presence', 'user_ids': event['user_ids']}))
+
+    def queue_read(self, message_id):
+        try:
+            message_id = str(uuid.UUID(str(message_id)))
+        except ValueError:
+            return
+        # Only the latest marker matters; it covers everything before it
+        self.read_up_to = message_id
+        if self.read_flush is None:
+            self.read_flush = asyncio.ensure_future(self.flush_read_later())
+
+    async def flush_read_later(self):
+        await asyncio.sleep(settings.READ_RECEIPT_DELAY)
+        self.read_flush = None
+        await self.flush_read()
+
+    async def flush_read(self):
+        message_id, self.read_up_to = self.read_up_to, None
+        if message_id is not None and await self.mark_read(message_id):
+            await self.channel_layer.group_send(self.room_group_name, {
+                'type': 'chat_read',
+                'user_id': str(self.user.id),
+                'message_id': message_id,
+            })
+
+    @database_sync_to_async
+    def is_participant(self):
+        try:
+            uuid.UUID(self.room_id)
+        except ValueError:
+            return False
+        return Conversation.participants.through.objects.filter(conversation_id=self.room_id, user_id=self.user.id).exists()
+
+    @database_sync_to_async
+    def mark_read(self, message_id):
+        # One UPDATE for everything the others sent up to the marker
+        up_to = Message.objects.filter(id=message_id, conversation_id=self.room_id).values('timestamp')
+        return (
+            Message.objects.filter(conversation_id=self.room_id, is_read=False, timestamp__lte=Subquery(up_to))
+            .exclude(sender_id=self.user.id)
+            .update(is_read=True)
+        )
+
     @database_sync_to_async
-    def save_message(self, sender_id, message):
-        user = User.objects.get(id=sender_id)
+    def save_message(self, message):
         conversation = Conversation.objects.get(id=self.room_id)
-        Message.objects.create(conversation=conversation, sender=user, content=message)
+        saved = Message.objects.create(conversation=conversation, sender=self.user, content=message)
         conversation.save()
+        return saved, list(conversation.participants.values_list('id', flat=True))
 
 class DeliveryConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -94,4 +202,28 @@ class DeliveryConsumer(AsyncWebsocketConsumer):
             'longitude': event['longitude'],
             'status': event['status'],
             'heading': event.get('heading', 0)
-        }))
\ No newline at end of file
+        }))
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """One socket per signed-in client for everything api/notifications.py publishes."""
+
+    async def connect(self):
+        user = self.scope.get('user')
+        self.joined = []
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.joined.append(notifications.user_group(user.id))
+        if user.user_type == 'rider':
+            self.joined.append(notifications.RIDERS_GROUP)
+        for group in self.joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        for group in self.joined:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def notify(self, event):
+        await self.send(text_data=json.dumps({'type': event['event'], **event['data']}))
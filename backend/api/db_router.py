@@ -0,0 +1,67 @@
+import hashlib
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Read-replica routing. ReplicaRoutingMiddleware (api/middleware.py) opens a
+# RoutingState for every request. Reads in GET/HEAD/OPTIONS requests go to
+# the 'replica' alias; everything else, and every read after a write in the
+# same request, goes to the primary. A client that has just written is
+# pinned to the primary for REPLICA_PIN_SECONDS so it reads its own writes
+# while the replica catches up.
+#
+# Code outside a request (management commands, background tasks, websocket
+# consumers) always uses the primary, and so does the test suite unless a test
+# turns REPLICA_ROUTING on.
+
+REPLICA_ALIAS = 'replica'
+PIN_PREFIX = 'db-pin:'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('db_routing', default=None)
+
+class RoutingState:
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+def has_replica():
+    return getattr(settings, 'REPLICA_ROUTING', True) and REPLICA_ALIAS in settings.DATABASES
+
+def begin(use_replica):
+    state = RoutingState(use_replica)
+    return state, _state.set(state)
+
+def end(token):
+    _state.reset(token)
+
+def pin_key(request):
+    # Keyed on the bearer token so the check needs no authentication query
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    return PIN_PREFIX + hashlib.sha256(authorization.encode()).hexdigest()
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not has_replica():
+            return None
+        state = _state.get()
+        if state is not None and state.use_replica and not state.wrote:
+            return REPLICA_ALIAS
+        # Explicit, or Django falls back to the alias the instance was read from
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_ALIAS
@@ -0,0 +1,147 @@
+import csv
+import tempfile
+import uuid
+from datetime import datetime
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from .archival import ORDER_DELIVERY
+from .models import ArchivedRecord, Listing, Order, WalletTransaction
+
+# Exports stream straight from a server-side cursor (.iterator()) into the
+# response, so memory use doesn't depend on how many rows a shop has.
+
+CHUNK_SIZE = 2000
+FILE_CHUNK_BYTES = 64 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def inventory_rows(user):
+    header = ['Listing ID', 'Title', 'Author', 'ISBN', 'Grade', 'Subject', 'Type', 'Condition', 'Price', 'Views', 'Listed On']
+    rows = (
+        Listing.objects.filter(listed_by=user, is_active=True)
+        .order_by('created_at')
+        .values_list(
+            'id', 'textbook__title', 'textbook__author', 'textbook__isbn', 'textbook__grade',
+            'textbook__subject', 'listing_type', 'condition', 'price', 'views', 'created_at'
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    return header, rows
+
+def order_rows(user):
+    header = ['Order ID', 'Date', 'Title', 'Amount Paid', 'Buyer', 'Tracking Code', 'Delivery Status']
+    rows = (
+        Order.objects.filter(listing__listed_by=user)
+        .order_by('created_at')
+        .values_list(
+            'id', 'created_at', 'listing__textbook__title', 'amount_paid', 'buyer__username',
+            'delivery__tracking_code', 'delivery__status'
+        )
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    return header, _with_archived_deliveries(rows)
+
+def _with_archived_deliveries(rows):
+    # Orders whose delivery has been archived take its tracking code and
+    # status from the archive, one lookup per chunk
+    while True:
+        batch = list(islice(rows, CHUNK_SIZE))
+        if not batch:
+            return
+        missing = [row[0] for row in batch if row[6] is None]
+        archived = {}
+        if missing:
+            archived = dict(
+                ArchivedRecord.objects.filter(model=ORDER_DELIVERY, object_id__in=missing).values_list('object_id', 'data')
+            )
+        for row in batch:
+            delivery = archived.get(row[0])
+            yield row[:5] + (delivery['tracking_code'], delivery['status']) if delivery else row
+
+def ledger_rows(user):
+    header = ['Transaction ID', 'Date', 'Type', 'Amount', 'Description']
+    rows = (
+        WalletTransaction.objects.filter(wallet__user=user)
+        .order_by('timestamp')
+        .values_list('id', 'timestamp', 'transaction_type', 'amount', 'description')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    return header, rows
+
+EXPORTS = {
+    'inventory': inventory_rows,
+    'orders': order_rows,
+    'ledger': ledger_rows,
+}
+
+class _Echo:
+    # csv.writer only needs write(); hand each formatted line straight back
+    def write(self, value):
+        return value
+
+def _csv_lines(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+def _xlsx_value(value):
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+def _xlsx_chunks(header, rows, title):
+    # Write-only workbooks spool rows to a temp file instead of keeping cells in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append([_xlsx_value(value) for value in row])
+
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while True:
+            chunk = spool.read(FILE_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+def _as_async(iterator, batch_size=500):
+    # Under ASGI Django would list() a sync iterator before sending it, so pull
+    # it in batches on the thread that owns the DB connection instead.
+    async def chunks():
+        def next_batch():
+            return list(islice(iterator, batch_size))
+
+        while True:
+            batch = await sync_to_async(next_batch)()
+            if not batch:
+                break
+            for part in batch:
+                yield part
+    return chunks()
+
+def export_response(request, kind, user, file_format='csv'):
+    header, rows = EXPORTS[kind](user)
+    if file_format == 'xlsx':
+        content = _xlsx_chunks(header, rows, title=kind.capitalize())
+    else:
+        content = _csv_lines(header, rows)
+
+    if isinstance(request, ASGIRequest):
+        content = _as_async(content)
+
+    filename = f"{kind}-{timezone.localdate():%Y-%m-%d}.{file_format}"
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,189 @@
+from collections import namedtuple, defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, When, F, Value, DecimalField, IntegerField, Sum, Count, Min, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import Wallet, WalletTransaction, WalletDailyRollup, Order
+
+# All wallet balance changes go through here. Balances are only ever changed
+# with single UPDATE statements (balance = balance + x), debits carry a
+# `balance >= x` guard, and the WalletTransaction rows are inserted in the
+# same transaction, so concurrent writers can't lose updates or overdraw.
+
+LedgerEntry = namedtuple('LedgerEntry', ['user_id', 'amount', 'transaction_type', 'description'])
+
+class InsufficientFunds(Exception):
+    pass
+
+def get_wallet_ids(user_ids):
+    """Map user id -> wallet id, creating any missing wallets in one insert."""
+    user_ids = set(user_ids)
+    wallet_ids = dict(Wallet.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    missing = user_ids - wallet_ids.keys()
+    if missing:
+        Wallet.objects.bulk_create([Wallet(user_id=user_id) for user_id in missing], ignore_conflicts=True)
+        wallet_ids.update(Wallet.objects.filter(user_id__in=missing).values_list('user_id', 'id'))
+    return wallet_ids
+
+def post_entries(entries):
+    """
+    Apply a batch of credits/debits atomically. Credits are applied with one
+    UPDATE for all wallets; each debited wallet gets a guarded UPDATE and the
+    whole batch is rolled back with InsufficientFunds if any guard fails.
+    Returns the list of created WalletTransaction rows.
+    """
+    entries = [entry for entry in entries if entry.amount]
+    if not entries:
+        return []
+
+    for entry in entries:
+        if entry.amount < 0:
+            raise ValueError("Ledger amounts must be positive; use a debit entry instead.")
+        if entry.transaction_type not in ('credit', 'debit'):
+            raise ValueError(f"Unknown transaction type: {entry.transaction_type}")
+
+    net = defaultdict(Decimal)
+    for entry in entries:
+        amount = Decimal(str(entry.amount))
+        net[entry.user_id] += amount if entry.transaction_type == 'credit' else -amount
+
+    now = timezone.now()
+    with transaction.atomic():
+        wallet_ids = get_wallet_ids(net.keys())
+
+        # Take the row locks in id order up front so two batches touching the
+        # same wallets in a different order can't deadlock
+        if len(wallet_ids) > 1:
+            list(Wallet.objects.select_for_update().filter(id__in=wallet_ids.values()).order_by('id').values_list('id', flat=True))
+
+        credits = {wallet_ids[user_id]: delta for user_id, delta in net.items() if delta > 0}
+        debits = {wallet_ids[user_id]: -delta for user_id, delta in net.items() if delta < 0}
+
+        if credits:
+            Wallet.objects.filter(id__in=credits.keys()).update(
+                balance=F('balance') + Case(
+                    *[When(id=wallet_id, then=Value(amount)) for wallet_id, amount in credits.items()],
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ),
+                last_updated=now,
+            )
+
+        for wallet_id, amount in debits.items():
+            updated = Wallet.objects.filter(id=wallet_id, balance__gte=amount).update(
+                balance=F('balance') - amount,
+                last_updated=now,
+            )
+            if not updated:
+                raise InsufficientFunds("Insufficient funds")
+
+        rows = WalletTransaction.objects.bulk_create([
+            WalletTransaction(
+                wallet_id=wallet_ids[entry.user_id],
+                amount=entry.amount,
+                transaction_type=entry.transaction_type,
+                description=entry.description,
+            )
+            for entry in entries
+        ])
+        _add_to_rollups(rows, timezone.localdate(now))
+        return rows
+
+def _add_to_rollups(rows, day):
+    # wallet id -> [credit_total, debit_total, credit_count, debit_count]
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0'), 0, 0])
+    for row in rows:
+        offset = 0 if row.transaction_type == 'credit' else 1
+        totals[row.wallet_id][offset] += Decimal(str(row.amount))
+        totals[row.wallet_id][offset + 2] += 1
+
+    WalletDailyRollup.objects.bulk_create(
+        [WalletDailyRollup(wallet_id=wallet_id, day=day) for wallet_id in totals],
+        ignore_conflicts=True,
+    )
+
+    def per_wallet(index, output_field):
+        return Case(
+            *[When(wallet_id=wallet_id, then=Value(values[index])) for wallet_id, values in totals.items()],
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    money = DecimalField(max_digits=12, decimal_places=2)
+    WalletDailyRollup.objects.filter(day=day, wallet_id__in=totals.keys()).update(
+        credit_total=F('credit_total') + per_wallet(0, money),
+        debit_total=F('debit_total') + per_wallet(1, money),
+        credit_count=F('credit_count') + per_wallet(2, IntegerField()),
+        debit_count=F('debit_count') + per_wallet(3, IntegerField()),
+        updated_at=timezone.now(),
+    )
+
+def rebuild_rollups(wallet_ids=None):
+    """Recompute daily rollups from the transaction history."""
+    transactions = WalletTransaction.objects.all()
+    rollups = WalletDailyRollup.objects.all()
+    if wallet_ids is not None:
+        transactions = transactions.filter(wallet_id__in=wallet_ids)
+        rollups = rollups.filter(wallet_id__in=wallet_ids)
+
+    daily = (
+        transactions.annotate(day=TruncDate('timestamp'))
+        .values('wallet_id', 'day')
+        .annotate(
+            credit_total=Sum('amount', filter=Q(transaction_type='credit'), default=0),
+            debit_total=Sum('amount', filter=Q(transaction_type='debit'), default=0),
+            credit_count=Count('id', filter=Q(transaction_type='credit')),
+            debit_count=Count('id', filter=Q(transaction_type='debit')),
+        )
+        .order_by()
+    )
+
+    with transaction.atomic():
+        rollups.delete()
+        created = WalletDailyRollup.objects.bulk_create(
+            [WalletDailyRollup(**row) for row in daily.iterator(chunk_size=2000)],
+            batch_size=1000,
+        )
+    return len(created)
+
+DEFAULT_RIDER_FEE = Decimal('200.00')
+
+def settle_delivery(delivery):
+    """
+    Pay the rider's fee and each seller's sales for a delivered order batch.
+    Seller totals come from one aggregate query, so the cost doesn't grow
+    with the number of books in the delivery.
+    """
+    entries = []
+    if delivery.rider_id:
+        amount_to_pay = delivery.transport_cost
+        if amount_to_pay <= 0:
+            amount_to_pay = DEFAULT_RIDER_FEE
+        entries.append(LedgerEntry(
+            delivery.rider_id, amount_to_pay, 'credit',
+            f"Delivery Fee for Order #{delivery.tracking_code}"
+        ))
+
+    seller_totals = (
+        Order.objects.filter(delivery=delivery)
+        .values('listing__listed_by')
+        .annotate(total=Sum('amount_paid'), books=Count('id'), title=Min('listing__textbook__title'))
+        .order_by()
+    )
+    for row in seller_totals:
+        if row['books'] == 1:
+            description = f"Sale of '{row['title']}'"
+        else:
+            description = f"Sale of {row['books']} books (Order #{delivery.tracking_code})"
+        entries.append(LedgerEntry(row['listing__listed_by'], row['total'], 'credit', description))
+
+    return post_entries(entries)
+
+def credit(user, amount, description):
+    return post_entries([LedgerEntry(user.id, amount, 'credit', description)])
+
+def debit(user, amount, description):
+    """Withdraw from a user's wallet. Returns the new balance."""
+    with transaction.atomic():
+        post_entries([LedgerEntry(user.id, amount, 'debit', description)])
+        return Wallet.objects.values_list('balance', flat=True).get(user=user)
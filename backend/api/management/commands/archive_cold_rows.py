@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from api import archival
+
+
+class Command(BaseCommand):
+    help = (
+        "Move old messages, finished deliveries and dead listings into the archive table. "
+        "Run nightly (e.g. from cron); ages are set by the ARCHIVE_*_AFTER_DAYS settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that would be archived.")
+
+    def handle(self, *args, **options):
+        counts = archival.archive_cold_rows(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        verb = "Would archive" if options['dry_run'] else "Archived"
+        for name, count in counts.items():
+            self.stdout.write(f"{verb} {count} {name}.")
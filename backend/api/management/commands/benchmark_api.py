@@ -0,0 +1,69 @@
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from api import benchmarks
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic data and time the API hot paths in-process, printing a JSON report. "
+        "Runs against a throwaway test database unless --in-place is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for the seeded row counts.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs per scenario.")
+        parser.add_argument('--output', default='-', help="Write the report to this file instead of stdout.")
+        parser.add_argument(
+            '--in-place', action='store_true',
+            help="Use the configured database inside a transaction that is rolled back afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options['in_place']:
+            report = self.run_in_transaction(options)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                report = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        text = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(text + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def run_in_transaction(self, options):
+        report = None
+        try:
+            with transaction.atomic():
+                report = self.run(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        return report
+
+    def run(self, options):
+        # Seeding saves cached models too; keep their version bumps off the shared cache
+        with benchmarks.private_cache():
+            return self.seed_and_time(options)
+
+    def seed_and_time(self, options):
+        counts = benchmarks.seed(scale=options['scale'], seed=options['seed'])
+        return {
+            'environment': benchmarks.environment(),
+            'scale': options['scale'],
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'rows': counts,
+            'scenarios': benchmarks.run_scenarios(repeat=options['repeat'], seed=options['seed']),
+        }
@@ -0,0 +1,90 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from api import benchmarks
+from api.models import User, Textbook, Listing
+from api.renderers import ORJSONRenderer
+from api.serializers import ListingSerializer, ListingRowSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare listing feed serialization throughput (rows/sec): ModelSerializer + json vs .values() rows + orjson. "
+        "Runs against a throwaway test database unless --in-place is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--in-place', action='store_true',
+            help="Use the configured database inside a transaction that is rolled back afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options['in_place']:
+            try:
+                with transaction.atomic():
+                    self.seed_and_run(options)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                self.seed_and_run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed_and_run(self, options):
+        # Seeding saves cached models too; keep their version bumps off the shared cache
+        with benchmarks.private_cache():
+            listing_ids = self.seed(options['rows'])
+            self.run(listing_ids, options['repeat'])
+
+    def seed(self, rows):
+        sellers = User.objects.bulk_create([
+            User(email=f'bench-seller{i}@example.com', username=f'bench-seller{i}', user_type='bookshop', location='Nyeri')
+            for i in range(20)
+        ])
+        textbooks = Textbook.objects.bulk_create([
+            Textbook(title=f'Bench Book {i}', author='Author', grade=str(i % 8 + 1), subject='Maths')
+            for i in range(200)
+        ])
+        listings = Listing.objects.bulk_create([
+            Listing(
+                listed_by=sellers[i % len(sellers)], textbook=textbooks[i % len(textbooks)],
+                listing_type='sell', condition='good', price=Decimal('350.00'), description='Bench listing'
+            )
+            for i in range(rows)
+        ], batch_size=1000)
+        return [listing.pk for listing in listings]
+
+    def run(self, listing_ids, repeat):
+        request = Request(APIRequestFactory().get('/api/listings/'))
+        # Only the seeded rows, so rows/sec matches what was serialized even with --in-place
+        listings = Listing.objects.filter(pk__in=listing_ids, is_active=True).order_by('-created_at')
+        rows = len(listing_ids)
+
+        def full():
+            data = ListingSerializer(listings.select_related('listed_by', 'textbook'), many=True, context={'request': request}).data
+            return JSONRenderer().render(data)
+
+        def lean():
+            return ORJSONRenderer().render(ListingRowSerializer(listings, context={'request': request}).data)
+
+        for label, func in (('ListingSerializer + json', full), ('ListingRowSerializer + orjson', lean)):
+            func()  # warm up
+            start = time.perf_counter()
+            for _ in range(repeat):
+                size = len(func())
+            elapsed = (time.perf_counter() - start) / repeat
+            self.stdout.write(f"{label:32} {rows / elapsed:12,.0f} rows/sec  {elapsed * 1000:8.1f} ms  {size / 1024:8.0f} KiB")
@@ -0,0 +1,65 @@
+import json
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+from api import ws_loadtest
+
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the chat and delivery tracking websockets and report fan-out latency "
+        "(p50/p95/p99) and messages/sec. "
+        "communicator mode runs the consumers in-process against a throwaway database; "
+        "socket mode connects to a running server that shares this project's database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=['communicator', 'socket'], default='communicator')
+        parser.add_argument('--url', default='ws://127.0.0.1:8000', help="Server base URL for socket mode.")
+        parser.add_argument(
+            '--layer', choices=['memory', 'local', 'redis', 'configured'], default='memory',
+            help="Channel layer for communicator mode: one of CHANNEL_LAYER_OPTIONS, or CHANNEL_LAYERS as configured.",
+        )
+        parser.add_argument('--deliveries', type=int, default=5)
+        parser.add_argument('--riders', type=int, default=1, help="Riders per delivery.")
+        parser.add_argument('--watchers', type=int, default=10, help="Watchers per delivery.")
+        parser.add_argument('--rooms', type=int, default=5)
+        parser.add_argument('--chatters', type=int, default=4, help="Chatters per room.")
+        parser.add_argument('--location-rate', type=float, default=1.0, help="Location updates/sec per rider.")
+        parser.add_argument('--chat-rate', type=float, default=0.2, help="Messages/sec per chatter.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to stream for.")
+        parser.add_argument('--output', default='-', help="Write the report to this file instead of stdout.")
+
+    def handle(self, *args, **options):
+        load = {
+            name: options[name] for name in (
+                'deliveries', 'riders', 'watchers', 'rooms', 'chatters', 'location_rate', 'chat_rate', 'duration'
+            )
+        }
+
+        if options['mode'] == 'socket':
+            # The server reads the fixtures, so they go in the real database
+            results = async_to_sync(ws_loadtest.run)(ws_loadtest.socket_factory(options['url']), **load)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                if options['layer'] == 'configured':
+                    layers = settings.CHANNEL_LAYERS
+                else:
+                    layers = {'default': settings.CHANNEL_LAYER_OPTIONS[options['layer']]}
+                with override_settings(CHANNEL_LAYERS=layers):
+                    results = async_to_sync(ws_loadtest.run)(ws_loadtest.communicator_factory(), **load)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {'mode': options['mode'], 'layer': options['layer'] if options['mode'] == 'communicator' else None, **load, 'results': results}
+        text = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(text)
+        else:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(text + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.swap_matching import propose_all
+
+
+class Command(BaseCommand):
+    help = "Run swap matchmaking for every parent with exchange listings and store new proposals."
+
+    def handle(self, *args, **options):
+        proposed = propose_all()
+        self.stdout.write(self.style.SUCCESS(f"Proposed {proposed} swap(s)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.payment_callbacks import process_pending_callbacks
+
+
+class Command(BaseCommand):
+    help = "Process payment callbacks still pending in the inbox (e.g. after a worker restart)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = process_pending_callbacks(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {count} payment callback(s)."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from api import archival
+
+
+class Command(BaseCommand):
+    help = "Permanently delete archived rows older than ARCHIVE_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows that would be deleted.")
+
+    def handle(self, *args, **options):
+        count = archival.purge_archive(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"Would purge {count} archived row(s).")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Purged {count} archived row(s)."))
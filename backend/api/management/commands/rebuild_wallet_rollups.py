@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from api.ledger import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-wallet daily earnings rollups from WalletTransaction history."
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} daily rollup row(s)."))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+from api.models import User, Review
+
+
+class Command(BaseCommand):
+    help = "Recompute every seller's rating, rating_sum and review_count from their reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Report drifted users without fixing them.")
+
+    def handle(self, *args, **options):
+        stats = {
+            row['seller_id']: (row['total'], row['count'])
+            for row in Review.objects.values('seller_id').annotate(total=Sum('rating'), count=Count('id')).order_by()
+        }
+
+        drifted = []
+        users = User.objects.only('id', 'rating', 'rating_sum', 'review_count').iterator(chunk_size=2000)
+        for user in users:
+            total, count = stats.get(user.id, (0, 0))
+            rating = total / count if count else 0.0
+            if (user.rating_sum, user.review_count) != (total, count) or abs(user.rating - rating) > 1e-9:
+                user.rating_sum, user.review_count, user.rating = total, count, rating
+                drifted.append(user)
+
+        if drifted and not options['dry_run']:
+            User.objects.bulk_update(drifted, ['rating', 'rating_sum', 'review_count'], batch_size=500)
+
+        verb = "Found" if options['dry_run'] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {len(drifted)} user(s) with drifted ratings."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from api.recommendations import refresh_all
+
+
+class Command(BaseCommand):
+    help = "Rebuild every parent's recommended listings. Run periodically (e.g. hourly from cron)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        total = refresh_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} recommendation(s)."))
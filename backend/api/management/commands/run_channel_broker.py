@@ -0,0 +1,19 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from api import channel_layers
+
+
+class Command(BaseCommand):
+    help = "Run the local channel broker that CHANNEL_LAYER=local workers on this host connect to."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'CHANNEL_BROKER_SOCKET', channel_layers.DEFAULT_SOCKET))
+        parser.add_argument('--capacity', type=int, default=100, help="Max queued messages per plain channel.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Channel broker listening on {options['socket']}")
+        try:
+            asyncio.run(channel_layers.serve(options['socket'], capacity=options['capacity']))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,156 @@
+import threading
+import traceback
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from django.conf import settings
+from django.utils import timezone
+
+# Per-request instrumentation. RequestMetricsMiddleware (api/middleware.py)
+# opens a RequestMetrics for each request, counts queries and DB time via a
+# connection execute_wrapper, and times serializer .data via measure_serializer().
+# Finished requests go into a rolling per-view window that the admin-only
+# /api/metrics/ endpoint summarises.
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+_current = ContextVar('request_metrics', default=None)
+
+class RequestMetrics:
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self._serializer_depth = 0
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = perf_counter() - start
+            self.queries += 1
+            self.db_time += duration
+            threshold = getattr(settings, 'SLOW_QUERY_MS', None)
+            if threshold is not None and duration * 1000 >= threshold:
+                record_slow_query(sql, duration)
+
+def begin():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+def end(token):
+    _current.reset(token)
+
+@contextmanager
+def measure_serializer():
+    """Add the time spent inside the block to the current request's serializer time."""
+    metrics = _current.get()
+    if metrics is None or metrics._serializer_depth:
+        # Not in a request, or already inside an outer serializer
+        yield
+        return
+    metrics._serializer_depth += 1
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_time += perf_counter() - start
+        metrics._serializer_depth -= 1
+
+def instrument_serializers():
+    """Wrap DRF's BaseSerializer.data so every serializer reports its time."""
+    from rest_framework.serializers import BaseSerializer
+
+    original = BaseSerializer.data
+    if getattr(original.fget, 'instrumented', False):
+        return
+
+    def data(self):
+        with measure_serializer():
+            return original.fget(self)
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+
+class MetricsStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(self._window)
+        self.slow_queries = deque(maxlen=50)
+
+    def _window(self):
+        return deque(maxlen=getattr(settings, 'REQUEST_METRICS_WINDOW', 1000))
+
+    def record(self, view_name, total, metrics):
+        sample = (total * 1000, metrics.queries, metrics.db_time * 1000, metrics.serializer_time * 1000)
+        with self.lock:
+            self.samples[view_name].append(sample)
+
+    def add_slow_query(self, entry):
+        with self.lock:
+            self.slow_queries.append(entry)
+
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.slow_queries.clear()
+
+    def snapshot(self):
+        with self.lock:
+            samples = {view: list(window) for view, window in self.samples.items()}
+            slow_queries = list(self.slow_queries)
+
+        views = {}
+        for view, rows in sorted(samples.items()):
+            latencies = sorted(row[0] for row in rows)
+            count = len(rows)
+            buckets = {}
+            for bound in LATENCY_BUCKETS_MS:
+                buckets[f'le_{bound}ms'] = sum(1 for latency in latencies if latency <= bound)
+            buckets['le_inf'] = count
+            views[view] = {
+                'count': count,
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'max_ms': round(latencies[-1], 2),
+                'avg_queries': round(sum(row[1] for row in rows) / count, 2),
+                'max_queries': max(row[1] for row in rows),
+                'avg_db_ms': round(sum(row[2] for row in rows) / count, 2),
+                'avg_serializer_ms': round(sum(row[3] for row in rows) / count, 2),
+                'latency_histogram': buckets,
+            }
+        return {'views': views, 'slow_queries': slow_queries}
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+store = MetricsStore()
+
+def record_slow_query(sql, duration):
+    # Keep only our own frames; the Django/DRF ones are the same every time
+    stack = [
+        line.strip() for line in traceback.format_stack()
+        if 'site-packages' not in line and '/lib/python' not in line and __file__ not in line
+    ]
+    entry = {
+        'timestamp': timezone.now().isoformat(),
+        'duration_ms': round(duration * 1000, 2),
+        'sql': sql,
+        'stack': stack,
+    }
+    print(f"Slow query ({entry['duration_ms']} ms): {sql}\n" + '\n'.join(stack))
+    store.add_slow_query(entry)
+
+def server_timing(total, metrics):
+    return ', '.join([
+        f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+        f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
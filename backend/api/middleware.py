@@ -1,8 +1,14 @@
+from contextlib import ExitStack
+from time import perf_counter
 from urllib.parse import parse_qs
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connections
 from rest_framework_simplejwt.tokens import AccessToken
 from api.models import User
+from api import db_router, metrics
 
 @database_sync_to_async
 def get_user(token_key):
@@ -27,4 +33,58 @@ class TokenAuthMiddleware:
         else:
             scope['user'] = AnonymousUser()
             
-        return await self.inner(scope, receive, send)
\ No newline at end of file
+        return await self.inner(scope, receive, send)
+
+class RequestMetricsMiddleware:
+    """
+    Record query count, DB time, serializer time and total latency for each
+    request, tagged by the resolved view name, and report them in a
+    Server-Timing header.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        request_metrics, token = metrics.begin()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(request_metrics.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            metrics.end(token)
+
+        total = perf_counter() - request_metrics.start
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else 'unresolved'
+        metrics.store.record(view_name, total, request_metrics)
+        if getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', True):
+            response['Server-Timing'] = metrics.server_timing(total, request_metrics)
+        return response
+
+class ReplicaRoutingMiddleware:
+    """
+    Send the reads of safe requests to the read replica (see api/db_router.py),
+    unless this client wrote something in the last REPLICA_PIN_SECONDS.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not db_router.has_replica():
+            return self.get_response(request)
+
+        key = db_router.pin_key(request)
+        safe = request.method in db_router.SAFE_METHODS
+        state, token = db_router.begin(use_replica=safe and not (key and cache.get(key)))
+        try:
+            response = self.get_response(request)
+        finally:
+            db_router.end(token)
+
+        if state.wrote and not safe and key:
+            cache.set(key, True, getattr(settings, 'REPLICA_PIN_SECONDS', 5))
+        return response
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:15
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    WalletTransaction = apps.get_model('api', 'WalletTransaction')
+    WalletDailyRollup = apps.get_model('api', 'WalletDailyRollup')
+    daily = (
+        WalletTransaction.objects.annotate(day=TruncDate('timestamp'))
+        .values('wallet_id', 'day')
+        .annotate(
+            credit_total=Sum('amount', filter=Q(transaction_type='credit'), default=0),
+            debit_total=Sum('amount', filter=Q(transaction_type='debit'), default=0),
+            credit_count=Count('id', filter=Q(transaction_type='credit')),
+            debit_count=Count('id', filter=Q(transaction_type='debit')),
+        )
+        .order_by()
+    )
+    WalletDailyRollup.objects.bulk_create([WalletDailyRollup(**row) for row in daily], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_tracking_code_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDailyRollup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('is_deleted', models.BooleanField(db_index=True, default=False)),
+                ('day', models.DateField()),
+                ('credit_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('debit_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('credit_count', models.IntegerField(default=0)),
+                ('debit_count', models.IntegerField(default=0)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='api.wallet')),
+            ],
+            options={
+                'unique_together': {('wallet', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
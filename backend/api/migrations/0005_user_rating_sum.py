@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:28
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_sums(apps, schema_editor):
+    User = apps.get_model('api', 'User')
+    Review = apps.get_model('api', 'Review')
+    stats = Review.objects.values('seller_id').annotate(total=Sum('rating'), count=Count('id')).order_by()
+    for row in stats:
+        User.objects.filter(pk=row['seller_id']).update(
+            rating_sum=row['total'],
+            review_count=row['count'],
+            rating=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_wallet_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_archived_records'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'timestamp', 'id'], name='message_history_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_thread_idx',
+        ),
+    ]
@@ -1,8 +1,24 @@
 import uuid
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from django.db.models import Avg
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import Cast
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from . import response_cache
+
+class SoftDeleteQuerySet(models.QuerySet):
+    def soft_delete(self):
+        # update() skips signals, so invalidate cached responses here
+        count = self.update(is_deleted=True, updated_at=timezone.now())
+        response_cache.bump(self.model)
+        return count
+
+class SoftDeleteManager(models.Manager.from_queryset(SoftDeleteQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
 
 class BaseModel(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -10,9 +26,18 @@ class BaseModel(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_deleted = models.BooleanField(default=False, db_index=True) # Soft delete
 
+    # `objects` hides soft-deleted rows (and so do reverse relations and DRF
+    # lookups); `all_objects` sees everything
+    objects = SoftDeleteManager()
+    all_objects = models.Manager.from_queryset(SoftDeleteQuerySet)()
+
     class Meta:
         abstract = True
 
+    def soft_delete(self):
+        self.is_deleted = True
+        self.save()
+
 class User(AbstractUser):
     USER_TYPE_CHOICES= (
         ('parent', _('Parent/Guardian')),
@@ -26,21 +51,37 @@ class User(AbstractUser):
     location = models.CharField(max_length=100)
     rating = models.FloatField(default=0.0)
     review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
     national_id = models.CharField(max_length=15, unique=True, blank=True, null=True) 
     phone_number = models.CharField(max_length=15, blank=True, null=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
+
+    @classmethod
+    def adjust_rating(cls, user_id, sum_delta, count_delta):
+        # One UPDATE computed from the row's current values, so concurrent
+        # reviews for the same seller can't overwrite each other
+        new_sum = F('rating_sum') + sum_delta
+        new_count = F('review_count') + count_delta
+        cls.objects.filter(pk=user_id).update(
+            rating_sum=new_sum,
+            review_count=new_count,
+            rating=Case(
+                When(review_count=-count_delta, then=Value(0.0)),
+                default=Cast(new_sum, models.FloatField()) / Cast(new_count, models.FloatField()),
+                output_field=models.FloatField(),
+            ),
+        )
+        response_cache.bump(cls)
     
     def update_rating(self):
-      reviews = self.reviews_received.all() 
-      if reviews.exists():
-        self.rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0.0
-        self.review_count = reviews.count()
-      else:
-        self.rating = 0.0
-        self.review_count = 0
-      self.save() 
+      # Full recompute; the incremental path is adjust_rating()
+      stats = self.reviews_received.aggregate(total=Sum('rating'), count=Count('id'))
+      self.rating_sum = stats['total'] or 0
+      self.review_count = stats['count']
+      self.rating = self.rating_sum / self.review_count if self.review_count else 0.0
+      self.save(update_fields=['rating', 'rating_sum', 'review_count'])
 
 class Textbook(BaseModel):
     title = models.CharField(max_length=200)    
@@ -65,7 +106,8 @@ class Listing(BaseModel):
         ('fair', _('Fair')),
     )
 
-    listed_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings')
+    # Indexed by listing_seller_idx below
+    listed_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='listings', db_index=False)
     textbook = models.ForeignKey(Textbook, on_delete=models.CASCADE, related_name='listings')
     listing_type = models.CharField(max_length=10, choices=LISTING_TYPE_CHOICES)
     condition = models.CharField(max_length=10, choices=CONDITION_CHOICES)
@@ -74,6 +116,22 @@ class Listing(BaseModel):
     is_active = models.BooleanField(default=True)
     views = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Public feed: active listings, newest first
+            models.Index(
+                fields=['-created_at'], name='listing_feed_idx',
+                condition=models.Q(is_active=True, is_deleted=False),
+            ),
+            # Cheapest active copy of a textbook (book list availability, recommendations)
+            models.Index(
+                fields=['textbook', 'price'], name='listing_book_price_idx',
+                condition=models.Q(is_active=True, is_deleted=False),
+            ),
+            # A seller's listings / bookshop inventory
+            models.Index(fields=['listed_by', 'is_active', '-created_at'], name='listing_seller_idx'),
+        ]
     
     def __str__(self):
         return f"Listing for {self.textbook.title}"
@@ -105,6 +163,54 @@ class BookList(BaseModel):
     def __str__(self):
         return f"Book List for {self.grade} ({self.academic_year}) - {self.school.school_name}"
 
+class Child(BaseModel):
+    # A parent's child at a school; their class book list drives swap matching
+    parent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='children')
+    name = models.CharField(max_length=100, blank=True)
+    school = models.ForeignKey(SchoolProfile, on_delete=models.CASCADE, related_name='children')
+    grade = models.CharField(max_length=50)
+
+    def __str__(self):
+        return f"{self.name or 'Child'} ({self.grade}, {self.school.school_name})"
+
+class Recommendation(BaseModel):
+    # Precomputed feed entry: a listing a parent's children need, best score first
+    parent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='recommendations')
+    score = models.FloatField()
+    distance_km = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('parent', 'listing')
+        indexes = [models.Index(fields=['parent', '-score'], name='recommendation_feed_idx')]
+
+    def __str__(self):
+        return f"{self.listing} for {self.parent.username} ({self.score:.2f})"
+
+class ArchivedRecord(models.Model):
+    # Cold rows moved out of the hot tables by api.archival, serialized as they were
+    model = models.CharField(max_length=100)   # app_label.model_name
+    object_id = models.UUIDField()
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField()        # of the original row
+    archived_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('model', 'object_id')
+
+    def __str__(self):
+        return f"{self.model} {self.object_id}"
+
+class GeocodedLocation(models.Model):
+    # Cache of free-text user locations -> coordinates; null when lookup failed
+    name = models.CharField(max_length=100, primary_key=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
 class Review(BaseModel):
     listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='reviews')
     reviewer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reviews_given')
@@ -114,8 +220,27 @@ class Review(BaseModel):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.seller.update_rating()
+        with transaction.atomic():
+            # What the row counted towards before and after this save: soft-deleted
+            # reviews count for nothing, as in update_rating()
+            before = None
+            if not self._state.adding:
+                previous = Review.all_objects.filter(pk=self.pk).values('seller_id', 'rating', 'is_deleted').first()
+                if previous and not previous['is_deleted']:
+                    before = (previous['seller_id'], previous['rating'])
+            after = None if self.is_deleted else (self.seller_id, self.rating)
+
+            super().save(*args, **kwargs)
+
+            if before == after:
+                return
+            if before and after and before[0] == after[0]:
+                User.adjust_rating(self.seller_id, after[1] - before[1], 0)
+                return
+            if before:
+                User.adjust_rating(before[0], -before[1], -1)
+            if after:
+                User.adjust_rating(after[0], after[1], 1)
 
     def __str__(self):
         return f"Review by {self.reviewer.username} for {self.seller.username} ({self.rating} stars)"
@@ -131,7 +256,8 @@ class Conversation(BaseModel):
         return f"Conversation {self.id}-{self.listing}"
 
 class Message(BaseModel):
-    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    # Indexed by message_history_idx below
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', db_index=False)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
@@ -139,6 +265,12 @@ class Message(BaseModel):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # id breaks timestamp ties, so history pages and sync read straight off the index
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_history_idx'),
+            # Unread counts and read markers only ever look at unread rows
+            models.Index(fields=['conversation'], condition=models.Q(is_read=False), name='message_unread_idx'),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender.username}"
@@ -161,6 +293,23 @@ class CartItem(BaseModel):
     def __str__(self):
         return f"{self.listing.textbook.title} in {self.cart.user.username}'s cart"
 
+class SwapMatch(BaseModel):
+    # A swap proposed by the matchmaker: a direct pair or a 3-4 parent cycle.
+    # Each leg is a SwapRequest pointing back here.
+    STATUS_CHOICES = (
+        ('proposed', 'Proposed'),
+        ('accepted', 'Accepted'),
+        ('rejected', 'Rejected'),
+        ('expired', 'Expired'),
+    )
+
+    signature = models.CharField(max_length=64, unique=True, help_text="Hash of the listing ids in the cycle")
+    size = models.PositiveSmallIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='proposed', db_index=True)
+
+    def __str__(self):
+        return f"{self.size}-way swap ({self.status})"
+
 class SwapRequest(BaseModel):
     STATUS_CHOICES = (
         ('pending', 'Pending'),
@@ -174,6 +323,7 @@ class SwapRequest(BaseModel):
     requested_listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='swap_requests_received')
     offered_listing = models.ForeignKey(Listing, on_delete=models.CASCADE, related_name='swap_requests_sent')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    match = models.ForeignKey(SwapMatch, on_delete=models.SET_NULL, null=True, blank=True, related_name='legs')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -217,10 +367,25 @@ class Delivery(BaseModel):
     current_lng = models.FloatField(null=True, blank=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Rider job board (status='paid', newest first)
+            models.Index(fields=['status', '-created_at'], name='delivery_status_idx'),
+            # A rider's own jobs, and the "already has an active job" check
+            models.Index(fields=['rider_phone', 'status'], name='delivery_rider_idx'),
+        ]
 
     def __str__(self):
         return f"Delivery {self.tracking_code or 'Pending'}"
 
+class CodeSequence(models.Model):
+    # Counter used for tracking codes on databases without native sequences
+    name = models.CharField(max_length=50, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.last_value}"
+
 class Payment(BaseModel):
     PAYMENT_METHOD_CHOICES = (
         ('mpesa', 'M-Pesa'),
@@ -238,9 +403,47 @@ class Payment(BaseModel):
     is_successful = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Callback lookups by provider reference; each payment has only one of the two
+        indexes = [
+            models.Index(
+                fields=['transaction_code'], name='payment_mpesa_code_idx',
+                condition=models.Q(transaction_code__isnull=False),
+            ),
+            models.Index(
+                fields=['paystack_ref'], name='payment_paystack_ref_idx',
+                condition=models.Q(paystack_ref__isnull=False),
+            ),
+        ]
+
     def __str__(self):
         return f"Payment {self.transaction_code or self.paystack_ref} - {self.amount}"
 
+class PaymentCallback(BaseModel):
+    PROVIDER_CHOICES = (
+        ('mpesa', 'M-Pesa'),
+        ('paystack', 'Paystack'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+
+    provider = models.CharField(max_length=10, choices=PROVIDER_CHOICES)
+    reference = models.CharField(max_length=100, help_text="CheckoutRequestID or Paystack reference")
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('provider', 'reference')
+
+    def __str__(self):
+        return f"{self.provider} callback {self.reference} ({self.status})"
+
 class Wallet(BaseModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='wallet')
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
@@ -254,17 +457,38 @@ class WalletTransaction(BaseModel):
         ('credit', 'Credit (Earnings)'),
         ('debit', 'Debit (Withdrawal)'),
     )
-    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions')
+    # Indexed by wallet_transaction_history_idx below
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES)
     description = models.CharField(max_length=255) 
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Earnings history, paged by (-timestamp, -id)
+        indexes = [models.Index(fields=['wallet', '-timestamp', '-id'], name='wallet_transaction_history_idx')]
+
     def __str__(self):
         return f"{self.transaction_type} - {self.amount}"
+
+
+class WalletDailyRollup(BaseModel):
+    # Per-wallet daily totals, kept up to date by api.ledger as rows are written
+    wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    credit_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    debit_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    credit_count = models.IntegerField(default=0)
+    debit_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('wallet', 'day')
+
+    def __str__(self):
+        return f"{self.wallet.user.username} {self.day}: +{self.credit_total} / -{self.debit_total}"
   
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django_rest_passwordreset.signals import reset_password_token_created
 from django.core.mail import send_mail
 from django.urls import reverse
@@ -274,6 +498,55 @@ def create_user_wallet(sender, instance, created, **kwargs):
     if created:
         Wallet.objects.create(user=instance)
 
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    # Fires for queryset and cascade deletes too, unlike Review.delete().
+    # A soft-deleted review was already taken off when it was hidden.
+    if not instance.is_deleted:
+        User.adjust_rating(instance.seller_id, -instance.rating, -1)
+
+@receiver(post_save, sender=Listing)
+def rematch_swaps_for_listing(sender, instance, update_fields=None, **kwargs):
+    from . import background, swap_matching
+
+    if instance.listing_type != 'exchange' or update_fields == frozenset(['views']):
+        return
+    if instance.is_active and not instance.is_deleted:
+        parent_id = instance.listed_by_id
+        transaction.on_commit(lambda: background.submit_once(swap_matching.propose_for_parent, parent_id))
+    else:
+        swap_matching.expire_matches_for_listings([instance.id])
+
+@receiver(post_save, sender=Child)
+def refresh_matches_for_child(sender, instance, **kwargs):
+    from . import background, recommendations, swap_matching
+
+    parent_id = instance.parent_id
+    transaction.on_commit(lambda: background.submit_once(swap_matching.propose_for_parent, parent_id))
+    transaction.on_commit(lambda: background.submit_once(recommendations.refresh_parent, parent_id))
+
+@receiver(m2m_changed, sender=BookList.textbooks.through)
+def rematch_swaps_for_booklist(sender, instance, action, reverse, **kwargs):
+    from . import background, swap_matching
+
+    if action == 'post_add' and not reverse:
+        booklist_id = instance.id
+        transaction.on_commit(lambda: background.submit_once(swap_matching.propose_for_booklist, booklist_id))
+
+# Models the public read endpoints are built from (api/response_cache.py)
+RESPONSE_CACHED_MODELS = (User, Textbook, Listing, BookshopProfile, SchoolProfile, BookList)
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_response_cache(sender, **kwargs):
+    if sender in RESPONSE_CACHED_MODELS:
+        response_cache.model_changed(sender, update_fields=kwargs.get('update_fields'))
+
+@receiver(m2m_changed, sender=BookList.textbooks.through)
+def invalidate_booklist_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        response_cache.bump(BookList)
+
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
     print(f"\n\n==========================================")
@@ -1,57 +1,162 @@
 import requests
 import base64
+import threading
+import time
 from datetime import datetime
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MPESA_BASE_URLS = {
+    'sandbox': "https://sandbox.safaricom.co.ke",
+    'production': "https://api.safaricom.co.ke",
+}
+
+class MpesaClient:
+    """
+    Daraja API client that keeps one pooled HTTP session per process and
+    caches the OAuth access token until shortly before it expires.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, base_url, timeout=10,
+                 max_retries=2, token_expiry_margin=60, pool_size=10):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token_expiry_margin = token_expiry_margin
+
+        self._token = None
+        self._token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+        # Only idempotent calls are retried (the token GET); an STK push is
+        # never re-sent automatically so a customer can't be prompted twice.
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_settings(cls):
+        environment = getattr(settings, 'MPESA_ENVIRONMENT', 'sandbox')
+        return cls(
+            consumer_key=settings.MPESA_CONSUMER_KEY,
+            consumer_secret=settings.MPESA_CONSUMER_SECRET,
+            base_url=getattr(settings, 'MPESA_BASE_URL', None) or MPESA_BASE_URLS.get(environment, MPESA_BASE_URLS['sandbox']),
+            timeout=getattr(settings, 'MPESA_TIMEOUT', 10),
+            max_retries=getattr(settings, 'MPESA_MAX_RETRIES', 2),
+            token_expiry_margin=getattr(settings, 'MPESA_TOKEN_EXPIRY_MARGIN', 60),
+        )
+
+    def _token_is_fresh(self):
+        return self._token is not None and time.monotonic() < self._token_expires_at
+
+    def get_access_token(self, force_refresh=False):
+        if not force_refresh and self._token_is_fresh():
+            return self._token
+
+        with self._token_lock:
+            # Another thread may have refreshed it while we waited for the lock
+            if not force_refresh and self._token_is_fresh():
+                return self._token
+
+            api_url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
+            try:
+                response = self.session.get(
+                    api_url,
+                    auth=(self.consumer_key, self.consumer_secret),
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                print(f"M-Pesa Token Error: {e}")
+                self._token = None
+                return None
+
+            expires_in = int(data.get('expires_in', 3599))
+            self._token = data['access_token']
+            self._token_expires_at = time.monotonic() + max(expires_in - self.token_expiry_margin, 0)
+            return self._token
+
+    def invalidate_token(self):
+        with self._token_lock:
+            self._token = None
+            self._token_expires_at = 0
+
+    def stk_push(self, phone_number, amount, reference_code):
+        access_token = self.get_access_token()
+        if not access_token:
+            return {"error": "Failed to authenticate with M-Pesa"}
+
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        shortcode = settings.MPESA_SHORTCODE
+        passkey = settings.MPESA_PASSKEY
+
+        password_str = f"{shortcode}{passkey}{timestamp}"
+        password = base64.b64encode(password_str.encode()).decode()
+
+        if phone_number.startswith('0'):
+            phone_number = '254' + phone_number[1:]
+        elif phone_number.startswith('+254'):
+            phone_number = phone_number[1:]
+
+        payload = {
+            "BusinessShortCode": shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": int(amount),
+            "PartyA": phone_number,
+            "PartyB": shortcode,
+            "PhoneNumber": phone_number,
+            "CallBackURL": settings.MPESA_CALLBACK_URL,
+            "AccountReference": f"Order-{reference_code}",
+            "TransactionDesc": "Textbook Delivery Fee"
+        }
+
+        api_url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
+
+        try:
+            response = self._post_with_token(api_url, payload, access_token)
+            return response.json()
+        except Exception as e:
+            return {"error": str(e)}
+
+    def _post_with_token(self, api_url, payload, access_token):
+        headers = {"Authorization": f"Bearer {access_token}"}
+        response = self.session.post(api_url, json=payload, headers=headers, timeout=self.timeout)
+
+        # A token revoked early by Safaricom is rejected before the request is
+        # processed, so refreshing once and re-sending is safe.
+        if response.status_code == 401:
+            access_token = self.get_access_token(force_refresh=True)
+            if access_token:
+                headers = {"Authorization": f"Bearer {access_token}"}
+                response = self.session.post(api_url, json=payload, headers=headers, timeout=self.timeout)
+        return response
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_mpesa_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MpesaClient.from_settings()
+    return _client
 
 def get_access_token():
-    consumer_key = settings.MPESA_CONSUMER_KEY
-    consumer_secret = settings.MPESA_CONSUMER_SECRET
-    api_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    
-    try:
-        response = requests.get(api_url, auth=(consumer_key, consumer_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
-    except Exception as e:
-        print(f"M-Pesa Token Error: {e}")
-        return None
+    return get_mpesa_client().get_access_token()
 
 def trigger_stk_push(phone_number, amount, reference_code):
-    access_token = get_access_token()
-    if not access_token:
-        return {"error": "Failed to authenticate with M-Pesa"}
-
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    shortcode = settings.MPESA_SHORTCODE
-    passkey = settings.MPESA_PASSKEY
-    
-    password_str = f"{shortcode}{passkey}{timestamp}"
-    password = base64.b64encode(password_str.encode()).decode()
-
-    if phone_number.startswith('0'):
-        phone_number = '254' + phone_number[1:]
-    elif phone_number.startswith('+254'):
-        phone_number = phone_number[1:]
-
-    payload = {
-        "BusinessShortCode": shortcode,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": int(amount),
-        "PartyA": phone_number,
-        "PartyB": shortcode,
-        "PhoneNumber": phone_number,
-        "CallBackURL": settings.MPESA_CALLBACK_URL, 
-        "AccountReference": f"Order-{reference_code}",
-        "TransactionDesc": "Textbook Delivery Fee"
-    }
-
-    api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-    headers = { "Authorization": f"Bearer {access_token}" }
-
-    try:
-        response = requests.post(api_url, json=payload, headers=headers)
-        return response.json()
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+    return get_mpesa_client().stk_push(phone_number, amount, reference_code)
@@ -0,0 +1,69 @@
+import json
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from .models import Order
+
+# Server-side events for the per-user socket (NotificationConsumer at
+# ws/notifications/). Every user's sockets sit in a `user_<id>` group; riders
+# are also in `riders`, which hears about jobs opening up and being taken.
+#
+# publish() sends once the surrounding transaction commits, so nobody hears
+# about a swap or a payment that rolled back. Events arrive on the socket as
+# {"type": <event>, ...data}:
+#   message            a chat message for you
+#   swap_received      swap_accepted      swap_rejected
+#   order_placed       payment_confirmed  rider_assigned   delivery_updated
+#   job_available      job_taken          (riders only)
+
+RIDERS_GROUP = 'riders'
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+def event_message(event, data):
+    # Channel layers may pack with msgpack: stick to plain JSON types
+    return {'type': 'notify', 'event': event, 'data': json.loads(json.dumps(data, cls=DjangoJSONEncoder))}
+
+def _send(groups, message):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    for group in groups:
+        try:
+            async_to_sync(layer.group_send)(group, message)
+        except Exception as e:
+            # A missed notification must never fail the request that caused it
+            print(f"Could not publish {message['event']} to {group}: {e}")
+
+def publish(user_ids, event, **data):
+    groups = [user_group(user_id) for user_id in set(user_ids) if user_id is not None]
+    if groups:
+        message = event_message(event, data)
+        transaction.on_commit(lambda: _send(groups, message))
+
+def publish_to_riders(event, **data):
+    message = event_message(event, data)
+    transaction.on_commit(lambda: _send([RIDERS_GROUP], message))
+
+async def publish_now(user_ids, event, **data):
+    """publish() for async code outside a transaction (consumers)."""
+    layer = get_channel_layer()
+    message = event_message(event, data)
+    for user_id in set(user_ids):
+        await layer.group_send(user_group(user_id), message)
+
+def delivery_party_ids(delivery):
+    """Everyone with a stake in a delivery: buyers, sellers or swap parents, and the rider."""
+    ids = {delivery.rider_id}
+    for buyer_id, seller_id in Order.objects.filter(delivery=delivery).values_list('buyer_id', 'listing__listed_by_id'):
+        ids.update((buyer_id, seller_id))
+    if delivery.swap_id:
+        ids.update((delivery.swap.sender_id, delivery.swap.receiver_id))
+    ids.discard(None)
+    return ids
+
+def payment_confirmed(delivery):
+    publish(delivery_party_ids(delivery), 'payment_confirmed', delivery_id=delivery.id, tracking_code=delivery.tracking_code)
+    publish_to_riders('job_available', delivery_id=delivery.id, pickup_location=delivery.pickup_location, dropoff_location=delivery.dropoff_location)
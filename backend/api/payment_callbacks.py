@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Delivery, Payment, PaymentCallback
+from .tracking_codes import generate_tracking_code
+from . import background, notifications
+
+# Provider callbacks are written to the PaymentCallback inbox and acknowledged
+# straight away; the payment/delivery updates run in a background worker.
+# Processing is idempotent per (provider, reference), so Safaricom/Paystack
+# retries and a sweep by `manage.py process_payment_callbacks` are harmless.
+#
+# A callback can beat its Payment row (the provider answers before
+# initiate_* has committed). It then fails and stays in the inbox: it is
+# retried when the payment is saved (retry_reference) and by the sweep, up to
+# PAYMENT_CALLBACK_MAX_ATTEMPTS times.
+
+def max_attempts():
+    return getattr(settings, 'PAYMENT_CALLBACK_MAX_ATTEMPTS', 10)
+
+def record_callback(provider, reference, payload):
+    """Store a callback in the inbox (once per reference) and queue it for processing."""
+    try:
+        with transaction.atomic():
+            callback, created = PaymentCallback.objects.get_or_create(
+                provider=provider,
+                reference=reference,
+                defaults={'payload': payload}
+            )
+    except IntegrityError:
+        # A concurrent retry of the same callback won the insert
+        callback, created = PaymentCallback.objects.get(provider=provider, reference=reference), False
+
+    # Provider retries of a callback that has used up its attempts are acknowledged, not rerun
+    if created or (callback.status == 'failed' and callback.attempts < max_attempts()):
+        transaction.on_commit(lambda: enqueue(callback.id))
+    return callback
+
+def enqueue(callback_id):
+    background.submit(process_callback, callback_id)
+
+def process_callback(callback_id):
+    """Apply one inbox entry. Safe to call any number of times for the same entry."""
+    try:
+        with transaction.atomic():
+            callback = PaymentCallback.objects.select_for_update().get(id=callback_id)
+            if callback.status == 'processed':
+                return callback
+
+            callback.attempts += 1
+            if callback.provider == 'mpesa':
+                _apply_mpesa(callback)
+            else:
+                _apply_paystack(callback)
+
+            callback.status = 'processed'
+            callback.last_error = ''
+            callback.processed_at = timezone.now()
+            callback.save(update_fields=['status', 'attempts', 'last_error', 'processed_at', 'updated_at'])
+            return callback
+    except Exception as e:
+        print(f"Payment callback {callback_id} failed: {e}")
+        # The attempt itself rolled back with the transaction; count it here
+        PaymentCallback.objects.filter(id=callback_id).exclude(status='processed').update(
+            status='failed', attempts=F('attempts') + 1, last_error=str(e), updated_at=timezone.now()
+        )
+        return None
+
+def process_pending_callbacks(limit=100):
+    ids = list(
+        PaymentCallback.objects.filter(status__in=['pending', 'failed'], attempts__lt=max_attempts())
+        .order_by('created_at')
+        .values_list('id', flat=True)[:limit]
+    )
+    for callback_id in ids:
+        process_callback(callback_id)
+    return len(ids)
+
+def retry_reference(provider, reference):
+    """Queue callbacks for a reference that arrived before its payment was saved."""
+    ids = list(
+        PaymentCallback.objects.filter(provider=provider, reference=reference, status__in=['pending', 'failed'])
+        .values_list('id', flat=True)
+    )
+    for callback_id in ids:
+        transaction.on_commit(lambda callback_id=callback_id: enqueue(callback_id))
+
+def assign_tracking_code(delivery):
+    """Give a delivery whose payment is confirmed its tracking code now, without waiting for the worker."""
+    if not delivery.tracking_code:
+        # Guarded so it can't overwrite a code the worker (or a second verify) already set
+        Delivery.objects.filter(Q(tracking_code__isnull=True) | Q(tracking_code=''), id=delivery.id).update(
+            tracking_code=generate_tracking_code(), updated_at=timezone.now(), last_updated=timezone.now()
+        )
+        delivery.refresh_from_db(fields=['tracking_code'])
+    return delivery.tracking_code
+
+def _mark_paid(payment):
+    if not payment.is_successful:
+        payment.is_successful = True
+        payment.save(update_fields=['is_successful', 'updated_at'])
+
+    delivery = payment.delivery
+    update_fields = []
+    if delivery.status == 'pending':
+        delivery.status = 'paid'
+        update_fields.append('status')
+    if not delivery.tracking_code:
+        delivery.tracking_code = generate_tracking_code()
+        update_fields.append('tracking_code')
+    if update_fields:
+        delivery.save(update_fields=update_fields + ['updated_at', 'last_updated'])
+    if 'status' in update_fields:
+        notifications.payment_confirmed(delivery)
+    return delivery
+
+def _apply_mpesa(callback):
+    body = callback.payload.get('Body', {}).get('stkCallback', {})
+    try:
+        payment = Payment.objects.select_for_update().select_related('delivery').get(transaction_code=callback.reference)
+    except Payment.DoesNotExist:
+        # Raised so the callback stays in the inbox and is retried
+        raise Payment.DoesNotExist(f"No payment yet for M-Pesa checkout {callback.reference}")
+
+    if body.get('ResultCode') == 0:
+        delivery = _mark_paid(payment)
+        print(f"Payment Confirmed for Order {delivery.id}")
+    else:
+        print(f"Payment Failed for Order {payment.delivery_id}: {body.get('ResultDesc')}")
+
+def _apply_paystack(callback):
+    try:
+        payment = Payment.objects.select_for_update().select_related('delivery').get(paystack_ref=callback.reference)
+    except Payment.DoesNotExist:
+        raise Payment.DoesNotExist(f"No payment yet for Paystack reference {callback.reference}")
+
+    if callback.payload.get('status') == 'success':
+        _mark_paid(payment)
@@ -0,0 +1,85 @@
+import asyncio
+from collections import Counter, defaultdict
+from django.conf import settings
+
+# Who has a chat room open. Kept out of the database: ChatConsumer calls
+# join()/leave() as sockets come and go and broadcasts the resulting member
+# list to the room.
+#
+# PRESENCE_BACKEND picks the store:
+#   memory - a counter per room in this process (memory and local channel layers)
+#   redis  - a hash per room in Redis, shared by every worker (redis layer)
+# Both count sockets per user, so a second tab closing doesn't mark you away.
+
+class MemoryPresence:
+    def __init__(self):
+        self.rooms = defaultdict(Counter)
+
+    async def join(self, room, user_id):
+        self.rooms[room][user_id] += 1
+        return self._members(room)
+
+    async def leave(self, room, user_id):
+        members = self.rooms.get(room)
+        if members is not None:
+            members[user_id] -= 1
+            if members[user_id] <= 0:
+                del members[user_id]
+            if not members:
+                del self.rooms[room]
+        return self._members(room)
+
+    def _members(self, room):
+        return sorted(self.rooms.get(room, ()))
+
+
+class RedisPresence:
+    # Increment/decrement and read back in one round trip, so a join racing a
+    # leave can't drop the user from the hash
+    JOIN = """
+    redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return redis.call('HKEYS', KEYS[1])
+    """
+    LEAVE = """
+    if redis.call('HINCRBY', KEYS[1], ARGV[1], -1) <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    end
+    return redis.call('HKEYS', KEYS[1])
+    """
+
+    def __init__(self, url, prefix='presence:', expiry=86400):
+        self.url = url
+        self.prefix = prefix
+        # Rooms nobody leaves cleanly (a worker crashed) disappear after this
+        self.expiry = expiry
+        self.clients = {}   # event loop -> redis client
+
+    def _client(self):
+        import redis.asyncio as redis
+
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            client = self.clients[loop] = redis.from_url(self.url)
+        return client
+
+    async def join(self, room, user_id):
+        members = await self._client().eval(self.JOIN, 1, self.prefix + room, user_id, self.expiry)
+        return sorted(member.decode() for member in members)
+
+    async def leave(self, room, user_id):
+        members = await self._client().eval(self.LEAVE, 1, self.prefix + room, user_id)
+        return sorted(member.decode() for member in members)
+
+
+_store = None
+
+def store():
+    global _store
+    if _store is None:
+        if settings.PRESENCE_BACKEND == 'redis':
+            _store = RedisPresence(settings.PRESENCE_REDIS_URL)
+        else:
+            _store = MemoryPresence()
+    return _store
@@ -0,0 +1,126 @@
+import math
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Child, GeocodedLocation, Listing, Recommendation, User
+from .swap_matching import wanted_textbooks
+from .utils import geocode_address
+
+# Personalised listing feed for parents. For each parent we take the textbooks
+# on their children's class book lists, score every active listing of those
+# books by price, condition and distance from the parent, and store the top
+# few as Recommendation rows. The feed endpoint then reads them back in one
+# query; `manage.py refresh_recommendations` rebuilds them periodically.
+
+PRICE_WEIGHT = 0.5
+CONDITION_WEIGHT = 0.3
+DISTANCE_WEIGHT = 0.2
+
+CONDITION_SCORES = {'new': 1.0, 'good': 0.7, 'fair': 0.4}
+UNKNOWN_DISTANCE_SCORE = 0.5
+DISTANCE_SCALE_KM = 5.0    # a listing this far away scores half a nearby one
+LISTINGS_PER_BOOK = 10     # cheapest listings considered per needed textbook
+
+def _haversine_km(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(h))
+
+def location_coordinates(names):
+    """Map location name -> (lat, lon) or None, geocoding (and caching) names we haven't seen."""
+    names = {name.strip() for name in names if name and name.strip()}
+    coords = {
+        row.name: (row.latitude, row.longitude) if row.latitude is not None else None
+        for row in GeocodedLocation.objects.filter(name__in=names)
+    }
+    missing = names - coords.keys()
+    if missing and getattr(settings, 'RECOMMENDATIONS_GEOCODE', True):
+        found = []
+        for name in missing:
+            coords[name] = geocode_address(name)
+            latitude, longitude = coords[name] or (None, None)
+            found.append(GeocodedLocation(name=name, latitude=latitude, longitude=longitude))
+        GeocodedLocation.objects.bulk_create(found, ignore_conflicts=True)
+    return coords
+
+def _distance_km(origin, destination, coords):
+    origin, destination = (origin or '').strip(), (destination or '').strip()
+    if origin and origin.lower() == destination.lower():
+        return 0.0
+    a, b = coords.get(origin), coords.get(destination)
+    if a and b:
+        return _haversine_km(a, b)
+    return None
+
+def score_listing(price, cheapest, condition, distance_km):
+    price_score = 1.0 if price <= cheapest else float(cheapest or 0) / float(price)
+    distance_score = UNKNOWN_DISTANCE_SCORE if distance_km is None else 1 / (1 + distance_km / DISTANCE_SCALE_KM)
+    return (
+        PRICE_WEIGHT * price_score
+        + CONDITION_WEIGHT * CONDITION_SCORES.get(condition, 0.5)
+        + DISTANCE_WEIGHT * distance_score
+    )
+
+def refresh_parents(parent_ids):
+    """Recompute and store the recommendation set for a batch of parents."""
+    parent_ids = list(parent_ids)
+    wants = wanted_textbooks(parent_ids)
+    needed = set().union(*wants.values())
+
+    candidates = defaultdict(list)
+    if needed:
+        # Only the cheapest few per textbook leave the database
+        rows = (
+            Listing.objects.filter(textbook_id__in=needed, is_active=True)
+            .annotate(rank=Window(RowNumber(), partition_by=F('textbook_id'), order_by=(F('price').asc(), F('created_at').asc())))
+            .filter(rank__lte=LISTINGS_PER_BOOK)
+            .order_by('textbook_id', 'price', 'created_at')
+            .values_list('id', 'textbook_id', 'listed_by_id', 'listed_by__location', 'condition', 'price')
+        )
+        for row in rows:
+            candidates[row[1]].append(row)
+
+    parent_locations = dict(User.objects.filter(id__in=parent_ids).values_list('id', 'location'))
+    coords = location_coordinates(
+        list(parent_locations.values()) + [row[3] for rows in candidates.values() for row in rows]
+    )
+
+    limit = getattr(settings, 'RECOMMENDATIONS_PER_PARENT', 50)
+    recommendations = []
+    for parent_id in parent_ids:
+        scored = []
+        for textbook_id in wants[parent_id]:
+            listings = candidates.get(textbook_id, [])
+            if not listings:
+                continue
+            cheapest = listings[0][5]
+            for listing_id, _, seller_id, seller_location, condition, price in listings:
+                if seller_id == parent_id:
+                    continue
+                distance = _distance_km(parent_locations.get(parent_id), seller_location, coords)
+                scored.append((score_listing(price, cheapest, condition, distance), distance, listing_id))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        recommendations.extend(
+            Recommendation(parent_id=parent_id, listing_id=listing_id, score=score, distance_km=distance)
+            for score, distance, listing_id in scored[:limit]
+        )
+
+    with transaction.atomic():
+        Recommendation.objects.filter(parent_id__in=parent_ids).delete()
+        Recommendation.objects.bulk_create(recommendations, batch_size=1000)
+    return len(recommendations)
+
+def refresh_parent(parent_id):
+    return refresh_parents([parent_id])
+
+def refresh_all(batch_size=200):
+    parent_ids = list(Child.objects.values_list('parent_id', flat=True).distinct())
+    total = 0
+    for start in range(0, len(parent_ids), batch_size):
+        total += refresh_parents(parent_ids[start:start + batch_size])
+    # Parents who no longer have children registered
+    Recommendation.objects.exclude(parent_id__in=Child.objects.values('parent_id')).delete()
+    return total
@@ -0,0 +1,110 @@
+import hashlib
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+# Response cache for the public read endpoints. Every model a response is
+# built from has a version token in the cache; the token is part of the
+# cache key and the ETag, and is replaced whenever a row of that model is
+# saved or deleted (see the signal receiver in models.py). Old entries are
+# never looked up again and simply expire.
+#
+# Queryset .update() calls skip signals, so code that updates cached models
+# in bulk calls bump() itself.
+
+VERSION_PREFIX = 'response-cache:version:'
+ENTRY_PREFIX = 'response-cache:entry:'
+
+# Saves that only touch these fields don't change any cached payload we care
+# about (a listing's view counter, a user's last login)
+IGNORED_UPDATE_FIELDS = {
+    'listing': {'views'},
+    'user': {'last_login'},
+}
+
+def _cache():
+    return caches[getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+def _label(model):
+    return model._meta.model_name
+
+def get_versions(models):
+    cache = _cache()
+    keys = [VERSION_PREFIX + _label(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # add() so two requests racing to initialise agree on a token
+            token = uuid.uuid4().hex
+            if not cache.add(key, token, timeout=None):
+                token = cache.get(key, token)
+            versions[key] = token
+    return [versions[key] for key in keys]
+
+def bump(*models):
+    """Invalidate every cached response built from these models."""
+    def new_versions():
+        _cache().set_many({VERSION_PREFIX + _label(model): uuid.uuid4().hex for model in models}, timeout=None)
+
+    # Bump now so this transaction's own reads miss, and again on commit so a
+    # response cached from a concurrent read of the old rows is dropped too
+    new_versions()
+    transaction.on_commit(new_versions)
+
+def model_changed(sender, update_fields=None, **kwargs):
+    ignored = IGNORED_UPDATE_FIELDS.get(_label(sender))
+    if update_fields and ignored and set(update_fields) <= ignored:
+        return
+    bump(sender)
+
+
+class CachedResponseMixin:
+    """
+    Cache GET responses of a viewset per URL (path + query string).
+    `cache_models` lists every model the payload is built from.
+    """
+    cache_models = ()
+    cache_actions = ('list', 'retrieve')
+    cache_anonymous_only = False
+
+    def is_cacheable(self, request):
+        if request.method != 'GET' or self.action not in self.cache_actions:
+            return False
+        return not (self.cache_anonymous_only and request.user.is_authenticated)
+
+    def cached_response(self, request, build, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return build(request, *args, **kwargs)
+
+        versions = get_versions(self.cache_models)
+        fingerprint = '|'.join([type(self).__name__, self.action, request.get_full_path(), *versions])
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()
+        etag = f'"{digest[:32]}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'public, max-age=0, must-revalidate',
+            'Vary': 'Authorization',
+        }
+
+        # Same versions means the same payload, so no lookup is needed at all
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        cache = _cache()
+        data = cache.get(ENTRY_PREFIX + digest)
+        if data is None:
+            response = build(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            data = response.data
+            cache.set(ENTRY_PREFIX + digest, data, getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300))
+        return Response(data, headers=headers)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
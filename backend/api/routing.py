@@ -3,5 +3,6 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_id>[0-9a-f-]+)/$', consumers.ChatConsumer.as_asgi()),
-    re_path(r'ws/delivery/(?P<delivery_id>\d+)/$', consumers.DeliveryConsumer.as_asgi()),
+    re_path(r'ws/delivery/(?P<delivery_id>[0-9a-f-]+)/$', consumers.DeliveryConsumer.as_asgi()),
+    re_path(r'ws/notifications/$', consumers.NotificationConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,9 +1,38 @@
+from decimal import Decimal
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from django.contrib.auth import get_user_model
-from .models import Textbook, Listing, BookshopProfile, SchoolProfile, BookList, Conversation, Message, Cart, CartItem, Review, SwapRequest, Order, Delivery, Payment, Wallet, WalletTransaction
+from django.core.files.storage import default_storage
+from django.db.models import Sum
+from .metrics import measure_serializer
+from .models import Textbook, Listing, BookshopProfile, SchoolProfile, BookList, Child, Conversation, Message, Cart, CartItem, Review, SwapRequest, Order, Delivery, Payment, Wallet, WalletTransaction
 
 User = get_user_model()
 
+def requested_fields(request):
+    """Field names from a ?fields=a,b,c query parameter on a read, or None for all fields."""
+    # Only reads are narrowed: on a write the same fields drive validation and save
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+class SparseFieldsetMixin:
+    """Honour ?fields= on the top-level serializer of a response (nested ones are left whole)."""
+    def get_fields(self):
+        fields = super().get_fields()
+        is_top_level = self.parent is None or (
+            isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None
+        )
+        wanted = requested_fields(self.context.get('request')) if is_top_level else None
+        if wanted:
+            for name in list(fields):
+                if name not in wanted:
+                    fields.pop(name)
+        return fields
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -37,12 +66,12 @@ class RegisterSerializer(serializers.ModelSerializer):
         )
         return user
 
-class TextbookSerializer(serializers.ModelSerializer):
+class TextbookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Textbook
         fields = '__all__' 
 
-class ListingSerializer(serializers.ModelSerializer):
+class ListingSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     listed_by = UserSerializer(read_only=True)
     textbook = TextbookSerializer(read_only=True)
     textbook_id = serializers.PrimaryKeyRelatedField(
@@ -60,17 +89,74 @@ class ListingSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('id', 'listed_by', 'created_at', 'views')
     
-class BookshopProfileSerializer(serializers.ModelSerializer):
+class ListingRowSerializer:
+    """
+    Read-only serializer for listing feeds. Works from .values() rows instead
+    of model instances, fetching only the requested columns, and hands
+    datetimes/UUIDs to the renderer as-is. The shape matches ListingSerializer
+    except that `listed_by` carries only the seller's public fields and
+    `textbook` only what listing cards display.
+    """
+    listing_fields = ('id', 'listing_type', 'condition', 'price', 'description', 'is_active', 'created_at', 'views')
+    seller_fields = ('id', 'username', 'user_type', 'rating', 'review_count', 'location')
+    textbook_fields = ('id', 'title', 'author', 'isbn', 'grade', 'subject', 'publisher', 'cover_image')
+
+    def __init__(self, queryset, context=None):
+        self.queryset = queryset
+        self.context = context or {}
+
+    @property
+    def data(self):
+        with measure_serializer():
+            return self._rows()
+
+    def _rows(self):
+        request = self.context.get('request')
+        wanted = requested_fields(request)
+        top = [name for name in self.listing_fields if wanted is None or name in wanted]
+        nested = [
+            (name, fields) for name, fields in (('listed_by', self.seller_fields), ('textbook', self.textbook_fields))
+            if wanted is None or name in wanted
+        ]
+        columns = top + [f'{name}__{field}' for name, fields in nested for field in fields]
+
+        results = []
+        for row in self.queryset.values(*columns):
+            item = {name: row[name] for name in top}
+            if 'price' in item:
+                item['price'] = str(item['price'])
+            for name, fields in nested:
+                item[name] = {field: row[f'{name}__{field}'] for field in fields}
+            results.append(item)
+
+        if any(name == 'textbook' for name, _ in nested):
+            self._cover_urls(results, request)
+        return results
+
+    def _cover_urls(self, results, request):
+        # Same URL ImageField would produce, without building a FieldFile per row
+        urls = {}
+        for item in results:
+            name = item['textbook']['cover_image']
+            if not name:
+                item['textbook']['cover_image'] = None
+                continue
+            if name not in urls:
+                url = default_storage.url(name)
+                urls[name] = request.build_absolute_uri(url) if request is not None else url
+            item['textbook']['cover_image'] = urls[name]
+
+class BookshopProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = BookshopProfile
         fields = '__all__'
 
-class SchoolProfileSerializer(serializers.ModelSerializer):
+class SchoolProfileSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = SchoolProfile
         fields = '__all__'
 
-class BookListSerializer(serializers.ModelSerializer):
+class BookListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     textbooks = TextbookSerializer(many=True, read_only=True)
     school = SchoolProfileSerializer(read_only=True)
 
@@ -78,6 +164,13 @@ class BookListSerializer(serializers.ModelSerializer):
         model = BookList
         fields = '__all__'
 
+class ChildSerializer(serializers.ModelSerializer):
+    school_name = serializers.CharField(source='school.school_name', read_only=True)
+
+    class Meta:
+        model = Child
+        fields = ['id', 'name', 'school', 'school_name', 'grade']
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     class Meta:
@@ -99,6 +192,7 @@ class SwapRequestSerializer(serializers.ModelSerializer):
     requested_listing = ListingSerializer(read_only=True)
     offered_listing = ListingSerializer(read_only=True)
     delivery_id = serializers.SerializerMethodField()
+    match_size = serializers.IntegerField(source='match.size', read_only=True, default=None)
 
     requested_listing_id = serializers.PrimaryKeyRelatedField(
         queryset=Listing.objects.all(), source='requested_listing', write_only=True
@@ -113,9 +207,9 @@ class SwapRequestSerializer(serializers.ModelSerializer):
             'id', 'sender', 'receiver', 'status', 'created_at',
             'requested_listing', 'offered_listing',
             'requested_listing_id', 'offered_listing_id',
-            'delivery_id'
+            'delivery_id', 'match', 'match_size'
         ]
-        read_only_fields = ['id', 'sender', 'receiver', 'status', 'created_at']
+        read_only_fields = ['id', 'sender', 'receiver', 'status', 'created_at', 'match']
 
     def get_delivery_id(self, obj):
         if hasattr(obj, 'delivery'):
@@ -220,11 +314,12 @@ class DeliverySerializer(serializers.ModelSerializer):
 class ConversationSerializer(serializers.ModelSerializer):
     other_user = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
     listing = ListingSerializer(read_only=True)
     delivery = DeliverySerializer(read_only=True)
     class Meta:
         model = Conversation
-        fields = ['id', 'other_user', 'last_message', 'updated_at', 'listing', 'delivery']
+        fields = ['id', 'other_user', 'last_message', 'unread_count', 'updated_at', 'listing', 'delivery']
 
     def get_other_user(self, obj):
         request = self.context.get('request')
@@ -238,6 +333,10 @@ class ConversationSerializer(serializers.ModelSerializer):
         last_msg = obj.messages.last()
         return last_msg.content if last_msg else ""
 
+    def get_unread_count(self, obj):
+        # Annotated by ConversationListView
+        return getattr(obj, 'unread_count', None)
+
     def get_delivery(self, obj):
         if hasattr(obj, 'delivery'):
              d = obj.delivery
@@ -259,12 +358,21 @@ class CartItemSerializer(serializers.ModelSerializer):
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total = serializers.SerializerMethodField()
+    count = serializers.SerializerMethodField()
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total']
+        fields = ['id', 'items', 'total', 'count']
 
+    # CartView annotates the total and prefetches items with their listings,
+    # so neither of these queries per item
     def get_total(self, obj):
-        return sum(item.listing.price for item in obj.items.all())
+        total = getattr(obj, 'items_total', None)
+        if total is None:
+            total = obj.items.aggregate(total=Sum('listing__price'))['total']
+        return total or Decimal('0.00')
+
+    def get_count(self, obj):
+        return len(obj.items.all())
 
 class ReviewSerializer(serializers.ModelSerializer):
     reviewer = UserSerializer(read_only=True)
@@ -0,0 +1,244 @@
+import hashlib
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from .models import BookList, Child, Delivery, Listing, SwapMatch, SwapRequest
+from . import notifications, response_cache
+
+# Swap matchmaking. Parents "want" the textbooks on their children's class
+# book lists that they don't already have, and "have" their active exchange
+# listings. Parent A points at parent B when B has a book A wants; a swap is
+# a cycle in that graph - a direct pair or a 3-4 parent ring.
+#
+# The graph is never built whole. A listing or child change only creates
+# cycles through its owner, so matching runs a bounded search out from that
+# one parent (a few queries per hop, capped fan-out) and proposes what it
+# finds as SwapRequest legs grouped under a SwapMatch.
+
+MAX_CYCLE_LENGTH = 4
+HOLDERS_PER_BOOK = 20   # candidate listings considered per wanted textbook
+MAX_PATHS = 500         # open paths carried to the next hop
+
+OPEN_SWAP_STATUSES = ('pending', 'accepted')
+
+def _available_listings():
+    # Active exchange listings not already tied up in an open swap
+    return (
+        Listing.objects.filter(listing_type='exchange', is_active=True)
+        .exclude(swap_requests_received__status__in=OPEN_SWAP_STATUSES)
+        .exclude(swap_requests_sent__status__in=OPEN_SWAP_STATUSES)
+    )
+
+def wanted_textbooks(parent_ids):
+    """Map parent id -> set of textbook ids their children need and they don't already list."""
+    parent_ids = set(parent_ids)
+    wants = {parent_id: set() for parent_id in parent_ids}
+    if not parent_ids:
+        return wants
+
+    needed = (
+        Child.objects.filter(
+            parent_id__in=parent_ids,
+            school__book_lists__grade=F('grade'),
+            school__book_lists__textbooks__isnull=False,
+        )
+        .values_list('parent_id', 'school__book_lists__textbooks')
+        .distinct()
+    )
+    for parent_id, textbook_id in needed:
+        wants[parent_id].add(textbook_id)
+
+    owned = (
+        Listing.objects.filter(listed_by_id__in=parent_ids, is_active=True)
+        .values_list('listed_by_id', 'textbook_id')
+        .distinct()
+    )
+    for parent_id, textbook_id in owned:
+        wants[parent_id].discard(textbook_id)
+    return wants
+
+def _holders(textbook_ids):
+    # textbook id -> [(listing id, owner id)], oldest listings first
+    holders = defaultdict(list)
+    if not textbook_ids:
+        return holders
+    rows = (
+        _available_listings()
+        .filter(textbook_id__in=textbook_ids)
+        .order_by('created_at')
+        .values_list('id', 'textbook_id', 'listed_by_id')[:HOLDERS_PER_BOOK * len(textbook_ids)]
+    )
+    for listing_id, textbook_id, owner_id in rows:
+        if len(holders[textbook_id]) < HOLDERS_PER_BOOK:
+            holders[textbook_id].append((listing_id, owner_id))
+    return holders
+
+def find_cycles(parent_id, max_length=MAX_CYCLE_LENGTH):
+    """
+    Find swap cycles through one parent, shortest first. Each cycle is a
+    (parents, listings) pair where parents[i] receives listings[i] from the
+    next parent round the ring.
+    """
+    offered = dict(
+        _available_listings().filter(listed_by_id=parent_id)
+        .order_by('created_at')
+        .values_list('textbook_id', 'id')
+    )
+    if not offered:
+        return []
+
+    wants = wanted_textbooks([parent_id])
+    if not wants[parent_id]:
+        return []
+
+    cycles = []
+    paths = [((parent_id,), ())]
+    for _ in range(max_length - 1):
+        holders = _holders(set().union(*(wants[parents[-1]] for parents, _ in paths)))
+
+        next_paths = []
+        for parents, listings in paths:
+            for textbook_id in wants[parents[-1]]:
+                for listing_id, owner_id in holders.get(textbook_id, ()):
+                    if owner_id not in parents:
+                        next_paths.append((parents + (owner_id,), listings + (listing_id,)))
+        if not next_paths:
+            break
+        next_paths = next_paths[:MAX_PATHS]
+
+        wants.update(wanted_textbooks({parents[-1] for parents, _ in next_paths} - wants.keys()))
+        for parents, listings in next_paths:
+            # Close the ring if the last parent wants something we offer
+            for textbook_id in wants[parents[-1]]:
+                if textbook_id in offered:
+                    cycles.append((parents, listings + (offered[textbook_id],)))
+                    break
+        paths = next_paths
+    return cycles
+
+def _signature(listings):
+    return hashlib.sha256(','.join(sorted(str(listing_id) for listing_id in listings)).encode()).hexdigest()
+
+def _legs(parents, listings):
+    # parents[i] asks the next parent for listings[i] and puts up the listing
+    # the previous parent receives from them. A pair only needs one request.
+    size = len(parents)
+    legs = []
+    for i in range(1 if size == 2 else size):
+        legs.append(SwapRequest(
+            sender_id=parents[i],
+            receiver_id=parents[(i + 1) % size],
+            requested_listing_id=listings[i],
+            offered_listing_id=listings[i - 1],
+        ))
+    return legs
+
+def propose_for_parent(parent_id, limit=5):
+    """Search for cycles through a parent and store up to `limit` new proposals."""
+    used = set()
+    proposed = []
+    for parents, listings in find_cycles(parent_id):
+        if len(proposed) >= limit:
+            break
+        if used.intersection(listings):
+            continue
+
+        legs = _legs(parents, listings)
+        previously = SwapRequest.objects.filter(
+            Q(*[Q(requested_listing_id=leg.requested_listing_id, offered_listing_id=leg.offered_listing_id) for leg in legs], _connector=Q.OR)
+        ).exists()
+        if previously:
+            # Already proposed, or declined before
+            continue
+
+        try:
+            with transaction.atomic():
+                match = SwapMatch.objects.create(signature=_signature(listings), size=len(parents))
+                for leg in legs:
+                    leg.match = match
+                SwapRequest.objects.bulk_create(legs)
+                for leg in legs:
+                    notifications.publish([leg.receiver_id], 'swap_received', swap_id=leg.id, match_id=match.id)
+        except IntegrityError:
+            continue
+        used.update(listings)
+        proposed.append(match)
+    return proposed
+
+def propose_for_booklist(booklist_id, limit=200):
+    """Re-run matching for parents with a child in a book list's class."""
+    book_list = BookList.objects.filter(id=booklist_id).values('school_id', 'grade').first()
+    if not book_list:
+        return []
+    parent_ids = (
+        Child.objects.filter(school_id=book_list['school_id'], grade=book_list['grade'])
+        .values_list('parent_id', flat=True)
+        .distinct()[:limit]
+    )
+    proposed = []
+    for parent_id in parent_ids:
+        proposed.extend(propose_for_parent(parent_id))
+    return proposed
+
+def propose_all():
+    """Full pass over every parent with exchange listings (see `manage.py match_swaps`)."""
+    parent_ids = list(
+        _available_listings().filter(listed_by__children__isnull=False)
+        .values_list('listed_by_id', flat=True)
+        .distinct()
+    )
+    return sum(len(propose_for_parent(parent_id)) for parent_id in parent_ids)
+
+def expire_matches_for_listings(listing_ids):
+    """Withdraw open proposals that include listings which are no longer available."""
+    match_ids = list(
+        SwapRequest.objects.filter(
+            Q(requested_listing_id__in=listing_ids) | Q(offered_listing_id__in=listing_ids),
+            match__status='proposed',
+        ).values_list('match_id', flat=True)
+    )
+    if not match_ids:
+        return 0
+    with transaction.atomic():
+        SwapRequest.objects.filter(match_id__in=match_ids, status='pending').update(status='rejected')
+        return SwapMatch.objects.filter(id__in=match_ids, status='proposed').update(status='expired')
+
+def finish_match_leg(swap):
+    """
+    Record one participant accepting their leg of a multi-parent swap. Once
+    every leg is accepted the listings are taken off the market and a
+    delivery is opened per leg. Returns the number of legs still waiting.
+    """
+    with transaction.atomic():
+        match = SwapMatch.objects.select_for_update().get(id=swap.match_id)
+        if match.status != 'proposed':
+            return None
+        SwapRequest.objects.filter(id=swap.id).update(status='accepted')
+        legs = list(match.legs.select_related('sender', 'receiver'))
+        waiting = sum(1 for leg in legs if leg.status != 'accepted' and leg.id != swap.id)
+        if waiting:
+            return waiting
+
+        match.status = 'accepted'
+        match.save(update_fields=['status', 'updated_at'])
+        listing_ids = {leg.requested_listing_id for leg in legs}
+        Listing.objects.filter(id__in=listing_ids).update(is_active=False)
+        response_cache.bump(Listing)
+        expire_matches_for_listings(listing_ids)
+        Delivery.objects.bulk_create([
+            # Each leg's book travels from its holder to the parent who asked for it
+            Delivery(
+                swap=leg,
+                pickup_location=leg.receiver.location,
+                dropoff_location=leg.sender.location,
+                transport_cost=0,
+                status='pending',
+            )
+            for leg in legs
+        ])
+        return 0
+
+def reject_match(match_id):
+    with transaction.atomic():
+        SwapRequest.objects.filter(match_id=match_id, status__in=OPEN_SWAP_STATUSES).update(status='rejected')
+        SwapMatch.objects.filter(id=match_id, status='proposed').update(status='rejected')
@@ -0,0 +1,76 @@
+import asyncio
+from collections import defaultdict
+from contextlib import contextmanager
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.utils import timezone
+from .models import Conversation, Message
+from . import notifications
+
+# SYSTEM messages that workflow endpoints (swaps, checkout, deliveries) post
+# into chats. Nothing is written while the workflow runs: collect() gathers
+# the messages and, once the surrounding transaction commits, they are
+# inserted with one bulk_create, their conversations are bumped with one
+# UPDATE, and they go out in one batch to the open chat rooms (ChatConsumer's
+# chat_<id> groups) and to the other participants' notification sockets.
+# If the transaction rolls back, so do the messages.
+
+class SystemMessages:
+    def __init__(self):
+        self.messages = []
+
+    def post(self, conversation, sender, content):
+        self.messages.append(Message(conversation=conversation, sender=sender, content=content))
+
+@contextmanager
+def collect():
+    batch = SystemMessages()
+    yield batch
+    if batch.messages:
+        transaction.on_commit(lambda: write(batch.messages))
+
+def post(conversation, sender, content):
+    """collect() for a single message."""
+    with collect() as batch:
+        batch.post(conversation, sender, content)
+
+def write(messages):
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        Conversation.objects.filter(id__in={message.conversation_id for message in messages}).update(updated_at=timezone.now())
+    broadcast(messages)
+
+async def _send_all(layer, sends):
+    await asyncio.gather(*[layer.group_send(group, message) for group, message in sends])
+
+def broadcast(messages):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    participants = defaultdict(set)
+    for conversation_id, user_id in Conversation.participants.through.objects.filter(
+        conversation_id__in={message.conversation_id for message in messages}
+    ).values_list('conversation_id', 'user_id'):
+        participants[conversation_id].add(user_id)
+
+    sends = []
+    for message in messages:
+        sends.append((f'chat_{message.conversation_id}', {
+            'type': 'chat_message',
+            'message': message.content,
+            'sender_id': str(message.sender_id),
+            'id': str(message.id),
+            'timestamp': message.timestamp.isoformat(),
+        }))
+        notify = notifications.event_message('message', {
+            'conversation_id': message.conversation_id, 'message_id': message.id,
+            'sender_id': message.sender_id, 'preview': message.content[:100],
+        })
+        for user_id in participants[message.conversation_id] - {message.sender_id}:
+            sends.append((notifications.user_group(user_id), notify))
+    try:
+        async_to_sync(_send_all)(layer, sends)
+    except Exception as e:
+        # The messages are saved; clients pick them up on their next history sync
+        print(f"Could not broadcast {len(messages)} system messages: {e}")
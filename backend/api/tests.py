@@ -1,3 +1,1432 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import openpyxl
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipIf
+from unittest.mock import Mock, patch
+from django.db import connection, connections, transaction
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User, Wallet, WalletTransaction, WalletDailyRollup, Textbook, Listing, Order, Delivery, Cart, CartItem, Review, SchoolProfile, BookList, Child, SwapMatch, SwapRequest, Recommendation, BookshopProfile, Conversation, Message, Payment, PaymentCallback, ArchivedRecord, CodeSequence
+from . import archival, background, benchmarks, channel_layers, ledger, metrics, payment_callbacks, recommendations, swap_matching, system_messages, tracking_codes, ws_loadtest
+from .consumers import ChatConsumer, NotificationConsumer
+from .ledger import LedgerEntry
+from .middleware import TokenAuthMiddleware
 
-# Create your tests here.
+# SQLite serialises writers and the shared in-memory test database raises
+# "table is locked" instead of waiting, so thread tests need Postgres:
+#   DATABASE_URL=postgres://... python manage.py test api
+requires_concurrent_db = skipIf(connection.vendor == 'sqlite', "Concurrency tests need a server database")
+
+
+def run_in_threads(count, target):
+    errors = []
+
+    def worker(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='rider@test.com', username='rider', password='pass')
+        self.seller = User.objects.create_user(email='shop@test.com', username='shop', password='pass')
+
+    def test_credit_and_debit_update_balance_and_history(self):
+        ledger.credit(self.user, Decimal('150.00'), "Delivery Fee")
+        new_balance = ledger.debit(self.user, Decimal('50.00'), "Withdrawal Request")
+
+        self.assertEqual(new_balance, Decimal('100.00'))
+        self.assertEqual(
+            list(WalletTransaction.objects.filter(wallet__user=self.user).order_by('timestamp').values_list('transaction_type', 'amount')),
+            [('credit', Decimal('150.00')), ('debit', Decimal('50.00'))]
+        )
+
+    def test_overdraw_is_rejected_and_rolled_back(self):
+        ledger.credit(self.user, Decimal('20.00'), "Delivery Fee")
+
+        with self.assertRaises(ledger.InsufficientFunds):
+            ledger.post_entries([
+                LedgerEntry(self.seller.id, Decimal('10.00'), 'credit', "Sale"),
+                LedgerEntry(self.user.id, Decimal('30.00'), 'debit', "Withdrawal Request"),
+            ])
+
+        self.assertEqual(Wallet.objects.get(user=self.user).balance, Decimal('20.00'))
+        self.assertEqual(Wallet.objects.get(user=self.seller).balance, Decimal('0.00'))
+        self.assertEqual(WalletTransaction.objects.count(), 1)
+
+    def test_batch_credits_several_wallets(self):
+        ledger.post_entries([
+            LedgerEntry(self.user.id, Decimal('200.00'), 'credit', "Delivery Fee"),
+            LedgerEntry(self.seller.id, Decimal('300.00'), 'credit', "Sale of 'A'"),
+            LedgerEntry(self.seller.id, Decimal('450.50'), 'credit', "Sale of 'B'"),
+        ])
+
+        self.assertEqual(Wallet.objects.get(user=self.user).balance, Decimal('200.00'))
+        self.assertEqual(Wallet.objects.get(user=self.seller).balance, Decimal('750.50'))
+        self.assertEqual(WalletTransaction.objects.count(), 3)
+
+
+class CompleteJobSettlementTests(TestCase):
+    def setUp(self):
+        self.rider = User.objects.create_user(email='rider@test.com', username='rider', password='pass', user_type='rider', phone_number='0711000000')
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass')
+        self.shops = [
+            User.objects.create_user(email=f'shop{i}@test.com', username=f'shop{i}', password='pass', user_type='bookshop')
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.rider)
+
+    def make_delivery(self, books):
+        delivery = Delivery.objects.create(
+            pickup_location='Nyeri', dropoff_location='Karatina', status='shipped',
+            rider=self.rider, rider_phone=self.rider.phone_number, transport_cost=Decimal('120.00'),
+            tracking_code=f'TRK-T{books:04d}'
+        )
+        for i in range(books):
+            textbook = Textbook.objects.create(title=f'Book {books}-{i}', grade='4', subject='Maths')
+            listing = Listing.objects.create(
+                listed_by=self.shops[i % 2], textbook=textbook, listing_type='sell',
+                condition='good', price=Decimal('100.00'), description='-', is_active=False
+            )
+            delivery.orders.add(Order.objects.create(buyer=self.buyer, listing=listing, amount_paid=listing.price))
+        return delivery
+
+    def complete(self, delivery):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/deliveries/{delivery.id}/complete_job/')
+        self.assertEqual(response.status_code, 200, response.data)
+        return len(queries)
+
+    def test_settlement_credits_rider_and_sellers(self):
+        delivery = self.make_delivery(5)
+        self.complete(delivery)
+
+        self.assertEqual(Wallet.objects.get(user=self.rider).balance, Decimal('120.00'))
+        self.assertEqual(Wallet.objects.get(user=self.shops[0]).balance, Decimal('300.00'))
+        self.assertEqual(Wallet.objects.get(user=self.shops[1]).balance, Decimal('200.00'))
+
+        response = self.client.post(f'/api/deliveries/{delivery.id}/complete_job/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Wallet.objects.get(user=self.rider).balance, Decimal('120.00'))
+
+    def test_query_count_does_not_grow_with_books(self):
+        small = self.complete(self.make_delivery(1))
+        large = self.complete(self.make_delivery(20))
+        self.assertEqual(small, large)
+
+
+class EarningsRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_rollups_follow_ledger_writes_and_match_rebuild(self):
+        ledger.post_entries([
+            LedgerEntry(self.user.id, Decimal('300.00'), 'credit', "Sale of 'A'"),
+            LedgerEntry(self.user.id, Decimal('200.00'), 'credit', "Sale of 'B'"),
+        ])
+        ledger.debit(self.user, Decimal('120.00'), "Withdrawal Request")
+
+        rollup = WalletDailyRollup.objects.get(wallet__user=self.user)
+        live = (rollup.credit_total, rollup.debit_total, rollup.credit_count, rollup.debit_count)
+        self.assertEqual(live, (Decimal('500.00'), Decimal('120.00'), 2, 1))
+
+        ledger.rebuild_rollups()
+        rollup = WalletDailyRollup.objects.get(wallet__user=self.user)
+        self.assertEqual((rollup.credit_total, rollup.debit_total, rollup.credit_count, rollup.debit_count), live)
+
+    def test_summary_endpoint_reads_rollups(self):
+        ledger.credit(self.user, Decimal('250.00'), "Sale of 'A'")
+
+        for period in ('day', 'week', 'month'):
+            response = self.client.get('/api/earnings/summary/', {'period': period})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), 1)
+            self.assertEqual(response.data['results'][0]['net'], Decimal('250.00'))
+
+        self.assertEqual(self.client.get('/api/earnings/summary/', {'period': 'year'}).status_code, 400)
+        for since in ('2024-02-30', 'last week'):
+            response = self.client.get('/api/earnings/summary/', {'since': since})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('since', response.data)
+
+    def test_history_pages_through_every_row_once(self):
+        for i in range(45):
+            ledger.credit(self.user, Decimal('1.00'), f"Sale {i}")
+
+        seen, url = [], '/api/earnings/history/'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len(set(seen)), 45)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        textbook = Textbook.objects.create(title='Primary Maths 4', grade='4', subject='Maths')
+        for price in ('350.00', '400.00', '425.50'):
+            Listing.objects.create(
+                listed_by=self.shop, textbook=textbook, listing_type='sell',
+                condition='new', price=Decimal(price), description='In stock'
+            )
+        ledger.credit(self.shop, Decimal('350.00'), "Sale of 'Primary Maths 4'")
+        self.client = APIClient()
+        self.client.force_authenticate(self.shop)
+
+    def test_inventory_csv_streams_every_row(self):
+        response = self.client.get('/api/exports/inventory/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().strip().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith('Listing ID,Title'))
+
+    def test_ledger_xlsx_is_a_workbook(self):
+        response = self.client.get('/api/exports/ledger/', {'file_format': 'xlsx'})
+        self.assertEqual(response.status_code, 200)
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2], 'credit')
+
+    def test_unknown_export_and_format_are_rejected(self):
+        self.assertEqual(self.client.get('/api/exports/users/').status_code, 404)
+        self.assertEqual(self.client.get('/api/exports/orders/', {'file_format': 'pdf'}).status_code, 400)
+
+
+def make_listings(seller, count, price='300.00'):
+    listings = []
+    for i in range(count):
+        textbook = Textbook.objects.create(title=f'{seller.username} book {i}', grade='5', subject='English')
+        listings.append(Listing.objects.create(
+            listed_by=seller, textbook=textbook, listing_type='sell',
+            condition='good', price=Decimal(price), description='-'
+        ))
+    return listings
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass', location='Nyeri')
+        self.shops = [
+            User.objects.create_user(email=f'shop{i}@test.com', username=f'shop{i}', password='pass', user_type='bookshop', location='Karatina')
+            for i in range(2)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def checkout(self, listings):
+        return self.client.post('/api/orders/', {'listing_ids': [str(listing.id) for listing in listings]}, format='json')
+
+    def test_checkout_groups_orders_per_seller_and_clears_cart(self):
+        listings = make_listings(self.shops[0], 3) + make_listings(self.shops[1], 2)
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.bulk_create([CartItem(cart=cart, listing=listing) for listing in listings])
+
+        response = self.checkout(listings)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(Delivery.objects.count(), 2)
+        self.assertEqual(
+            sorted(delivery.orders.count() for delivery in Delivery.objects.all()),
+            [2, 3]
+        )
+        self.assertFalse(Listing.objects.filter(is_active=True).exists())
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_sold_listing_cannot_be_bought_again(self):
+        listing = make_listings(self.shops[0], 1)
+        self.assertEqual(self.checkout(listing).status_code, 201)
+        self.assertEqual(self.checkout(listing).status_code, 400)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        def queries_for(seller, count):
+            listings = make_listings(seller, count)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.checkout(listings).status_code, 201)
+            return len(queries)
+
+        self.assertEqual(queries_for(self.shops[0], 1), queries_for(self.shops[1], 15))
+
+
+class TrackingCodeTests(TestCase):
+    def test_permute_is_a_bijection(self):
+        numbers = range(1, 5001)
+        permuted = [tracking_codes.permute(number) for number in numbers]
+        self.assertEqual(len(set(permuted)), len(permuted))
+        self.assertTrue(all(0 <= value < 1 << tracking_codes.CODE_BITS for value in permuted))
+        self.assertEqual([tracking_codes.unpermute(value) for value in permuted], list(numbers))
+
+    def test_codes_fit_the_format_and_the_column(self):
+        max_length = Delivery._meta.get_field('tracking_code').max_length
+        codes = [tracking_codes.generate_tracking_code() for _ in range(20)]
+        codes.append(tracking_codes.CODE_PREFIX + tracking_codes.encode((1 << tracking_codes.CODE_BITS) - 1))
+        for code in codes:
+            self.assertRegex(code, r'^TRK-[0-9A-HJKMNP-TV-Z]{8}$')
+            self.assertLessEqual(len(code), max_length)
+        self.assertEqual(len(set(codes)), len(codes))
+
+    def test_consecutive_numbers_give_unrelated_codes(self):
+        codes = [tracking_codes.CODE_PREFIX + tracking_codes.encode(tracking_codes.permute(number)) for number in range(1, 1001)]
+        self.assertNotEqual(sorted(codes), codes)
+        # Neighbours share at most a character or two of prefix, never most of the code
+        shared = [len(os.path.commonprefix([a, b])) - len(tracking_codes.CODE_PREFIX) for a, b in zip(codes, codes[1:])]
+        self.assertLess(max(shared), 5)
+
+    def test_counter_table_hands_out_distinct_values(self):
+        with patch.object(tracking_codes.connection, 'vendor', 'sqlite'):
+            values = [tracking_codes.next_sequence_value() for _ in range(25)]
+        self.assertEqual(values, list(range(values[0], values[0] + 25)))
+        self.assertEqual(CodeSequence.objects.get(name=tracking_codes.SEQUENCE_NAME).last_value, values[-1])
+
+
+class CartTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass')
+        self.shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        self.listings = make_listings(self.shop, 6, price='150.00')
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_add_and_remove_return_compact_deltas(self):
+        first = self.client.post('/api/cart/', {'listing_id': str(self.listings[0].id)}, format='json')
+        second = self.client.post('/api/cart/', {'listing_id': str(self.listings[1].id)}, format='json')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(set(second.data), {'item_id', 'listing_id', 'created', 'total', 'count'})
+        self.assertEqual((second.data['total'], second.data['count']), (Decimal('300.00'), 2))
+
+        removed = self.client.delete('/api/cart/', {'item_id': str(first.data['item_id'])}, format='json')
+        self.assertEqual((removed.data['total'], removed.data['count']), (Decimal('150.00'), 1))
+
+    def test_full_cart_query_count_is_independent_of_size(self):
+        def queries_for_cart():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/api/cart/')
+            return len(queries), response
+
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, listing=self.listings[0])
+        small, _ = queries_for_cart()
+
+        CartItem.objects.bulk_create([CartItem(cart=cart, listing=listing) for listing in self.listings[1:]])
+        large, response = queries_for_cart()
+
+        self.assertEqual(small, large)
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(response.data['total'], Decimal('900.00'))
+
+
+@override_settings(BACKGROUND_TASKS_ASYNC=False)
+class PaymentCallbackTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass')
+        self.delivery = Delivery.objects.create(pickup_location='Karatina', dropoff_location='Nyeri', status='pending')
+        self.payload = {'Body': {'stkCallback': {'ResultCode': 0, 'CheckoutRequestID': 'ws-1'}}}
+
+    def pay(self):
+        return Payment.objects.create(
+            user=self.buyer, delivery=self.delivery, phone_number='0712345678', amount=Decimal('600'), transaction_code='ws-1'
+        )
+
+    def deliver(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return payment_callbacks.record_callback('mpesa', 'ws-1', self.payload)
+
+    def test_duplicate_deliveries_apply_once(self):
+        self.pay()
+        with patch.object(payment_callbacks.notifications, 'payment_confirmed') as payment_confirmed:
+            self.deliver()
+            self.deliver()
+            # ...and a sweep racing the worker
+            payment_callbacks.process_callback(PaymentCallback.objects.get().id)
+
+        callback = PaymentCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts), ('processed', 1))
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, 'paid')
+        payment_confirmed.assert_called_once()
+
+    def test_early_callback_is_applied_once_the_payment_is_saved(self):
+        self.deliver()
+        callback = PaymentCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts), ('failed', 1))
+        self.assertIn('ws-1', callback.last_error)
+
+        self.pay()
+        with self.captureOnCommitCallbacks(execute=True):
+            payment_callbacks.retry_reference('mpesa', 'ws-1')
+
+        callback.refresh_from_db()
+        self.assertEqual((callback.status, callback.attempts), ('processed', 2))
+        self.delivery.refresh_from_db()
+        self.assertEqual(self.delivery.status, 'paid')
+
+    def test_sweep_retries_failed_callbacks_up_to_the_cap(self):
+        with override_settings(PAYMENT_CALLBACK_MAX_ATTEMPTS=2):
+            self.deliver()
+            self.assertEqual(payment_callbacks.process_pending_callbacks(), 1)
+            self.assertEqual(payment_callbacks.process_pending_callbacks(), 0)
+        self.assertEqual(PaymentCallback.objects.get().attempts, 2)
+
+        self.pay()
+        self.assertEqual(payment_callbacks.process_pending_callbacks(), 1)
+        self.assertEqual(PaymentCallback.objects.get().status, 'processed')
+
+    def test_verify_returns_the_tracking_code_before_the_worker_runs(self):
+        Payment.objects.create(
+            user=self.buyer, delivery=self.delivery, amount=Decimal('600'), payment_method='card', paystack_ref='ps-1'
+        )
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        verified = Mock(json=Mock(return_value={'status': True, 'data': {'status': 'success', 'reference': 'ps-1'}}))
+
+        with patch('api.views.requests.get', return_value=verified), self.captureOnCommitCallbacks() as queued:
+            response = client.post('/api/payments/verify_paystack/', {'reference': 'ps-1'}, format='json')
+        code = response.data['tracking_code']
+        self.assertRegex(code, r'^TRK-')
+
+        for callback in queued:
+            callback()
+        self.delivery.refresh_from_db()
+        self.assertEqual((self.delivery.status, self.delivery.tracking_code), ('paid', code))
+
+    @override_settings(PAYMENT_CALLBACK_MAX_ATTEMPTS=2)
+    def test_provider_retries_stop_at_the_cap(self):
+        for _ in range(4):
+            self.deliver()
+        callback = PaymentCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts), ('failed', 2))
+
+
+class SellerRatingTests(TestCase):
+    def setUp(self):
+        self.shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        self.listing = make_listings(self.shop, 1)[0]
+        self.parents = [
+            User.objects.create_user(email=f'parent{i}@test.com', username=f'parent{i}', password='pass')
+            for i in range(3)
+        ]
+
+    def review(self, parent, rating):
+        return Review.objects.create(listing=self.listing, reviewer=parent, seller=self.shop, rating=rating)
+
+    def assertRating(self, rating, count):
+        self.shop.refresh_from_db()
+        self.assertAlmostEqual(self.shop.rating, rating)
+        self.assertEqual(self.shop.review_count, count)
+
+    def test_create_edit_and_delete_keep_rating_in_step(self):
+        first = self.review(self.parents[0], 5)
+        self.review(self.parents[1], 2)
+        self.assertRating(3.5, 2)
+
+        first.rating = 3
+        first.save()
+        self.assertRating(2.5, 2)
+
+        first.delete()
+        self.assertRating(2.0, 1)
+
+        Review.objects.all().delete()
+        self.assertRating(0.0, 0)
+
+    def test_soft_delete_and_restore_match_the_full_recompute(self):
+        first = self.review(self.parents[0], 5)
+        self.review(self.parents[1], 2)
+
+        first.soft_delete()
+        self.assertRating(2.0, 1)
+        first.save()   # re-saving a hidden review doesn't count it again
+        self.assertRating(2.0, 1)
+
+        first.is_deleted = False
+        first.save()
+        self.assertRating(3.5, 2)
+
+        first.soft_delete()
+        Review.all_objects.filter(pk=first.pk).delete()
+        self.assertRating(2.0, 1)
+        self.shop.update_rating()
+        self.assertRating(2.0, 1)
+
+    def test_review_write_cost_does_not_grow_with_review_count(self):
+        def queries_for(parent):
+            with CaptureQueriesContext(connection) as queries:
+                self.review(parent, 4)
+            return len(queries)
+
+        self.assertEqual(queries_for(self.parents[0]), queries_for(self.parents[1]))
+
+    def test_reconcile_command_repairs_drift(self):
+        self.review(self.parents[0], 4)
+        User.objects.filter(pk=self.shop.pk).update(rating=1.0, rating_sum=1, review_count=7)
+
+        call_command('reconcile_ratings', stdout=io.StringIO())
+        self.assertRating(4.0, 1)
+
+
+class SwapMatchingTests(TestCase):
+    def setUp(self):
+        school_user = User.objects.create_user(email='school@test.com', username='school', password='pass', user_type='school')
+        self.school = SchoolProfile.objects.create(user=school_user, school_name='Hill School', address='Nyeri')
+        self.books = [Textbook.objects.create(title=f'Book {i}', grade=str(i), subject='Maths') for i in range(3)]
+        self.parents = [
+            User.objects.create_user(email=f'parent{i}@test.com', username=f'parent{i}', password='pass', location=f'Town {i}')
+            for i in range(3)
+        ]
+
+    def needs(self, parent, grade, books):
+        book_list = BookList.objects.create(school=self.school, grade=grade, academic_year='2025')
+        book_list.textbooks.set(books)
+        Child.objects.create(parent=parent, school=self.school, grade=grade)
+
+    def offer(self, parent, book):
+        return Listing.objects.create(
+            listed_by=parent, textbook=book, listing_type='exchange',
+            condition='good', price=0, description='-'
+        )
+
+    def make_ring(self):
+        # parent i needs book i+1 and has book i
+        for i, parent in enumerate(self.parents):
+            self.needs(parent, f'Grade {i}', [self.books[(i + 1) % 3]])
+        return [self.offer(parent, self.books[i]) for i, parent in enumerate(self.parents)]
+
+    def test_direct_match_becomes_one_swap_request(self):
+        self.needs(self.parents[0], 'Grade 1', [self.books[1]])
+        self.needs(self.parents[1], 'Grade 2', [self.books[0]])
+        mine, theirs = self.offer(self.parents[0], self.books[0]), self.offer(self.parents[1], self.books[1])
+
+        proposed = swap_matching.propose_for_parent(self.parents[0].id)
+
+        self.assertEqual([match.size for match in proposed], [2])
+        swap = SwapRequest.objects.get()
+        self.assertEqual((swap.sender, swap.receiver), (self.parents[0], self.parents[1]))
+        self.assertEqual((swap.requested_listing, swap.offered_listing), (theirs, mine))
+
+    def test_three_way_cycle_is_proposed_once(self):
+        listings = self.make_ring()
+
+        proposed = swap_matching.propose_for_parent(self.parents[0].id)
+
+        self.assertEqual([match.size for match in proposed], [3])
+        legs = {swap.sender_id: swap for swap in SwapRequest.objects.all()}
+        self.assertEqual(len(legs), 3)
+        for i, parent in enumerate(self.parents):
+            self.assertEqual(legs[parent.id].requested_listing, listings[(i + 1) % 3])
+            self.assertEqual(legs[parent.id].receiver, self.parents[(i + 1) % 3])
+        self.assertEqual(swap_matching.propose_for_parent(self.parents[1].id), [])
+
+    def test_ring_completes_when_every_parent_accepts(self):
+        listings = self.make_ring()
+        swap_matching.propose_for_parent(self.parents[0].id)
+        client = APIClient()
+
+        waiting = []
+        for swap in SwapRequest.objects.order_by('receiver__username'):
+            client.force_authenticate(swap.receiver)
+            response = client.post(f'/api/swaps/{swap.id}/accept/')
+            self.assertEqual(response.status_code, 200, response.data)
+            waiting.append(response.data['waiting_for'])
+
+        self.assertEqual(waiting, [2, 1, 0])
+        self.assertEqual(SwapMatch.objects.get().status, 'accepted')
+        self.assertEqual(Delivery.objects.count(), 3)
+        self.assertFalse(Listing.objects.filter(id__in=[listing.id for listing in listings], is_active=True).exists())
+
+    def test_withdrawn_listing_expires_the_proposal(self):
+        listings = self.make_ring()
+        swap_matching.propose_for_parent(self.parents[0].id)
+
+        listings[1].is_active = False
+        listings[1].save()
+
+        self.assertEqual(SwapMatch.objects.get().status, 'expired')
+        self.assertFalse(SwapRequest.objects.filter(status='pending').exists())
+
+    def test_sold_listing_expires_the_proposal(self):
+        listings = self.make_ring()
+        swap_matching.propose_for_parent(self.parents[0].id)
+        buyer = User.objects.create_user(email='buyer@test.com', username='buyer', password='pass', location='Nyeri')
+        client = APIClient()
+        client.force_authenticate(buyer)
+
+        response = client.post('/api/orders/', {'listing_ids': [str(listings[1].id)]}, format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(SwapMatch.objects.get().status, 'expired')
+        self.assertFalse(SwapRequest.objects.filter(status='pending').exists())
+
+    @override_settings(BACKGROUND_TASKS_ASYNC=False)
+    def test_new_listing_triggers_matching(self):
+        for i, parent in enumerate(self.parents[:2]):
+            self.needs(parent, f'Grade {i}', [self.books[1 - i]])
+        self.offer(self.parents[0], self.books[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.offer(self.parents[1], self.books[1])
+
+        self.assertEqual(SwapMatch.objects.get().size, 2)
+
+
+@override_settings(RECOMMENDATIONS_GEOCODE=False)
+class RecommendationTests(TestCase):
+    def setUp(self):
+        school_user = User.objects.create_user(email='school@test.com', username='school', password='pass', user_type='school')
+        school = SchoolProfile.objects.create(user=school_user, school_name='Hill School', address='Nyeri')
+        self.maths, self.english, self.other = [
+            Textbook.objects.create(title=title, grade='4', subject=title) for title in ('Maths', 'English', 'Art')
+        ]
+        book_list = BookList.objects.create(school=school, grade='Grade 4', academic_year='2025')
+        book_list.textbooks.set([self.maths, self.english])
+        self.parent = User.objects.create_user(email='parent@test.com', username='parent', password='pass', location='Karatina')
+        Child.objects.create(parent=self.parent, school=school, grade='Grade 4')
+        self.shops = [
+            User.objects.create_user(email=f'shop{i}@test.com', username=f'shop{i}', password='pass', user_type='bookshop', location=location)
+            for i, location in enumerate(['Karatina', 'Nyeri'])
+        ]
+
+    def list_book(self, seller, textbook, price, condition='good'):
+        return Listing.objects.create(
+            listed_by=seller, textbook=textbook, listing_type='sell',
+            condition=condition, price=Decimal(price), description='-'
+        )
+
+    def test_only_needed_books_are_recommended_cheapest_and_nearest_first(self):
+        near_cheap = self.list_book(self.shops[0], self.maths, '300.00')
+        far_cheap = self.list_book(self.shops[1], self.maths, '300.00')
+        near_dear = self.list_book(self.shops[0], self.maths, '900.00', condition='fair')
+        self.list_book(self.shops[0], self.other, '100.00')
+
+        recommendations.refresh_parent(self.parent.id)
+
+        ranked = list(Recommendation.objects.filter(parent=self.parent).order_by('-score').values_list('listing_id', flat=True))
+        self.assertEqual(ranked, [near_cheap.id, far_cheap.id, near_dear.id])
+
+    def test_only_the_cheapest_listings_per_book_are_considered(self):
+        for price in ('500.00', '300.00', '400.00'):
+            self.list_book(self.shops[0], self.maths, price)
+        self.list_book(self.shops[1], self.english, '250.00')
+
+        with patch.object(recommendations, 'LISTINGS_PER_BOOK', 2):
+            recommendations.refresh_parent(self.parent.id)
+
+        recommended = set(Recommendation.objects.filter(parent=self.parent).values_list('listing__price', flat=True))
+        self.assertEqual(recommended, {Decimal('300.00'), Decimal('400.00'), Decimal('250.00')})
+
+    def test_feed_is_served_in_one_query(self):
+        for shop in self.shops:
+            self.list_book(shop, self.maths, '300.00')
+            self.list_book(shop, self.english, '250.00')
+        recommendations.refresh_all()
+        client = APIClient()
+        client.force_authenticate(self.parent)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/listings/recommended/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(queries), 1)
+
+    def test_sold_listings_drop_out_of_the_feed(self):
+        listing = self.list_book(self.shops[0], self.maths, '300.00')
+        recommendations.refresh_parent(self.parent.id)
+        Listing.objects.filter(id=listing.id).update(is_active=False)
+        client = APIClient()
+        client.force_authenticate(self.parent)
+
+        self.assertEqual(client.get('/api/listings/recommended/').data, [])
+
+    def test_first_visit_queues_the_refresh_instead_of_scoring_inline(self):
+        self.list_book(self.shops[0], self.maths, '300.00')
+        client = APIClient()
+        client.force_authenticate(self.parent)
+
+        with patch.object(background, 'submit_once') as submit_once:
+            self.assertEqual(client.get('/api/listings/recommended/').data, [])
+        submit_once.assert_called_once_with(recommendations.refresh_parent, self.parent.id)
+        self.assertFalse(Recommendation.objects.exists())
+
+        # Nobody to recommend for: nothing is queued at all
+        client.force_authenticate(self.shops[0])
+        with patch.object(background, 'submit_once') as submit_once:
+            self.assertEqual(client.get('/api/listings/recommended/').data, [])
+        submit_once.assert_not_called()
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        self.listings = make_listings(self.shop, 3)
+        self.client = APIClient()
+
+    def feed(self, **headers):
+        return self.client.get('/api/listings/', **headers)
+
+    def test_repeat_anonymous_feed_skips_the_database(self):
+        first = self.feed()
+        with CaptureQueriesContext(connection) as queries:
+            second = self.feed()
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.feed()['ETag']
+        self.assertEqual(self.feed(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_saves_and_bulk_updates_invalidate(self):
+        etag = self.feed()['ETag']
+        make_listings(self.shop, 1)
+        response = self.feed(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, len(response.data)), (200, 4))
+
+        buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass')
+        client = APIClient()
+        client.force_authenticate(buyer)
+        client.post('/api/orders/', {'listing_ids': [str(self.listings[0].id)]}, format='json')
+        self.assertEqual(len(self.feed().data), 3)
+
+    def test_view_counter_does_not_invalidate(self):
+        etag = self.feed()['ETag']
+        self.client.get(f'/api/listings/{self.listings[0].id}/')
+        self.assertEqual(self.feed(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_signed_in_feed_is_not_cached(self):
+        self.client.force_authenticate(self.shop)
+        response = self.feed()
+        self.assertNotIn('ETag', response)
+
+
+class LeanListingFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shop = User.objects.create_user(
+            email='shop@test.com', username='shop', password='pass', user_type='bookshop',
+            phone_number='0700000000', national_id='12345678'
+        )
+        self.listings = make_listings(self.shop, 3)
+        self.client = APIClient()
+
+    def test_rows_match_the_model_serializer(self):
+        self.client.force_authenticate(self.shop)
+        detail = json.loads(self.client.get(f'/api/listings/{self.listings[0].id}/').content)
+        feed = json.loads(self.client.get('/api/listings/').content)
+
+        row = next(item for item in feed if item['id'] == detail['id'])
+        for key, value in row.items():
+            if isinstance(value, dict):
+                for nested_key, nested_value in value.items():
+                    if nested_key in detail[key]:
+                        self.assertEqual(nested_value, detail[key][nested_key], f'{key}.{nested_key}')
+            else:
+                self.assertEqual(value, detail[key], key)
+
+    def test_feed_hides_private_seller_fields(self):
+        seller = json.loads(self.client.get('/api/listings/').content)[0]['listed_by']
+        self.assertNotIn('phone_number', seller)
+        self.assertNotIn('national_id', seller)
+
+    def test_sparse_fieldsets(self):
+        feed = json.loads(self.client.get('/api/listings/', {'fields': 'id,price'}).content)
+        self.assertEqual(set(feed[0]), {'id', 'price'})
+
+        inventory = self.client.get(f'/api/bookshops/{self.make_shop_profile().id}/inventory/', {'fields': 'id,textbook'})
+        self.assertEqual(set(json.loads(inventory.content)[0]), {'id', 'textbook'})
+
+        textbooks = json.loads(self.client.get('/api/textbooks/', {'fields': 'title'}).content)
+        self.assertEqual(set(textbooks[0]), {'title'})
+
+        # Writes ignore ?fields=: nothing the client sent is dropped from validation or save
+        self.client.force_authenticate(self.shop)
+        created = self.client.post('/api/textbooks/?fields=id', {'title': 'Kiswahili 5', 'grade': '5', 'subject': 'Kiswahili'}, format='json')
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(Textbook.objects.get(id=created.data['id']).subject, 'Kiswahili')
+        self.assertIn('title', created.data)
+
+    def test_raw_decimals_render_as_numbers(self):
+        ledger.credit(self.shop, Decimal('350.50'), "Sale of 'Primary Maths 4'")
+        self.client.force_authenticate(self.shop)
+        earnings = json.loads(self.client.get('/api/earnings/').content)
+        self.assertEqual(earnings['balance'], 350.5)
+
+    def make_shop_profile(self):
+        return BookshopProfile.objects.create(user=self.shop, shop_name='Shop', address='Nyeri', phone_number='0700000000', opening_hours='9-5')
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.store.reset()
+        self.shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        make_listings(self.shop, 3)
+        self.client = APIClient()
+
+    def test_server_timing_and_per_view_summary(self):
+        response = self.client.get('/api/textbooks/')
+
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="1 queries", serializer;dur=[\d.]+, total;dur=[\d.]+')
+        summary = metrics.store.snapshot()['views']['textbook-list']
+        self.assertEqual((summary['count'], summary['max_queries']), (1, 1))
+        self.assertGreater(summary['avg_serializer_ms'], 0)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_query_log_captures_the_calling_code(self):
+        # Every query is "slow" here; keep the printed stacks out of the test output
+        with patch('sys.stdout', new_callable=io.StringIO) as output:
+            self.client.get('/api/textbooks/')
+        self.assertIn('Slow query', output.getvalue())
+
+        slow = metrics.store.snapshot()['slow_queries']
+        self.assertTrue(slow)
+        self.assertTrue(any('api/response_cache.py' in line for entry in slow for line in entry['stack']))
+
+    def test_metrics_endpoint_is_admin_only(self):
+        self.client.force_authenticate(self.shop)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        admin = User.objects.create_superuser(email='admin@test.com', username='admin', password='pass')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('metrics', response.data['views'])
+
+
+class BenchmarkTests(TestCase):
+    def test_seeded_scenarios_all_succeed(self):
+        counts = benchmarks.seed(scale=0.3, seed=1)
+        self.assertEqual(counts['listings'], Listing.objects.count())
+
+        cache.set('shared-key', 'kept')
+        results = benchmarks.run_scenarios(repeat=1, seed=1)
+        self.assertEqual(cache.get('shared-key'), 'kept')
+        self.assertEqual(results['checkout']['runs'], 1)
+        for name, result in results.items():
+            self.assertTrue(all(200 <= code < 300 for code in result['status_codes']), name)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WebsocketLoadTestTests(TransactionTestCase):
+    def test_fan_out_reaches_every_group_member(self):
+        results = async_to_sync(ws_loadtest.run)(
+            ws_loadtest.communicator_factory(),
+            deliveries=2, riders=1, watchers=3, rooms=1, chatters=3,
+            location_rate=10, chat_rate=5, duration=0.3,
+        )
+
+        self.assertEqual(results['tracking']['connections'], 8)
+        self.assertEqual(results['chat']['connections'], 3)
+        for stream in results.values():
+            self.assertGreater(stream['received'], 0)
+            self.assertEqual(stream['lost'], 0)
+        self.assertFalse(User.objects.filter(username__startswith=ws_loadtest.USERNAME_PREFIX).exists())
+
+
+@override_settings(READ_RECEIPT_DELAY=0.05)
+class ChatReceiptTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email='alice@test.com', username='alice', password='pass')
+        self.bob = User.objects.create_user(email='bob@test.com', username='bob', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        start = timezone.now() - timedelta(minutes=5)
+        self.messages = []
+        for i, sender in enumerate([self.bob, self.alice, self.bob, self.bob]):
+            message = Message.objects.create(conversation=self.conversation, sender=sender, content=f'message {i}')
+            Message.objects.filter(id=message.id).update(timestamp=start + timedelta(seconds=i))
+            self.messages.append(message)
+
+    def connect(self, user=None):
+        application = TokenAuthMiddleware(ChatConsumer.as_asgi())
+        query = f'?token={AccessToken.for_user(user)}' if user else ''
+        communicator = WebsocketCommunicator(application, f'/ws/chat/{self.conversation.id}/{query}')
+        communicator.scope['url_route'] = {'kwargs': {'room_id': str(self.conversation.id)}}
+        return communicator
+
+    async def exchange(self):
+        alice, bob = self.connect(self.alice), self.connect(self.bob)
+        await alice.connect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user_ids': [str(self.alice.id)]})
+        await bob.connect()
+        both = sorted([str(self.alice.id), str(self.bob.id)])
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user_ids': both})
+        self.assertEqual(await bob.receive_json_from(), {'type': 'presence', 'user_ids': both})
+
+        await bob.send_json_to({'type': 'typing', 'is_typing': True})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'typing', 'user_id': str(self.bob.id), 'is_typing': True})
+        await bob.receive_json_from()
+
+        # Two markers inside the delay become one receipt for the later one
+        await alice.send_json_to({'type': 'read', 'message_id': str(self.messages[1].id)})
+        await alice.send_json_to({'type': 'read', 'message_id': str(self.messages[2].id)})
+        receipt = {'type': 'read', 'user_id': str(self.alice.id), 'message_id': str(self.messages[2].id)}
+        self.assertEqual(await bob.receive_json_from(timeout=2), receipt)
+        self.assertEqual(await alice.receive_json_from(timeout=2), receipt)
+        self.assertTrue(await alice.receive_nothing(timeout=0.2))
+
+        await bob.disconnect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user_ids': [str(self.alice.id)]})
+        await alice.disconnect()
+
+    def test_read_markers_typing_and_presence(self):
+        async_to_sync(self.exchange)()
+
+        read = dict(Message.objects.values_list('content', 'is_read'))
+        # Only the other side's messages up to the marker
+        self.assertEqual(read, {'message 0': True, 'message 1': False, 'message 2': True, 'message 3': False})
+
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        self.assertEqual(client.get('/api/conversations/').data[0]['unread_count'], 1)
+
+    async def intrude(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()   # presence
+        outsider = await database_sync_to_async(User.objects.create_user)(email='eve@test.com', username='eve', password='pass')
+        for socket in (self.connect(outsider), self.connect()):
+            connected, _ = await socket.connect()
+            self.assertFalse(connected)
+        # Nobody joined as far as the room is concerned
+        self.assertTrue(await alice.receive_nothing(timeout=0.2))
+        await alice.disconnect()
+
+    def test_only_participants_can_join(self):
+        async_to_sync(self.intrude)()
+
+    async def spoof(self):
+        bob = self.connect(self.bob)
+        await bob.connect()
+        await bob.receive_json_from()   # presence
+        await bob.send_json_to({'message': 'it was me', 'sender_id': self.alice.id})
+        event = await bob.receive_json_from()
+        await bob.disconnect()
+        return event
+
+    def test_sender_is_the_socket_user_not_the_frame(self):
+        event = async_to_sync(self.spoof)()
+        self.assertEqual(event['sender_id'], str(self.bob.id))
+        self.assertEqual(Message.objects.get(content='it was me').sender_id, self.bob.id)
+
+
+class NotificationSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass', location='Nyeri')
+        self.seller = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop', location='Karatina')
+        self.rider = User.objects.create_user(email='rider@test.com', username='rider', password='pass', user_type='rider', phone_number='0700000001')
+        self.listings = make_listings(self.seller, 2)
+
+    def socket(self, user=None):
+        query = f'?token={AccessToken.for_user(user)}' if user else ''
+        return WebsocketCommunicator(TokenAuthMiddleware(NotificationConsumer.as_asgi()), f'/ws/notifications/{query}')
+
+    def post(self, user, url, data=None):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(url, data or {}, format='json')
+
+    def pay(self):
+        delivery = Delivery.objects.get()
+        Payment.objects.create(user=self.buyer, delivery=delivery, phone_number='0712345678', amount=Decimal('600'), transaction_code='ws-test')
+        callback = PaymentCallback.objects.create(provider='mpesa', reference='ws-test', payload={'Body': {'stkCallback': {'ResultCode': 0}}})
+        payment_callbacks.process_callback(callback.id)
+        delivery.refresh_from_db()
+        return delivery
+
+    async def workflow(self):
+        anonymous = self.socket()
+        connected, _ = await anonymous.connect()
+        self.assertFalse(connected)
+
+        buyer, seller, rider = self.socket(self.buyer), self.socket(self.seller), self.socket(self.rider)
+        for socket in (buyer, seller, rider):
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+
+        checkout = database_sync_to_async(self.post)
+        response = await checkout(self.buyer, '/api/orders/', {'listing_ids': [str(listing.id) for listing in self.listings]})
+        self.assertEqual(response.status_code, 201)
+        placed = await seller.receive_json_from()
+        self.assertEqual((placed['type'], placed['buyer'], placed['count']), ('order_placed', 'parent', 2))
+        chat = await seller.receive_json_from()
+        self.assertEqual(chat['type'], 'message')
+        self.assertTrue(chat['preview'].startswith('🔔 SYSTEM: I have purchased 2 books'))
+
+        delivery = await database_sync_to_async(self.pay)()
+        for socket in (buyer, seller):
+            self.assertEqual(await socket.receive_json_from(), {
+                'type': 'payment_confirmed', 'delivery_id': str(delivery.id), 'tracking_code': delivery.tracking_code,
+            })
+        self.assertEqual((await rider.receive_json_from())['type'], 'job_available')
+
+        response = await checkout(self.rider, f'/api/deliveries/{delivery.id}/accept_job/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await buyer.receive_json_from())['type'], 'message')
+        assigned = await buyer.receive_json_from()
+        self.assertEqual((assigned['type'], assigned['rider']), ('rider_assigned', 'rider'))
+        self.assertEqual(await rider.receive_json_from(), {'type': 'job_taken', 'delivery_id': str(delivery.id)})
+        self.assertTrue(await rider.receive_nothing(timeout=0.2))
+
+        for socket in (buyer, seller, rider):
+            await socket.disconnect()
+
+    def test_workflow_events_reach_each_party(self):
+        async_to_sync(self.workflow)()
+
+
+class SystemMessageTests(TransactionTestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass', location='Nyeri')
+        self.sellers = [
+            User.objects.create_user(email=f'shop{i}@test.com', username=f'shop{i}', password='pass', user_type='bookshop')
+            for i in range(2)
+        ]
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.buyer, self.sellers[0])
+
+    def chat_socket(self, user):
+        communicator = WebsocketCommunicator(
+            TokenAuthMiddleware(ChatConsumer.as_asgi()), f'/ws/chat/{self.conversation.id}/?token={AccessToken.for_user(user)}'
+        )
+        communicator.scope['url_route'] = {'kwargs': {'room_id': str(self.conversation.id)}}
+        return communicator
+
+    def checkout(self):
+        listings = make_listings(self.sellers[0], 2) + make_listings(self.sellers[1], 1)
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        return client.post('/api/orders/', {'listing_ids': [str(listing.id) for listing in listings]}, format='json')
+
+    async def watch_checkout(self):
+        socket = self.chat_socket(self.sellers[0])
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        await socket.receive_json_from()   # presence
+
+        response = await database_sync_to_async(self.checkout)()
+        self.assertEqual(response.status_code, 201)
+        event = await socket.receive_json_from()
+        self.assertEqual((event['type'], event['sender_id']), ('message', str(self.buyer.id)))
+        self.assertTrue(event['message'].startswith('🔔 SYSTEM: I have purchased 2 books'))
+        # Only this room's message; the other seller's went to its own chat
+        self.assertTrue(await socket.receive_nothing(timeout=0.2))
+        await socket.disconnect()
+        return event
+
+    def test_checkout_messages_are_written_and_broadcast_at_commit(self):
+        event = async_to_sync(self.watch_checkout)()
+        saved = Message.objects.get(id=event['id'])
+        self.assertEqual((saved.conversation_id, saved.timestamp.isoformat()), (self.conversation.id, event['timestamp']))
+        self.assertEqual(Message.objects.filter(sender=self.buyer).count(), 2)
+
+    def test_rolled_back_workflow_posts_nothing(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            system_messages.post(self.conversation, self.buyer, 'SYSTEM: never sent')
+            raise ValueError
+        self.assertFalse(Message.objects.exists())
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+    async def start_broker(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'channels.sock')
+        broker = asyncio.ensure_future(channel_layers.serve(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        return path, broker
+
+    async def stop_broker(self, broker):
+        broker.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await broker
+
+    async def test_group_send_reaches_channels_on_every_worker(self):
+        path, broker = await self.start_broker()
+        # Two layer instances stand in for two worker processes
+        first, second = channel_layers.LocalChannelLayer(path), channel_layers.LocalChannelLayer(path)
+        try:
+            channels = [await first.new_channel(), await first.new_channel(), await second.new_channel()]
+            layers = [first, first, second]
+            for layer, channel in zip(layers, channels):
+                await layer.group_add('delivery_1', channel)
+            await second.group_discard('delivery_1', channels[2])
+
+            await second.group_send('delivery_1', {'type': 'delivery.update', 'latitude': -0.42})
+            for layer, channel in zip(layers[:2], channels[:2]):
+                message = await asyncio.wait_for(layer.receive(channel), 1)
+                self.assertEqual(message, {'type': 'delivery.update', 'latitude': -0.42})
+
+            await first.send('worker-tasks', {'type': 'task'})
+            self.assertEqual(await asyncio.wait_for(second.receive('worker-tasks'), 1), {'type': 'task'})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(second.receive(channels[2]), 0.1)
+        finally:
+            await first.close()
+            await second.close()
+            await self.stop_broker(broker)
+
+    async def test_undelivered_messages_expire_with_their_queues(self):
+        path, broker = await self.start_broker()
+        layer = channel_layers.LocalChannelLayer(path, expiry=0.05)
+        try:
+            gone, live = await layer.new_channel(), await layer.new_channel()
+            await layer.send(gone, {'type': 'stale'})
+            await asyncio.sleep(0.1)
+            await layer.send(live, {'type': 'fresh'})
+            self.assertEqual(await asyncio.wait_for(layer.receive(live), 1), {'type': 'fresh'})
+            self.assertEqual(layer.queues, {})
+        finally:
+            await layer.close()
+            await self.stop_broker(broker)
+
+    async def test_cancelled_broker_forgets_the_worker_and_stays_cancelled(self):
+        broker = channel_layers.Broker()
+        reader = asyncio.StreamReader()
+        reader.feed_data(channel_layers._pack({'op': 'hello', 'id': 'worker-1'}))
+        reader.feed_data(channel_layers._pack({'op': 'group_add', 'group': 'chat_1', 'channel': 'specific.worker-1!a'}))
+        writer = Mock()
+        handler = asyncio.ensure_future(broker.handle(reader, writer))
+        while 'chat_1' not in broker.groups:
+            await asyncio.sleep(0.01)
+
+        handler.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await handler
+        self.assertEqual((broker.workers, dict(broker.groups)), ({}, {}))
+        writer.close.assert_called_once()
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(email='seller@test.com', username='seller', password='pass', user_type='bookshop', phone_number='0712345678')
+        self.textbook = Textbook.objects.create(title='Maths 4', author='A', grade='4', subject='Maths')
+        Listing.objects.create(listed_by=self.seller, textbook=self.textbook, listing_type='sell', condition='new', price=Decimal('500'), description='x')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                # A near-empty table is always cheaper to scan; ask whether an index applies at all
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_hot_queries_use_their_indexes(self):
+        wallet = Wallet.objects.get(user=self.seller)
+        conversation = Conversation.objects.create()
+
+        self.assertUsesIndex(Listing.objects.filter(is_active=True, is_deleted=False).order_by('-created_at')[:20], 'listing_feed_idx')
+        self.assertUsesIndex(
+            Listing.objects.filter(textbook=self.textbook, is_active=True, is_deleted=False).order_by('price')[:1],
+            'listing_book_price_idx',
+        )
+        self.assertUsesIndex(Listing.objects.filter(listed_by=self.seller, is_active=True, is_deleted=False), 'listing_seller_idx')
+        self.assertUsesIndex(Message.objects.filter(conversation=conversation).order_by('timestamp'), 'message_history_idx')
+        self.assertUsesIndex(Delivery.objects.filter(status='paid').order_by('-created_at'), 'delivery_status_idx')
+        self.assertUsesIndex(Delivery.objects.filter(rider_phone='0712345678', status='shipped'), 'delivery_rider_idx')
+        self.assertUsesIndex(Payment.objects.filter(transaction_code='QWE123'), 'payment_mpesa_code_idx')
+        self.assertUsesIndex(Payment.objects.filter(paystack_ref='ref-1'), 'payment_paystack_ref_idx')
+        self.assertUsesIndex(
+            WalletTransaction.objects.filter(wallet=wallet).order_by('-timestamp', '-id')[:20],
+            'wallet_transaction_history_idx',
+        )
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(email='alice@test.com', username='alice', password='pass')
+        self.bob = User.objects.create_user(email='bob@test.com', username='bob', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.alice, self.bob)
+        start = timezone.now() - timedelta(hours=1)
+        self.messages = Message.objects.bulk_create([
+            Message(conversation=self.conversation, sender=self.alice if i % 2 else self.bob, content=f'message {i}')
+            for i in range(35)
+        ])
+        for i, message in enumerate(self.messages):
+            Message.objects.filter(id=message.id).update(timestamp=start + timedelta(seconds=i))
+        self.url = f'/api/conversations/{self.conversation.id}/messages/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def contents(self, response):
+        return [message['content'] for message in response.data['results']]
+
+    def test_pages_walk_back_from_the_newest_message(self):
+        with self.assertNumQueries(1):
+            latest = self.client.get(self.url)
+        self.assertEqual(latest.status_code, 200)
+        self.assertEqual(self.contents(latest), [f'message {i}' for i in range(34, 4, -1)])
+
+        older = self.client.get(latest.data['next'])
+        self.assertEqual(self.contents(older), [f'message {i}' for i in range(4, -1, -1)])
+        self.assertIsNone(older.data['next'])
+
+    def test_since_returns_only_newer_messages(self):
+        response = self.client.get(self.url, {'since': str(self.messages[32].id)})
+        self.assertEqual(self.contents(response), ['message 33', 'message 34'])
+        self.assertFalse(response.data['has_more'])
+
+        timestamp = Message.objects.get(id=self.messages[33].id).timestamp
+        response = self.client.get(self.url, {'since': timestamp.isoformat()})
+        self.assertEqual(self.contents(response), ['message 34'])
+
+        response = self.client.get(self.url, {'since': str(self.messages[34].id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'since': '2024-02-30T00:00:00'}).status_code, 400)
+
+    def test_non_participants_cannot_read_the_history(self):
+        outsider = User.objects.create_user(email='eve@test.com', username='eve', password='pass')
+        self.client.force_authenticate(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(self.url, {'since': str(self.messages[0].id)}).status_code, 404)
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(email='seller@test.com', username='seller', password='pass', user_type='bookshop')
+        self.listing = make_listings(self.seller, 1)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def test_deleting_a_listing_hides_it_but_keeps_the_row(self):
+        response = self.client.delete(f'/api/listings/{self.listing.id}/')
+
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Listing.objects.filter(id=self.listing.id).exists())
+        self.assertTrue(Listing.all_objects.get(id=self.listing.id).is_deleted)
+        self.assertEqual(self.client.get(f'/api/listings/{self.listing.id}/').status_code, 404)
+
+    def test_queryset_soft_delete(self):
+        self.assertEqual(Listing.objects.filter(id=self.listing.id).soft_delete(), 1)
+        self.assertEqual(Listing.objects.count(), 0)
+        self.assertEqual(Listing.all_objects.count(), 1)
+
+
+class ArchivalTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(email='parent@test.com', username='parent', password='pass')
+        self.seller = User.objects.create_user(email='seller@test.com', username='seller', password='pass', user_type='bookshop')
+        self.long_ago = timezone.now() - timedelta(days=1000)
+
+    def test_archives_cold_deliveries_messages_and_unsold_listings(self):
+        sold, unsold, live = make_listings(self.seller, 3)
+        order = Order.objects.create(buyer=self.buyer, listing=sold, amount_paid=sold.price)
+        delivery = Delivery.objects.create(pickup_location='Nyeri', dropoff_location='Karatina', status='delivered')
+        delivery.orders.add(order)
+        payment = Payment.objects.create(user=self.buyer, delivery=delivery, phone_number='0712345678', amount=Decimal('300'))
+        conversation = Conversation.objects.create(delivery=delivery, listing=unsold)
+        old_message = Message.objects.create(conversation=conversation, sender=self.buyer, content='old')
+        new_message = Message.objects.create(conversation=conversation, sender=self.buyer, content='new')
+
+        Delivery.objects.filter(id=delivery.id).update(created_at=self.long_ago)
+        Message.objects.filter(id=old_message.id).update(timestamp=self.long_ago)
+        Listing.objects.filter(id__in=[sold.id, unsold.id]).update(is_active=False, updated_at=self.long_ago)
+
+        self.assertEqual(archival.archive_cold_rows(dry_run=True), {'messages': 1, 'deliveries': 1, 'listings': 1})
+        self.assertEqual(archival.archive_cold_rows(batch_size=1), {'messages': 1, 'deliveries': 1, 'listings': 1})
+
+        self.assertFalse(Delivery.all_objects.filter(id=delivery.id).exists())
+        self.assertFalse(Payment.all_objects.exists())
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [new_message.id])
+        self.assertEqual(set(Listing.all_objects.values_list('id', flat=True)), {sold.id, live.id})
+        self.assertTrue(Order.objects.filter(id=order.id).exists())
+        conversation.refresh_from_db()
+        self.assertIsNone(conversation.delivery_id)
+        self.assertIsNone(conversation.listing_id)
+
+        self.assertEqual(dict(ArchivedRecord.objects.values_list('object_id', 'model')), {
+            delivery.id: 'api.delivery', payment.id: 'api.payment', old_message.id: 'api.message', unsold.id: 'api.listing',
+            order.id: archival.ORDER_DELIVERY,
+        })
+        self.assertEqual(ArchivedRecord.objects.get(object_id=delivery.id).data['orders'], [str(order.id)])
+        self.assertEqual(archival.archive_cold_rows(), {'messages': 0, 'deliveries': 0, 'listings': 0})
+
+    def test_order_export_keeps_archived_tracking_codes(self):
+        sold = make_listings(self.seller, 1)[0]
+        order = Order.objects.create(buyer=self.buyer, listing=sold, amount_paid=sold.price)
+        delivery = Delivery.objects.create(pickup_location='Nyeri', dropoff_location='Karatina', status='delivered', tracking_code='TRK-0000ABCD')
+        delivery.orders.add(order)
+        Delivery.objects.filter(id=delivery.id).update(created_at=self.long_ago)
+        archival.archive_cold_rows()
+        client = APIClient()
+        client.force_authenticate(self.seller)
+
+        response = client.get('/api/exports/orders/')
+
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[1][5:], ['TRK-0000ABCD', 'delivered'])
+
+    def test_purge_drops_expired_archive_rows(self):
+        kept = ArchivedRecord.objects.create(model='api.message', object_id=uuid.uuid4(), data={}, created_at=self.long_ago)
+        expired = ArchivedRecord.objects.create(model='api.message', object_id=uuid.uuid4(), data={}, created_at=self.long_ago)
+        ArchivedRecord.objects.filter(id=expired.id).update(archived_at=self.long_ago)
+
+        self.assertEqual(archival.purge_archive(dry_run=True), 1)
+        self.assertEqual(archival.purge_archive(), 1)
+        self.assertEqual(list(ArchivedRecord.objects.values_list('id', flat=True)), [kept.id])
+
+
+@override_settings(REPLICA_ROUTING=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # Without DATABASE_REPLICA_URL, a second connection onto the test
+        # database stands in for the replica
+        cls.added_replica = 'replica' not in connections.settings
+        if cls.added_replica:
+            default = connections.settings['default']
+            connections.settings['replica'] = {**default, 'TEST': {**default['TEST'], 'MIRROR': 'default'}}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        # The mirror alias keeps its own connection pool onto the test database
+        if hasattr(connections['replica'], 'close_pool'):
+            connections['replica'].close_pool()
+        if cls.added_replica:
+            connections['replica'].close()
+            del connections['replica']
+            del connections.settings['replica']
+
+    def setUp(self):
+        self.parent = User.objects.create_user(email='parent@test.com', username='parent', password='pass', user_type='parent')
+        self.school = SchoolProfile.objects.create(user=User.objects.create_user(email='school@test.com', username='school', password='pass', user_type='school'), school_name='Nyeri Primary')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.parent)}')
+
+    def child_queries(self, alias, request):
+        with CaptureQueriesContext(connections[alias]) as captured:
+            response = request()
+        self.assertLess(response.status_code, 300)
+        return [query['sql'] for query in captured if 'api_child' in query['sql']]
+
+    def test_reads_go_to_replica_until_the_client_writes(self):
+        cache.clear()
+        self.assertTrue(self.child_queries('replica', lambda: self.client.get('/api/my-children/')))
+
+        create = lambda: self.client.post('/api/my-children/', {'name': 'Wanjiru', 'school': str(self.school.id), 'grade': 'Grade 4'})
+        self.assertFalse(self.child_queries('replica', create))
+
+        # Pinned to the primary right after the write
+        self.assertFalse(self.child_queries('replica', lambda: self.client.get('/api/my-children/')))
+        self.assertTrue(self.child_queries('default', lambda: self.client.get('/api/my-children/')))
+
+
+@requires_concurrent_db
+class CheckoutConcurrencyTests(TransactionTestCase):
+    def test_two_buyers_cannot_buy_the_same_book(self):
+        shop = User.objects.create_user(email='shop@test.com', username='shop', password='pass', user_type='bookshop')
+        buyers = [
+            User.objects.create_user(email=f'parent{i}@test.com', username=f'parent{i}', password='pass')
+            for i in range(8)
+        ]
+        listing = make_listings(shop, 1)[0]
+        start = threading.Barrier(len(buyers))
+        statuses = []
+
+        def buy(index):
+            client = APIClient()
+            client.force_authenticate(buyers[index])
+            start.wait()
+            response = client.post('/api/orders/', {'listing_ids': [str(listing.id)]}, format='json')
+            statuses.append(response.status_code)
+
+        errors = run_in_threads(len(buyers), buy)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(statuses), [201] + [400] * (len(buyers) - 1))
+        self.assertEqual(Order.objects.filter(listing=listing).count(), 1)
+        self.assertEqual(Delivery.objects.count(), 1)
+
+
+@requires_concurrent_db
+class LedgerConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='rider@test.com', username='rider', password='pass')
+
+    def test_concurrent_credits_and_debits_lose_nothing(self):
+        ledger.credit(self.user, Decimal('1000.00'), "Opening balance")
+        threads, rounds = 16, 25
+
+        def hammer(index):
+            for _ in range(rounds):
+                ledger.credit(self.user, Decimal('5.00'), "Delivery Fee")
+                try:
+                    ledger.debit(self.user, Decimal('3.00'), "Withdrawal Request")
+                except ledger.InsufficientFunds:
+                    pass
+
+        errors = run_in_threads(threads, hammer)
+
+        self.assertEqual(errors, [])
+        wallet = Wallet.objects.get(user=self.user)
+        credits = wallet.transactions.filter(transaction_type='credit').count() - 1
+        debits = wallet.transactions.filter(transaction_type='debit').count()
+        self.assertEqual(credits, threads * rounds)
+        self.assertEqual(debits, threads * rounds)
+        self.assertEqual(wallet.balance, Decimal('1000.00') + credits * Decimal('5.00') - debits * Decimal('3.00'))
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        ledger.credit(self.user, Decimal('100.00'), "Opening balance")
+        succeeded = []
+
+        def withdraw(index):
+            try:
+                ledger.debit(self.user, Decimal('10.00'), "Withdrawal Request")
+                succeeded.append(index)
+            except ledger.InsufficientFunds:
+                pass
+
+        errors = run_in_threads(40, withdraw)
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(succeeded), 10)
+        self.assertEqual(Wallet.objects.get(user=self.user).balance, Decimal('0.00'))
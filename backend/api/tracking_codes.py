@@ -0,0 +1,68 @@
+import hashlib
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from .models import CodeSequence
+
+# Tracking codes are a sequence number pushed through a keyed Feistel
+# permutation of the 40-bit space, so consecutive deliveries get unrelated
+# looking codes but two numbers can never map to the same code. 2**40 values
+# in Crockford base32 give 8 characters, e.g. TRK-7ZK3QX0M.
+
+SEQUENCE_NAME = 'api_tracking_code_seq'
+CODE_PREFIX = 'TRK-'
+CODE_BITS = 40
+HALF_BITS = CODE_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32, no I/L/O/U
+CODE_LENGTH = 8
+
+def _key():
+    secret = getattr(settings, 'TRACKING_CODE_KEY', None) or settings.SECRET_KEY
+    return hashlib.sha256(secret.encode()).digest()
+
+def _round(value, round_no, key):
+    digest = hashlib.blake2b(value.to_bytes(4, 'big') + bytes([round_no]), key=key, digest_size=4).digest()
+    return int.from_bytes(digest, 'big') & HALF_MASK
+
+def permute(number):
+    """Bijective map of [0, 2**40) onto itself."""
+    key = _key()
+    left, right = (number >> HALF_BITS) & HALF_MASK, number & HALF_MASK
+    for round_no in range(ROUNDS):
+        left, right = right, left ^ _round(right, round_no, key)
+    return (left << HALF_BITS) | right
+
+def unpermute(value):
+    key = _key()
+    left, right = (value >> HALF_BITS) & HALF_MASK, value & HALF_MASK
+    for round_no in reversed(range(ROUNDS)):
+        left, right = right ^ _round(left, round_no, key), left
+    return (left << HALF_BITS) | right
+
+def encode(value):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+def next_sequence_value():
+    if connection.vendor == 'postgresql':
+        # nextval() is non-transactional: no row lock is held until commit,
+        # and a rolled-back checkout simply leaves a gap.
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [SEQUENCE_NAME])
+            return cursor.fetchone()[0]
+
+    with transaction.atomic():
+        CodeSequence.objects.get_or_create(name=SEQUENCE_NAME)
+        CodeSequence.objects.filter(name=SEQUENCE_NAME).update(last_value=F('last_value') + 1)
+        return CodeSequence.objects.get(name=SEQUENCE_NAME).last_value
+
+def generate_tracking_code():
+    number = next_sequence_value()
+    if number >= 1 << CODE_BITS:
+        raise OverflowError("Tracking code space exhausted")
+    return CODE_PREFIX + encode(permute(number))
@@ -7,8 +7,9 @@ from rest_framework_simplejwt.views import (
 from .views import (RegisterView, CurrentUserView, TextbookViewSet, ListingViewSet,
  BookshopViewSet, SchoolViewSet, SchoolBookListsView, ConversationListView, MessageListView, 
  FindOrCreateConversationView, CartView, ReviewViewSet, UserReviewsView, MyListingsView, 
- MyBookListsView, MyProfileView, SwapRequestViewSet, DeliveryViewSet, OrderViewSet, 
- PaymentViewSet, BookListViewSet, MyEarningsView, WithdrawalView)
+ MyBookListsView, MyChildrenView, MyProfileView, SwapRequestViewSet, DeliveryViewSet, OrderViewSet, 
+ PaymentViewSet, BookListViewSet, MyEarningsView, WithdrawalView, EarningsHistoryView,
+ EarningsSummaryView, ExportView, MetricsView)
 #router
 router = DefaultRouter()
 #register viewsets
@@ -18,6 +19,7 @@ router.register(r'bookshops', BookshopViewSet, basename='bookshop')
 router.register(r'schools', SchoolViewSet, basename='school')
 router.register(r'reviews', ReviewViewSet, basename='review')
 router.register(r'my-booklists', MyBookListsView, basename='my-booklists')
+router.register(r'my-children', MyChildrenView, basename='my-children')
 router.register(r'swaps', SwapRequestViewSet, basename='swap')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'payments', PaymentViewSet, basename='payment')
@@ -41,4 +43,8 @@ urlpatterns = [
     path('password_reset/', include('django_rest_passwordreset.urls', namespace='password_reset')),
     path('earnings/', MyEarningsView.as_view(), name='my-earnings'),
     path('earnings/withdraw/', WithdrawalView.as_view(), name='withdraw'),
+    path('earnings/history/', EarningsHistoryView.as_view(), name='earnings-history'),
+    path('earnings/summary/', EarningsSummaryView.as_view(), name='earnings-summary'),
+    path('exports/<str:kind>/', ExportView.as_view(), name='export'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
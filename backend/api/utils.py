@@ -65,4 +65,16 @@ def get_delivery_cost(pickup_address, delivery_address, is_swap=False):
         return int(total_cost), distance_text, coords_1, coords_2, route_geometry, None
 
     except Exception as e:
-        return None, None, None, None, None, f"System Error: {str(e)}"
\ No newline at end of file
+        return None, None, None, None, None, f"System Error: {str(e)}"
+
+def geocode_address(address):
+    """Return (latitude, longitude) for a place name, or None if it can't be found."""
+    geolocator = Nominatim(user_agent="dkut_textbook_project_2026", timeout=10)
+    try:
+        for query in (f"{address}, Nyeri, Kenya", f"{address}, Kenya"):
+            location = geolocator.geocode(query)
+            if location:
+                return location.latitude, location.longitude
+    except (GeocoderTimedOut, GeocoderServiceError):
+        pass
+    return None
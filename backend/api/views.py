@@ -2,20 +2,29 @@ from rest_framework import generics, permissions, viewsets, filters, status
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.pagination import CursorPagination
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Sum, Q
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Exists, Sum, Q, F, Prefetch
+from django.db.models.functions import TruncWeek, TruncMonth
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils import timezone
 from django.db import transaction
 from django.conf import settings
-from decimal import Decimal
-from .models import Textbook, Listing, BookshopProfile, SchoolProfile, BookList, Conversation, Message, Cart, CartItem, Review, SwapRequest, Order, Delivery, Payment, Wallet, WalletTransaction
-from .serializers import UserSerializer, RegisterSerializer, TextbookSerializer, ListingSerializer, BookshopProfileSerializer, SchoolProfileSerializer, BookListSerializer, ConversationSerializer, MessageSerializer, CartItemSerializer, CartSerializer, ReviewSerializer, SwapRequestSerializer, OrderSerializer, DeliverySerializer, PaymentSerializer, WalletSerializer, WalletTransactionSerializer
+from decimal import Decimal, InvalidOperation
+from datetime import timedelta
+from .models import Textbook, Listing, BookshopProfile, SchoolProfile, BookList, Child, Conversation, Message, Cart, CartItem, Review, SwapMatch, SwapRequest, Order, Delivery, Payment, Wallet, WalletTransaction, WalletDailyRollup
+from .serializers import UserSerializer, RegisterSerializer, TextbookSerializer, ListingSerializer, BookshopProfileSerializer, SchoolProfileSerializer, BookListSerializer, ChildSerializer, ConversationSerializer, MessageSerializer, CartItemSerializer, CartSerializer, ReviewSerializer, SwapRequestSerializer, ListingRowSerializer, OrderSerializer, DeliverySerializer, PaymentSerializer, WalletSerializer, WalletTransactionSerializer
 from .permissions import IsOwnerOrReadOnly
-import random, string, csv, io, openpyxl, requests
+import string, csv, io, openpyxl, requests, uuid
 from .utils import get_delivery_cost
 from .mpesa_utils import trigger_stk_push
+from .payment_callbacks import assign_tracking_code, record_callback, retry_reference
+from .tracking_codes import generate_tracking_code
+from . import background, ledger, exports, metrics, notifications, recommendations, response_cache, swap_matching, system_messages
+from .response_cache import CachedResponseMixin
 
 User = get_user_model()
 
@@ -31,20 +40,32 @@ class CurrentUserView(APIView):
         serializer = UserSerializer(request.user)
         return Response(serializer.data)
 
-class TextbookViewSet(viewsets.ModelViewSet):
+class TextbookViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Textbook.objects.all()
     serializer_class = TextbookSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cache_models = (Textbook,)
 
-class ListingViewSet(viewsets.ModelViewSet):
+class ListingViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Listing.objects.select_related('listed_by', 'textbook').filter(is_active=True).order_by('-created_at')
     serializer_class = ListingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
+    # Only the anonymous feed; retrieve bumps the view counter on every hit
+    cache_models = (Listing, Textbook, User)
+    cache_actions = ('list',)
+    cache_anonymous_only = True
 
     filter_backends = [filters.SearchFilter, DjangoFilterBackend]
     search_fields = ['textbook__title', 'textbook__subject', 'description']
     filterset_fields = ['listing_type', 'condition']
 
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, self._list_rows)
+
+    def _list_rows(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(ListingRowSerializer(queryset, context=self.get_serializer_context()).data)
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
         instance.views += 1
@@ -56,6 +77,28 @@ class ListingViewSet(viewsets.ModelViewSet):
         user = self.request.user
         serializer.save(listed_by=user)
 
+    def perform_destroy(self, instance):
+        # Orders, reviews and chats point at listings; hide it rather than cascade them away
+        instance.is_active = False
+        instance.soft_delete()
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def recommended(self, request):
+        # Served from the precomputed Recommendation rows in a single query
+        feed = (
+            Listing.objects.filter(recommendations__parent=request.user, is_active=True)
+            .select_related('listed_by', 'textbook')
+            .order_by('-recommendations__score')
+        )
+        listings = list(feed)
+        if not listings and not request.user.recommendations.exists() and request.user.children.exists():
+            # First visit before the periodic refresh has reached this parent.
+            # Scoring may geocode locations, so it never runs in the request:
+            # the feed fills in on a later visit.
+            background.submit_once(recommendations.refresh_parent, request.user.id)
+        serializer = self.get_serializer(listings, many=True)
+        return Response(serializer.data)
+
     @action(detail=False, methods=['post'])
     def bulk_upload(self, request):
         file = request.FILES.get('file')
@@ -155,30 +198,40 @@ class MyListingsView(generics.ListAPIView):
     def get_queryset(self):
         return Listing.objects.select_related('textbook').filter(listed_by=self.request.user).order_by('-created_at')
 
-class BookshopViewSet(viewsets.ReadOnlyModelViewSet):
+class BookshopViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = BookshopProfile.objects.all().order_by('shop_name')
     serializer_class = BookshopProfileSerializer
     permission_classes = [permissions.AllowAny]
+    cache_models = (BookshopProfile, Listing, Textbook, User)
+    cache_actions = ('list', 'retrieve', 'inventory')
 
     @action(detail=True, methods=['get'])
     def inventory(self, request, pk=None):
+        return self.cached_response(request, self._inventory, pk=pk)
+
+    def _inventory(self, request, pk=None):
         bookshop = self.get_object()
-        listings = Listing.objects.select_related('textbook').filter(listed_by=bookshop.user, is_active=True)
-        serializer = ListingSerializer(listings, many=True)
-        return Response(serializer.data)
+        listings = Listing.objects.filter(listed_by=bookshop.user, is_active=True)
+        return Response(ListingRowSerializer(listings, context=self.get_serializer_context()).data)
 
-class SchoolViewSet(viewsets.ReadOnlyModelViewSet):
+class SchoolViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = SchoolProfile.objects.all().order_by('school_name')
     serializer_class = SchoolProfileSerializer
     permission_classes = [permissions.AllowAny]
+    cache_models = (SchoolProfile,)
 
-class BookListViewSet(viewsets.ReadOnlyModelViewSet):
+class BookListViewSet(CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     queryset = BookList.objects.select_related('school').prefetch_related('textbooks').all()
     serializer_class = BookListSerializer
     permission_classes = [permissions.AllowAny]
+    cache_models = (BookList, SchoolProfile, Textbook, Listing)
+    cache_actions = ('list', 'retrieve', 'check_availability')
 
     @action(detail=True, methods=['get'])
     def check_availability(self, request, pk=None):
+        return self.cached_response(request, self._check_availability, pk=pk)
+
+    def _check_availability(self, request, pk=None):
         book_list = self.get_object()
         results = []
         
@@ -224,15 +277,79 @@ class ConversationListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return self.request.user.conversations.all().order_by('-updated_at')
+        user = self.request.user
+        unread = Q(messages__is_read=False, messages__is_deleted=False) & ~Q(messages__sender=user)
+        return user.conversations.annotate(unread_count=Count('messages', filter=unread)).order_by('-updated_at')
+
+class MessageCursorPagination(CursorPagination):
+    # Newest page first; follow `next` for older messages
+    page_size = 30
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    ordering = ('-timestamp', '-id')
 
 class MessageListView(generics.ListAPIView):
+    """
+    Chat history for one conversation, newest page first. With ?since=<message
+    id or ISO timestamp> it returns only the messages after that point, oldest
+    first, for clients that already hold the history.
+    """
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+    SYNC_LIMIT = 200
 
     def get_queryset(self):
         conversation_id = self.kwargs['conversation_id']
-        return Message.objects.filter(conversation__id=conversation_id).order_by('timestamp')
+        # Checked in the same query, against the through table's (conversation, user) unique index
+        membership = Conversation.participants.through.objects.filter(conversation_id=conversation_id, user_id=self.request.user.id)
+        return Message.objects.filter(conversation_id=conversation_id).filter(Exists(membership)).select_related('sender')
+
+    def is_participant(self):
+        return Conversation.participants.through.objects.filter(
+            conversation_id=self.kwargs['conversation_id'], user_id=self.request.user.id
+        ).exists()
+
+    def list(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since is None:
+            response = super().list(request, *args, **kwargs)
+            messages = response.data['results']
+        else:
+            after = self.sync_point(since)
+            rows = list(
+                self.get_queryset()
+                .filter(Q(timestamp__gt=after[0]) | Q(timestamp=after[0], id__gt=after[1]))
+                .order_by('timestamp', 'id')[:self.SYNC_LIMIT + 1]
+            )
+            messages = self.get_serializer(rows[:self.SYNC_LIMIT], many=True).data
+            response = Response({'results': messages, 'has_more': len(rows) > self.SYNC_LIMIT})
+
+        # An empty page is the only time we need to tell "no messages" from "not yours"
+        if not messages and not self.is_participant():
+            raise NotFound("Conversation not found.")
+        return response
+
+    def sync_point(self, since):
+        """(timestamp, id) to sync from: a message id the client already has, or a timestamp."""
+        try:
+            message_id = uuid.UUID(since)
+        except ValueError:
+            try:
+                # None when malformed; ValueError when well-formed but impossible (Feb 30th)
+                timestamp = parse_datetime(since)
+            except ValueError:
+                timestamp = None
+            if timestamp is None:
+                raise ValidationError({'since': 'Expected a message id or an ISO 8601 timestamp.'})
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            return timestamp, uuid.UUID(int=(1 << 128) - 1)
+
+        point = Message.all_objects.filter(id=message_id, conversation_id=self.kwargs['conversation_id']).values_list('timestamp', 'id').first()
+        if point is None:
+            raise ValidationError({'since': 'Unknown message.'})
+        return point
 
 class FindOrCreateConversationView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -272,9 +389,21 @@ class FindOrCreateConversationView(APIView):
 class CartView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_cart(self, user):
+        items = CartItem.objects.select_related('listing__textbook', 'listing__listed_by').order_by('added_at')
+        carts = Cart.objects.annotate(items_total=Sum('items__listing__price')).prefetch_related(Prefetch('items', queryset=items))
+        cart = carts.filter(user=user).first()
+        if cart is None:
+            Cart.objects.get_or_create(user=user)
+            cart = carts.get(user=user)
+        return cart
+
+    def summary(self, cart_id):
+        totals = CartItem.objects.filter(cart_id=cart_id).aggregate(total=Sum('listing__price'), count=Count('id'))
+        return {'total': totals['total'] or 0, 'count': totals['count']}
+
     def get(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        serializer = CartSerializer(self.get_cart(request.user))
         return Response(serializer.data)
 
     def post(self, request):
@@ -283,24 +412,28 @@ class CartView(APIView):
         
         try:
             listing = Listing.objects.get(id=listing_id, is_active=True)
-        except Listing.DoesNotExist:
+        except (Listing.DoesNotExist, DjangoValidationError):
             return Response({"error": "Listing not found"}, status=404)
 
-        if listing.listed_by == request.user:
+        if listing.listed_by_id == request.user.id:
              return Response({"error": "Cannot buy your own book"}, status=400)
 
-        CartItem.objects.get_or_create(cart=cart, listing=listing)
+        item, created = CartItem.objects.get_or_create(cart=cart, listing=listing)
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return Response({'item_id': item.id, 'listing_id': listing.id, 'created': created, **self.summary(cart.id)})
 
     def delete(self, request):
         item_id = request.data.get('item_id')
-        cart = Cart.objects.get(user=request.user)
-        CartItem.objects.filter(cart=cart, id=item_id).delete()
+        cart = Cart.objects.filter(user=request.user).only('id').first()
+        if cart is None:
+            return Response({'item_id': item_id, 'total': 0, 'count': 0})
+
+        try:
+            CartItem.objects.filter(cart=cart, id=item_id).delete()
+        except DjangoValidationError:
+            return Response({"error": "Invalid item id"}, status=400)
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        return Response({'item_id': item_id, **self.summary(cart.id)})
 
 class ReviewViewSet(viewsets.ModelViewSet):
     queryset = Review.objects.all()
@@ -491,6 +624,21 @@ class MyProfileView(APIView):
 
         return Response(UserSerializer(user).data)
 
+class MyChildrenView(viewsets.ModelViewSet):
+    serializer_class = ChildSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Child.objects.select_related('school').filter(parent=self.request.user)
+
+    def perform_create(self, serializer):
+        if self.request.user.user_type != 'parent':
+            raise ValidationError("Only parent accounts can add children.")
+        serializer.save(parent=self.request.user)
+
+    def perform_destroy(self, instance):
+        instance.soft_delete()
+
 class SwapRequestViewSet(viewsets.ModelViewSet):
     serializer_class = SwapRequestSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -526,10 +674,11 @@ class SwapRequestViewSet(viewsets.ModelViewSet):
         if requested_listing.listed_by == self.request.user:
             raise ValidationError("You cannot swap with yourself.")
             
-        serializer.save(
+        swap = serializer.save(
             sender=self.request.user,
             receiver=requested_listing.listed_by
         )
+        notifications.publish([swap.receiver_id], 'swap_received', swap_id=swap.id, sender=self.request.user.username)
 
     @action(detail=True, methods=['post'])
     def accept(self, request, pk=None):
@@ -537,7 +686,17 @@ class SwapRequestViewSet(viewsets.ModelViewSet):
         
         if request.user != swap.receiver:
             return Response({'error': 'Not authorized'}, status=403)
-            
+
+        if swap.match_id and swap.match.size > 2:
+            waiting = swap_matching.finish_match_leg(swap)
+            if waiting is None:
+                return Response({'error': 'This swap is no longer available.'}, status=400)
+            notifications.publish([swap.sender_id], 'swap_accepted', swap_id=swap.id, waiting_for=waiting)
+            return Response({'status': 'Swap Accepted', 'waiting_for': waiting})
+
+        if swap.match_id:
+            SwapMatch.objects.filter(id=swap.match_id).update(status='accepted')
+
         swap.status = 'accepted'
         swap.save()
         
@@ -566,11 +725,8 @@ class SwapRequestViewSet(viewsets.ModelViewSet):
             conversation.listing = swap.requested_listing
             conversation.save()
        
-        Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content=f"SYSTEM: I have accepted your swap offer for '{swap.requested_listing.textbook.title}'."
-        )
+        system_messages.post(conversation, request.user, f"SYSTEM: I have accepted your swap offer for '{swap.requested_listing.textbook.title}'.")
+        notifications.publish([swap.sender_id], 'swap_accepted', swap_id=swap.id, conversation_id=conversation.id)
         
         return Response({'status': 'Swap Accepted', 'conversation_id': conversation.id})
 
@@ -579,7 +735,20 @@ class SwapRequestViewSet(viewsets.ModelViewSet):
         swap = self.get_object()
         if request.user != swap.receiver:
             return Response({'error': 'Not authorized'}, status=403)
-            
+
+        if swap.match_id and swap.match.size > 2:
+            # One parent dropping out breaks the whole ring
+            swap_matching.reject_match(swap.match_id)
+            parents = SwapRequest.objects.filter(match_id=swap.match_id).values_list('sender_id', 'receiver_id')
+            notifications.publish(
+                {parent for leg in parents for parent in leg} - {request.user.id}, 'swap_rejected',
+                swap_id=swap.id, match_id=swap.match_id,
+            )
+            return Response({'status': 'Swap Rejected'})
+
+        if swap.match_id:
+            SwapMatch.objects.filter(id=swap.match_id).update(status='rejected')
+
         swap.status = 'rejected'
         swap.save()
         
@@ -600,11 +769,8 @@ class SwapRequestViewSet(viewsets.ModelViewSet):
             conversation = Conversation.objects.create(listing=swap.requested_listing)
             conversation.participants.add(sender, receiver)
 
-        Message.objects.create(
-            conversation=conversation,
-            sender=receiver,
-            content=f"SYSTEM: I have rejected the swap offer for '{swap.requested_listing.textbook.title}'."
-        )
+        system_messages.post(conversation, receiver, f"SYSTEM: I have rejected the swap offer for '{swap.requested_listing.textbook.title}'.")
+        notifications.publish([sender.id], 'swap_rejected', swap_id=swap.id)
         return Response({'status': 'Swap Rejected'})
 
 class DeliveryViewSet(viewsets.ModelViewSet):
@@ -727,11 +893,13 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         conversation.participants.add(*participants_to_add)
 
         if created:
-             Message.objects.create(
-                conversation=conversation,
-                sender=user,
-                content="🔔 SYSTEM: Rider has joined. Delivery Group Chat (Rider + Buyer + Seller) is active."
-            )
+            system_messages.post(conversation, user, "🔔 SYSTEM: Rider has joined. Delivery Group Chat (Rider + Buyer + Seller) is active.")
+
+        notifications.publish(
+            notifications.delivery_party_ids(delivery) - {user.id}, 'rider_assigned',
+            delivery_id=delivery.id, rider=user.username, rider_phone=user.phone_number, conversation_id=conversation.id,
+        )
+        notifications.publish_to_riders('job_taken', delivery_id=delivery.id)
 
         return Response({
             'status': 'Job Accepted', 
@@ -766,44 +934,17 @@ class DeliveryViewSet(viewsets.ModelViewSet):
             delivery.save()
             print(f"⚠️ Fixed missing rider. Assigned to {user.username}")
 
-        delivery.status = 'delivered'
-        delivery.save()
-
         with transaction.atomic():
-            if delivery.rider:
-                rider_wallet, _ = Wallet.objects.get_or_create(user=delivery.rider)
-                
-                amount_to_pay = delivery.transport_cost
-                if amount_to_pay <= 0:
-                    amount_to_pay = Decimal('200.00') 
-                
-                current_balance = Decimal(str(rider_wallet.balance))
-                rider_wallet.balance = current_balance + amount_to_pay
-                rider_wallet.save()
-                
-                WalletTransaction.objects.create(
-                    wallet=rider_wallet,
-                    amount=amount_to_pay,
-                    transaction_type='credit',
-                    description=f"Delivery Fee for Order #{delivery.tracking_code}"
-                )
-                print(f"DEBUG: Rider Paid {amount_to_pay}. New Balance: {rider_wallet.balance}")
-            
-            for order in delivery.orders.all():
-                seller = order.listing.listed_by
-                seller_wallet, _ = Wallet.objects.get_or_create(user=seller)
-                
-                current_seller_balance = Decimal(str(seller_wallet.balance))
-                seller_wallet.balance = current_seller_balance + order.amount_paid
-                seller_wallet.save()
-                
-                WalletTransaction.objects.create(
-                    wallet=seller_wallet,
-                    amount=order.amount_paid,
-                    transaction_type='credit',
-                    description=f"Sale of '{order.listing.textbook.title}'"
-                )
-                print(f"DEBUG: Seller Paid {order.amount_paid}. New Balance: {seller_wallet.balance}")
+            # Flip the status with a guarded UPDATE so a double-tap or a retry
+            # can't settle the same delivery twice
+            completed = Delivery.objects.filter(pk=delivery.pk).exclude(status='delivered').update(
+                status='delivered', last_updated=timezone.now()
+            )
+            if not completed:
+                return Response({'error': 'Job already completed'}, status=400)
+
+            ledger.settle_delivery(delivery)
+            notifications.publish(notifications.delivery_party_ids(delivery), 'delivery_updated', delivery_id=delivery.id, status='delivered')
 
         return Response({'status': 'Job Completed & Wallets Credited'})
 
@@ -815,8 +956,14 @@ class DeliveryViewSet(viewsets.ModelViewSet):
         if delivery.status in ['shipped', 'delivered']:
             return Response({'error': 'Cannot cancel order that is already in transit.'}, status=400)
             
+        was_open_job = delivery.status == 'paid'
         delivery.status = 'cancelled'
         delivery.save()
+        notifications.publish(
+            notifications.delivery_party_ids(delivery) - {buyer.id}, 'delivery_updated', delivery_id=delivery.id, status='cancelled'
+        )
+        if was_open_job:
+            notifications.publish_to_riders('job_taken', delivery_id=delivery.id)
         
         if delivery.orders.exists():
             for order in delivery.orders.all():
@@ -831,10 +978,9 @@ class DeliveryViewSet(viewsets.ModelViewSet):
                 .filter(listing=first_order.listing).first()
             
             if conversation:
-                Message.objects.create(
-                    conversation=conversation,
-                    sender=buyer,
-                    content=f"🚫 SYSTEM: I have cancelled the delivery for {delivery.orders.count()} books. They have been returned to your inventory."
+                system_messages.post(
+                    conversation, buyer,
+                    f"🚫 SYSTEM: I have cancelled the delivery for {delivery.orders.count()} books. They have been returned to your inventory.",
                 )
 
         elif delivery.swap:
@@ -856,11 +1002,7 @@ class DeliveryViewSet(viewsets.ModelViewSet):
                 .filter(listing=swap.requested_listing).first()
 
             if conversation:
-                Message.objects.create(
-                    conversation=conversation,
-                    sender=buyer,
-                    content=f"🚫 SYSTEM: I have cancelled the swap delivery."
-                )
+                system_messages.post(conversation, buyer, "🚫 SYSTEM: I have cancelled the swap delivery.")
             
         return Response({'status': 'Delivery Cancelled and Items Restocked'})
     
@@ -874,70 +1016,85 @@ class OrderViewSet(viewsets.ModelViewSet):
         listing_ids = request.data.get('listing_ids', [])
         if not listing_ids:
             return Response({'error': 'No books selected'}, status=400)
-
-        listings = Listing.objects.filter(id__in=listing_ids, is_active=True)
-        if len(listings) != len(listing_ids):
-             return Response({'error': 'One or more books have already been sold. Please clear your cart and try again.'}, status=400)
-
-        seller_groups = {}
-        for listing in listings:
-            seller_id = listing.listed_by.id
-            if seller_id not in seller_groups:
-                seller_groups[seller_id] = []
-            seller_groups[seller_id].append(listing)
-
-        created_count = 0
+        listing_ids = list(dict.fromkeys(str(listing_id) for listing_id in listing_ids))
 
         try:
             with transaction.atomic():
+                # Lock the requested listings; rows another checkout holds are
+                # skipped rather than waited on, so a contested book shows up
+                # as missing and the second buyer is told it's gone.
+                listings = list(
+                    Listing.objects.select_for_update(skip_locked=True, of=('self',))
+                    .select_related('listed_by', 'textbook')
+                    .filter(id__in=listing_ids, is_active=True)
+                )
+                if len(listings) != len(listing_ids):
+                    return Response({'error': 'One or more books have already been sold. Please clear your cart and try again.'}, status=400)
+
+                seller_groups = {}
+                for listing in listings:
+                    seller_groups.setdefault(listing.listed_by_id, []).append(listing)
+
+                deliveries = {}
                 for seller_id, group_listings in seller_groups.items():
-                    seller = group_listings[0].listed_by
-                    
-                    delivery = Delivery.objects.create(
-                        pickup_location=seller.location,
+                    deliveries[seller_id] = Delivery(
+                        pickup_location=group_listings[0].listed_by.location,
                         dropoff_location=request.user.location,
                         transport_cost=0.00, 
                         status='pending'
                     )
+                Delivery.objects.bulk_create(deliveries.values())
+
+                orders = Order.objects.bulk_create([
+                    Order(buyer=request.user, listing=listing, amount_paid=listing.price)
+                    for listing in listings
+                ])
 
-                    book_titles = []
-                    for listing in group_listings:
-                        order = Order.objects.create(
-                            buyer=request.user,
-                            listing=listing,
-                            amount_paid=listing.price
+                sold_ids = [listing.id for listing in listings]
+                Listing.objects.filter(id__in=sold_ids).update(
+                    is_active=False, updated_at=timezone.now()
+                )
+                response_cache.bump(Listing)
+                # .update() skips the post_save rematch receiver; withdraw proposals here instead
+                swap_matching.expire_matches_for_listings(sold_ids)
+
+                DeliveryOrder = Delivery.orders.through
+                DeliveryOrder.objects.bulk_create([
+                    DeliveryOrder(delivery_id=deliveries[order.listing.listed_by_id].id, order_id=order.id)
+                    for order in orders
+                ])
+
+                CartItem.objects.filter(cart__user=request.user, listing_id__in=sold_ids).delete()
+
+                # One chat message per seller, all written and broadcast together at commit
+                with system_messages.collect() as chat:
+                    for seller_id, group_listings in seller_groups.items():
+                        seller = group_listings[0].listed_by
+                        titles_str = ", ".join(listing.textbook.title for listing in group_listings)
+
+                        conversation = Conversation.objects.filter(participants=request.user)\
+                            .filter(participants=seller).first()
+
+                        if not conversation:
+                            conversation = Conversation.objects.create(listing=group_listings[0])
+                            conversation.participants.add(request.user, seller)
+                        elif conversation.listing_id != group_listings[0].id:
+                            conversation.listing = group_listings[0]
+                            conversation.save(update_fields=['listing'])
+
+                        chat.post(
+                            conversation, request.user,
+                            f"🔔 SYSTEM: I have purchased {len(group_listings)} books: {titles_str}. They are grouped in one delivery!",
+                        )
+                        notifications.publish(
+                            [seller_id], 'order_placed',
+                            delivery_id=deliveries[seller_id].id, buyer=request.user.username, count=len(group_listings),
                         )
-                        listing.is_active = False 
-                        listing.save()
-                        
-                        delivery.orders.add(order)
-                        book_titles.append(listing.textbook.title)
-                        created_count += 1
-                        
-                        CartItem.objects.filter(cart__user=request.user, listing=listing).delete()
-
-                    titles_str = ", ".join(book_titles)
-                    
-                    conversation = Conversation.objects.filter(participants=request.user)\
-                        .filter(participants=seller).first()
-                    
-                    if not conversation:
-                        conversation = Conversation.objects.create(listing=group_listings[0])
-                        conversation.participants.add(request.user, seller)
-                    else:
-                        conversation.listing = group_listings[0]
-                        conversation.save()
-                    
-                    Message.objects.create(
-                        conversation=conversation,
-                        sender=request.user,
-                        content=f"🔔 SYSTEM: I have purchased {len(group_listings)} books: {titles_str}. They are grouped in one delivery!"
-                    )
 
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
-        return Response({'status': 'Orders Placed', 'count': created_count}, status=status.HTTP_201_CREATED)
+        return Response({'status': 'Orders Placed', 'count': len(orders)}, status=status.HTTP_201_CREATED)
 
 
 class PaymentViewSet(viewsets.ModelViewSet):
@@ -972,12 +1129,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     'transaction_code':response.get('CheckoutRequestID')
                 }
             )
+            retry_reference('mpesa', payment.transaction_code)
             
             payment.is_successful = True
             payment.save()
+            was_pending = delivery.status == 'pending'
             delivery.status = 'paid'
-            delivery.tracking_code = f"TRK-{random.randint(1000, 9999)}"
+            delivery.tracking_code = delivery.tracking_code or generate_tracking_code()
             delivery.save()
+            if was_pending:
+                notifications.payment_confirmed(delivery)
 
             return Response({
                 'status': 'STK Push Sent. Check your phone.',
@@ -994,30 +1155,12 @@ class PaymentViewSet(viewsets.ModelViewSet):
         data = request.data
         
         body = data.get('Body', {}).get('stkCallback', {})
-        result_code = body.get('ResultCode')
         checkout_id = body.get('CheckoutRequestID')
 
         if not checkout_id:
             return Response({'status': 'Invalid Data'}, status=400)
 
-        try:
-            payment = Payment.objects.get(transaction_code=checkout_id)
-            delivery = payment.delivery
-            
-            if result_code == 0:
-                payment.is_successful = True
-                payment.save()
-                
-                delivery.status = 'paid'
-                delivery.tracking_code = f"TRK-{random.randint(1000, 9999)}"
-                delivery.save()
-                
-                print(f"Payment Confirmed for Order {delivery.id}")
-            else:
-                print(f"Payment Failed for Order {delivery.id}: {body.get('ResultDesc')}")
-        
-        except Payment.DoesNotExist:
-            print("Payment record not found for this callback")
+        record_callback('mpesa', checkout_id, data)
 
         return Response({'status': 'Callback Received'})
 
@@ -1068,6 +1211,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
                     'transaction_code': None 
                 }
             )
+            retry_reference('paystack', res_data['data']['reference'])
             return Response({'authorization_url': res_data['data']['authorization_url']})
         else:
             return Response({'error': res_data['message']}, status=400)
@@ -1083,19 +1227,15 @@ class PaymentViewSet(viewsets.ModelViewSet):
         res_data = response.json()
 
         if res_data['status'] and res_data['data']['status'] == 'success':
-            try:
-                payment = Payment.objects.get(paystack_ref=reference)
-                payment.is_successful = True
-                payment.save()
+            payment = Payment.objects.select_related('delivery').filter(paystack_ref=reference).first()
+            if not payment:
+                return Response({'error': 'Payment record not found'}, status=404)
 
-                delivery = payment.delivery
-                delivery.status = 'paid'
-                delivery.tracking_code = f"TRK-{random.randint(1000, 9999)}"
-                delivery.save()
+            record_callback('paystack', reference, res_data['data'])
 
-                return Response({'status': 'Payment Verified', 'tracking_code': delivery.tracking_code})
-            except Payment.DoesNotExist:
-                return Response({'error': 'Payment record not found'}, status=404)
+            # Paystack has confirmed the charge, so the buyer gets the code now;
+            # the worker marks the delivery paid and keeps the same code
+            return Response({'status': 'Payment Verified', 'tracking_code': assign_tracking_code(payment.delivery)})
         else:
             return Response({'error': 'Verification failed'}, status=400)
         
@@ -1111,26 +1251,103 @@ class MyEarningsView(APIView):
             'history': WalletTransactionSerializer(transactions, many=True).data
         })
 
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, kind):
+        if kind not in exports.EXPORTS:
+            return Response({'error': f"Unknown export '{kind}'. Use one of: {', '.join(exports.EXPORTS)}"}, status=404)
+
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in exports.CONTENT_TYPES:
+            return Response({'error': 'file_format must be csv or xlsx'}, status=400)
+
+        return exports.export_response(request._request, kind, request.user, file_format)
+
+class LedgerCursorPagination(CursorPagination):
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    ordering = ('-timestamp', '-id')
+
+class EarningsHistoryView(generics.ListAPIView):
+    serializer_class = WalletTransactionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = LedgerCursorPagination
+
+    def get_queryset(self):
+        return WalletTransaction.objects.filter(wallet__user=self.request.user)
+
+class EarningsSummaryView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    PERIODS = {
+        'day': (None, 30),
+        'week': (TruncWeek, 7 * 12),
+        'month': (TruncMonth, 366),
+    }
+
+    def get(self, request):
+        period = request.query_params.get('period', 'day')
+        if period not in self.PERIODS:
+            return Response({'error': 'period must be one of: day, week, month'}, status=400)
+
+        trunc, default_days = self.PERIODS[period]
+        since = request.query_params.get('since')
+        if since:
+            try:
+                # None when malformed; ValueError when well-formed but impossible (Feb 30th)
+                since = parse_date(since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({'since': 'Expected a date as YYYY-MM-DD.'}, status=400)
+        else:
+            since = timezone.localdate() - timedelta(days=default_days)
+
+        rollups = WalletDailyRollup.objects.filter(wallet__user=request.user, day__gte=since)
+        bucket = F('day') if trunc is None else trunc('day')
+        rows = (
+            rollups.annotate(period=bucket)
+            .values('period')
+            .annotate(
+                credit_total=Sum('credit_total'),
+                debit_total=Sum('debit_total'),
+                credit_count=Sum('credit_count'),
+                debit_count=Sum('debit_count'),
+            )
+            .order_by('-period')
+        )
+
+        results = [dict(row, net=row['credit_total'] - row['debit_total']) for row in rows]
+        return Response({'period': period, 'since': since, 'results': results})
+
 class WithdrawalView(APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request):
-        amount = Decimal(request.data.get('amount', 0))
-        wallet, _ = Wallet.objects.get_or_create(user=request.user)
+        try:
+            amount = Decimal(str(request.data.get('amount', 0)))
+        except InvalidOperation:
+            return Response({'error': 'Invalid amount'}, status=400)
 
-        if amount <= 0:
+        if not amount.is_finite() or amount <= 0:
             return Response({'error': 'Invalid amount'}, status=400)
-        if wallet.balance < amount:
+
+        try:
+            new_balance = ledger.debit(request.user, amount, "Withdrawal Request")
+        except ledger.InsufficientFunds:
             return Response({'error': 'Insufficient funds'}, status=400)
 
-        wallet.balance -= amount
-        wallet.save()
+        return Response({'status': 'Withdrawal Successful', 'new_balance': new_balance})
 
-        WalletTransaction.objects.create(
-            wallet=wallet,
-            amount=amount,
-            transaction_type='debit',
-            description="Withdrawal Request"
-        )
+class MetricsView(APIView):
+    """Rolling per-view latency/query summary collected by RequestMetricsMiddleware."""
+    permission_classes = [permissions.IsAdminUser]
 
-        return Response({'status': 'Withdrawal Successful', 'new_balance': wallet.balance})
\ No newline at end of file
+    def get(self, request):
+        return Response(metrics.store.snapshot())
+
+    def delete(self, request):
+        metrics.store.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
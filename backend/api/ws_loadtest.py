@@ -0,0 +1,299 @@
+import asyncio
+import base64
+import json
+import os
+import struct
+from time import perf_counter
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.utils.module_loading import import_string
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from rest_framework_simplejwt.tokens import AccessToken
+from .metrics import percentile
+from .models import User, Conversation, Delivery
+
+# Load generator for the chat and delivery tracking websockets. Opens riders
+# and watchers per delivery and chatters per conversation, has every rider and
+# chatter send at a fixed rate, and measures the time from send until each
+# group member receives the fan-out.
+#
+# Two transports share the same client interface:
+#   communicator - drives the ASGI app in-process via Channels' WebsocketCommunicator
+#   socket       - real websocket connections to a running server
+#
+# Latencies are measured on one clock: the sender records when each message
+# went out, keyed by its payload, and receivers look the payload up.
+
+USERNAME_PREFIX = 'wsload-'
+BASE_LATITUDE = -0.4201
+BASE_LONGITUDE = 36.9476
+CONNECT_TIMEOUT = 10
+DRAIN_TIMEOUT = 5
+
+
+class CommunicatorClient:
+    def __init__(self, application, path):
+        self.communicator = WebsocketCommunicator(application, path)
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=CONNECT_TIMEOUT)
+        if not connected:
+            raise ConnectionError("Connection rejected")
+
+    async def send(self, text):
+        await self.communicator.send_to(text_data=text)
+
+    async def receive(self):
+        # Read the output queue directly: receive_from() cancels the app on timeout
+        while True:
+            message = await self.communicator.output_queue.get()
+            if message['type'] == 'websocket.send':
+                return message.get('text')
+            if message['type'] == 'websocket.close':
+                raise ConnectionError("Connection closed")
+
+    async def close(self):
+        await self.communicator.disconnect()
+
+
+class SocketClient:
+    """
+    Minimal asyncio websocket client (RFC 6455, text frames only). autobahn's
+    asyncio flavour can't be used in-process: daphne has already pinned txaio
+    to Twisted.
+    """
+    def __init__(self, base_url, path):
+        self.url = base_url.rstrip('/') + path
+        self.reader = self.writer = None
+
+    async def connect(self):
+        parts = urlsplit(self.url)
+        secure = parts.scheme == 'wss'
+        port = parts.port or (443 if secure else 80)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=secure or None), CONNECT_TIMEOUT
+        )
+        key = base64.b64encode(os.urandom(16)).decode()
+        target = parts.path + (f'?{parts.query}' if parts.query else '')
+        self.writer.write((
+            f'GET {target} HTTP/1.1\r\nHost: {parts.hostname}:{port}\r\nUpgrade: websocket\r\n'
+            f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n'
+        ).encode())
+        head = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), CONNECT_TIMEOUT)
+        if not head.startswith(b'HTTP/1.1 101'):
+            self.writer.close()
+            raise ConnectionError(f"Handshake failed: {head.splitlines()[0].decode()}")
+
+    def _frame(self, opcode, payload):
+        # Client frames must be masked
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        return header + mask + bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    async def send(self, text):
+        self.writer.write(self._frame(0x1, text.encode()))
+        await self.writer.drain()
+
+    async def receive(self):
+        message = b''
+        while True:
+            try:
+                first, second = await self.reader.readexactly(2)
+                length = second & 0x7f
+                if length == 126:
+                    length, = struct.unpack('!H', await self.reader.readexactly(2))
+                elif length == 127:
+                    length, = struct.unpack('!Q', await self.reader.readexactly(8))
+                payload = await self.reader.readexactly(length)
+            except (asyncio.IncompleteReadError, ConnectionResetError):
+                raise ConnectionError("Connection closed")
+
+            opcode = first & 0x0f
+            if opcode == 0x8:
+                raise ConnectionError("Connection closed")
+            if opcode == 0x9:
+                self.writer.write(self._frame(0xa, payload))
+                continue
+            if opcode in (0x0, 0x1):
+                message += payload
+                if first & 0x80:
+                    return message.decode()
+
+    async def close(self):
+        try:
+            self.writer.write(self._frame(0x8, struct.pack('!H', 1000)))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+class StreamStats:
+    def __init__(self, name):
+        self.name = name
+        self.sent_at = {}
+        self.connect_times = []
+        self.latencies = []
+        self.sent = 0
+        self.expected = 0
+        self.errors = 0
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        connects = sorted(self.connect_times)
+        return {
+            'connections': len(connects),
+            'connect_p50_ms': round(percentile(connects, 50), 2),
+            'connect_max_ms': round(connects[-1], 2) if connects else None,
+            'sent': self.sent,
+            'expected_deliveries': self.expected,
+            'received': len(latencies),
+            'lost': self.expected - len(latencies),
+            'errors': self.errors,
+            'messages_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+            'latency_p50_ms': round(percentile(latencies, 50), 2),
+            'latency_p95_ms': round(percentile(latencies, 95), 2),
+            'latency_p99_ms': round(percentile(latencies, 99), 2),
+            'latency_max_ms': round(latencies[-1], 2) if latencies else None,
+        }
+
+
+def create_fixtures(deliveries, riders, watchers, rooms, chatters):
+    """Create the users, deliveries and conversations for a run. Returns the plan of connections."""
+    def make_users(label, user_type, count):
+        return User.objects.bulk_create([
+            User(email=f'{USERNAME_PREFIX}{label}{i}@load.test', username=f'{USERNAME_PREFIX}{label}{i}', user_type=user_type)
+            for i in range(count)
+        ])
+
+    delivery_rows = Delivery.objects.bulk_create([
+        Delivery(pickup_location='Nyeri', dropoff_location='Karatina', status='shipped')
+        for _ in range(deliveries)
+    ])
+    rider_users = make_users('rider', 'rider', deliveries * riders)
+    watcher_users = make_users('watcher', 'parent', deliveries * watchers)
+    tracking = [
+        (delivery.id, rider_users[i * riders:(i + 1) * riders], watcher_users[i * watchers:(i + 1) * watchers])
+        for i, delivery in enumerate(delivery_rows)
+    ]
+
+    conversations = Conversation.objects.bulk_create([Conversation() for _ in range(rooms)])
+    chatter_users = make_users('chatter', 'parent', rooms * chatters)
+    chat = [
+        (conversation.id, chatter_users[i * chatters:(i + 1) * chatters])
+        for i, conversation in enumerate(conversations)
+    ]
+    Conversation.participants.through.objects.bulk_create([
+        Conversation.participants.through(conversation_id=room_id, user_id=user.id)
+        for room_id, users in chat for user in users
+    ])
+    return {'tracking': tracking, 'chat': chat}
+
+def delete_fixtures(plan):
+    Delivery.objects.filter(id__in=[delivery_id for delivery_id, _, _ in plan['tracking']]).delete()
+    Conversation.objects.filter(id__in=[room_id for room_id, _ in plan['chat']]).delete()
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+async def _open(make_client, path, user, stats, semaphore):
+    client = make_client(f'{path}?token={AccessToken.for_user(user)}')
+    async with semaphore:
+        start = perf_counter()
+        await client.connect()
+        stats.connect_times.append((perf_counter() - start) * 1000)
+    return client
+
+async def _read(client, stats, key_of):
+    while True:
+        try:
+            text = await client.receive()
+        except ConnectionError:
+            stats.errors += 1
+            return
+        received = perf_counter()
+        sent = stats.sent_at.get(key_of(json.loads(text)))
+        if sent is not None:
+            stats.latencies.append((received - sent) * 1000)
+
+async def _send_at_rate(rate, duration, send):
+    interval = 1 / rate
+    next_at = start = perf_counter()
+    seq = 0
+    while next_at - start < duration:
+        await send(seq)
+        seq += 1
+        next_at += interval
+        await asyncio.sleep(max(0, next_at - perf_counter()))
+
+async def run_load(plan, make_client, location_rate=1.0, chat_rate=0.2, duration=10, connect_concurrency=50):
+    """Open every connection in the plan, stream for `duration` seconds and return the per-stream report."""
+    tracking, chat = StreamStats('tracking'), StreamStats('chat')
+    semaphore = asyncio.Semaphore(connect_concurrency)
+    opened = []   # (client, stats, key_of, send function or None, send rate)
+
+    for delivery_id, riders, watchers in plan['tracking']:
+        path = f'/ws/delivery/{delivery_id}/'
+        clients = await asyncio.gather(*[_open(make_client, path, user, tracking, semaphore) for user in riders + watchers])
+        group_size = len(clients)
+        for index, client in enumerate(clients[:len(riders)]):
+            async def send(seq, client=client, index=index, delivery_id=delivery_id, group_size=group_size):
+                # Each (rider, seq) gets its own coordinates so receivers can match them up
+                point = (round(BASE_LATITUDE + seq * 1e-5, 6), round(BASE_LONGITUDE + index * 1e-5, 6))
+                tracking.sent_at[(delivery_id, *point)] = perf_counter()
+                tracking.sent += 1
+                tracking.expected += group_size
+                await client.send(json.dumps({'latitude': point[0], 'longitude': point[1], 'status': 'shipped', 'heading': 90}))
+            opened.append((client, tracking, lambda data, delivery_id=delivery_id: (delivery_id, data['latitude'], data['longitude']), send, location_rate))
+        for client in clients[len(riders):]:
+            opened.append((client, tracking, lambda data, delivery_id=delivery_id: (delivery_id, data['latitude'], data['longitude']), None, None))
+
+    for room_id, users in plan['chat']:
+        path = f'/ws/chat/{room_id}/'
+        clients = await asyncio.gather(*[_open(make_client, path, user, chat, semaphore) for user in users])
+        for client, user in zip(clients, users):
+            async def send(seq, client=client, user=user, room_id=room_id, group_size=len(clients)):
+                message = f'load {room_id} {user.id} {seq}'
+                chat.sent_at[message] = perf_counter()
+                chat.sent += 1
+                chat.expected += group_size
+                await client.send(json.dumps({'message': message}))
+            opened.append((client, chat, lambda data: data.get('message'), send, chat_rate))
+
+    readers = [asyncio.ensure_future(_read(client, stats, key_of)) for client, stats, key_of, _, _ in opened]
+    start = perf_counter()
+    await asyncio.gather(*[
+        _send_at_rate(rate, duration, send) for _, _, _, send, rate in opened if send is not None and rate
+    ])
+
+    # Let in-flight fan-out arrive before stopping the readers
+    deadline = perf_counter() + DRAIN_TIMEOUT
+    while perf_counter() < deadline and any(len(s.latencies) < s.expected for s in (tracking, chat)):
+        await asyncio.sleep(0.05)
+    elapsed = perf_counter() - start
+
+    for reader in readers:
+        reader.cancel()
+    await asyncio.gather(*readers, return_exceptions=True)
+    await asyncio.gather(*[client.close() for client, _, _, _, _ in opened], return_exceptions=True)
+    return {stats.name: stats.report(elapsed) for stats in (tracking, chat)}
+
+def communicator_factory():
+    application = import_string(settings.ASGI_APPLICATION)
+    return lambda path_with_query: CommunicatorClient(application, path_with_query)
+
+def socket_factory(base_url):
+    return lambda path_with_query: SocketClient(base_url, path_with_query)
+
+async def run(make_client, deliveries=5, riders=1, watchers=10, rooms=5, chatters=4, **options):
+    plan = await database_sync_to_async(create_fixtures)(deliveries, riders, watchers, rooms, chatters)
+    try:
+        return await run_load(plan, make_client, **options)
+    finally:
+        await database_sync_to_async(delete_fixtures)(plan)
@@ -1,7 +1,12 @@
 import React, { useState, useEffect, useRef, useMemo } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import api from '../utils/api';
+import {
+    addLiveMessage, applyReadReceipt, cachedMessages, chatSocketUrl, hasOlderMessages, lastIncomingId, loadHistory, loadOlderMessages
+} from '../utils/messageHistory';
+
+const TYPING_SHOWN_MS = 4000;
+const TYPING_RESEND_MS = 3000;
 
 const ChatWidget = ({ conversationId, delivery }) => {
     const { user } = useAuth();
@@ -9,8 +14,14 @@ const ChatWidget = ({ conversationId, delivery }) => {
     const [messages, setMessages] = useState([]);
     const [newMessage, setNewMessage] = useState("");
     const [isOpen, setIsOpen] = useState(false);
+    const [hasOlder, setHasOlder] = useState(false);
+    const [connected, setConnected] = useState(false);
+    const [online, setOnline] = useState([]);
+    const [typing, setTyping] = useState({});
     const ws = useRef(null);
     const messagesEndRef = useRef(null);
+    const lastReadSent = useRef(null);
+    const lastTypingSent = useRef(0);
 
 
     const participantMap = useMemo(() => {
@@ -55,29 +66,33 @@ const ChatWidget = ({ conversationId, delivery }) => {
     useEffect(() => {
         if (isOpen && conversationId) {
 
-            api.get(`conversations/${conversationId}/messages/`)
-                .then(res => {
-                    setMessages(res.data);
+            // Show what we already have, then fetch only what's new
+            setMessages(cachedMessages(conversationId));
+            loadHistory(conversationId)
+                .then(history => {
+                    setMessages(history);
+                    setHasOlder(hasOlderMessages(conversationId));
                     scrollToBottom();
                 })
                 .catch(err => console.error("Chat Load Error", err));
 
-            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            const wsUrl = `${protocol}//${window.location.hostname}:8000/ws/chat/${conversationId}/`;
-
-            ws.current = new WebSocket(wsUrl);
+            ws.current = new WebSocket(chatSocketUrl(conversationId));
 
-            ws.current.onopen = () => console.log("Widget WS Connected");
+            ws.current.onopen = () => setConnected(true);
+            ws.current.onclose = () => setConnected(false);
 
             ws.current.onmessage = (event) => {
                 const data = JSON.parse(event.data);
-                setMessages((prev) => [...prev, {
-                    id: Date.now(),
-                    content: data.message,
-                    sender: { id: data.sender_id },
-                    timestamp: new Date().toISOString()
-                }]);
-                scrollToBottom();
+                if (data.type === 'presence') {
+                    setOnline(data.user_ids);
+                } else if (data.type === 'typing') {
+                    showTyping(data);
+                } else if (data.type === 'read') {
+                    setMessages((prev) => applyReadReceipt(conversationId, data, prev));
+                } else {
+                    setMessages((prev) => addLiveMessage(conversationId, data, prev));
+                    scrollToBottom();
+                }
             };
 
             ws.current.onerror = (e) => console.error("Widget WS Error", e);
@@ -88,22 +103,58 @@ const ChatWidget = ({ conversationId, delivery }) => {
                 ws.current.close();
                 ws.current = null;
             }
+            lastReadSent.current = null;
         };
     }, [isOpen, conversationId]);
 
+    // Tell the room how far we've read; the server batches these into one update
+    useEffect(() => {
+        if (!isOpen || !connected) return;
+        const lastId = lastIncomingId(messages, user?.id);
+        if (lastId && lastId !== lastReadSent.current && ws.current?.readyState === WebSocket.OPEN) {
+            ws.current.send(JSON.stringify({ type: 'read', message_id: lastId }));
+            lastReadSent.current = lastId;
+        }
+    }, [messages, isOpen, connected]);
+
+    const showTyping = (data) => {
+        if (String(data.user_id) === String(user?.id)) return;
+        setTyping((prev) => ({ ...prev, [data.user_id]: data.is_typing ? Date.now() : undefined }));
+        setTimeout(() => {
+            setTyping((prev) => (prev[data.user_id] && Date.now() - prev[data.user_id] >= TYPING_SHOWN_MS ? { ...prev, [data.user_id]: undefined } : prev));
+        }, TYPING_SHOWN_MS);
+    };
+
+    const sendTyping = (isTyping) => {
+        if (ws.current?.readyState !== WebSocket.OPEN) return;
+        if (isTyping && Date.now() - lastTypingSent.current < TYPING_RESEND_MS) return;
+        ws.current.send(JSON.stringify({ type: 'typing', is_typing: isTyping }));
+        lastTypingSent.current = isTyping ? Date.now() : 0;
+    };
+
+    const typingNames = Object.keys(typing).filter((id) => typing[id]).map((id) => getSenderInfo(id).name);
+    const othersOnline = online.filter((id) => String(id) !== String(user?.id)).length;
+
     const scrollToBottom = () => {
         setTimeout(() => {
             messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
         }, 100);
     };
 
+    const showOlder = () => {
+        loadOlderMessages(conversationId)
+            .then(history => {
+                setMessages(history);
+                setHasOlder(hasOlderMessages(conversationId));
+            })
+            .catch(err => console.error("Chat Load Error", err));
+    };
+
     const sendMessage = (e) => {
         e.preventDefault();
         if (newMessage.trim() && ws.current && ws.current.readyState === WebSocket.OPEN) {
-            ws.current.send(JSON.stringify({
-                message: newMessage,
-                sender_id: user.id
-            }));
+            ws.current.send(JSON.stringify({ message: newMessage }));
+            sendTyping(false);
             setNewMessage("");
         }
     };
@@ -129,13 +180,22 @@ const ChatWidget = ({ conversationId, delivery }) => {
                             </div>
                             <p className="text-[10px] text-slate-400 truncate">
                                 {delivery ? `Order #${delivery.tracking_code}` : 'Connecting...'}
+                                {othersOnline > 0 && ` · ${othersOnline} online`}
                             </p>
+                            {typingNames.length > 0 && (
+                                <p className="text-[10px] text-green-400 truncate">{typingNames.join(', ')} typing...</p>
+                            )}
                         </div>
                         <button onClick={() => setIsOpen(false)} className="text-gray-400 hover:text-white px-2">✕</button>
                     </div>
 
 
                     <div className="flex-1 overflow-y-auto p-3 space-y-3 bg-gray-50">
+                        {hasOlder && (
+                            <button onClick={showOlder} className="block mx-auto text-[10px] text-slate-500 hover:text-slate-800 underline">
+                                Load earlier messages
+                            </button>
+                        )}
                         {messages.length === 0 && <p className="text-xs text-center text-gray-400 mt-10">No messages yet.</p>}
 
                         {messages.map((msg, idx) => {
@@ -144,7 +204,7 @@ const ChatWidget = ({ conversationId, delivery }) => {
                             const { name, role } = getSenderInfo(senderId);
 
                             return (
-                                <div key={idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
+                                <div key={msg.id || idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
                                     <div className={`max-w-[85%] p-2 rounded-xl text-sm shadow-sm relative ${isMe ? 'bg-slate-800 text-white rounded-br-none' : 'bg-white text-gray-800 border border-gray-200 rounded-bl-none'
                                         }`}>
                                         {!isMe && (
@@ -162,6 +222,7 @@ const ChatWidget = ({ conversationId, delivery }) => {
                                         <p className="leading-snug break-words">{msg.content}</p>
                                         <p className={`text-[9px] text-right mt-1 ${isMe ? 'text-slate-400' : 'text-gray-400'}`}>
                                             {msg.timestamp ? new Date(msg.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' }) : ''}
+                                            {isMe && msg.is_read ? ' ✓✓' : ''}
                                         </p>
                                     </div>
                                 </div>
@@ -175,7 +236,7 @@ const ChatWidget = ({ conversationId, delivery }) => {
                         <input
                             className="flex-1 border rounded-lg px-3 py-2 text-sm focus:outline-none focus:ring-2 focus:ring-slate-500 bg-gray-50"
                             value={newMessage}
-                            onChange={(e) => setNewMessage(e.target.value)}
+                            onChange={(e) => { setNewMessage(e.target.value); sendTyping(true); }}
                             placeholder="Message group..."
                         />
                         <button type="submit" className="bg-slate-900 hover:bg-black text-white px-4 rounded-lg text-lg font-bold shadow transition">
@@ -2,12 +2,14 @@ import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
 import { useCart } from '../context/CartContext';
+import { useNotification } from '../context/NotificationContext';
 import { getConversations } from '../utils/api';
 import SearchBar from './SearchBar';
 
 const Navbar = () => {
     const { user, logout } = useAuth();
     const { cart } = useCart();
+    const { subscribe } = useNotification();
     const navigate = useNavigate();
     const [isMenuOpen, setIsMenuOpen] = useState(false);
     const [unreadMessages, setUnreadMessages] = useState(0);
@@ -24,16 +26,18 @@ const Navbar = () => {
             try {
                 const res = await getConversations();
 
-                setUnreadMessages(res.data.length);
+                setUnreadMessages(res.data.reduce((total, chat) => total + (chat.unread_count || 0), 0));
             } catch (err) {
                 console.error("Msg check failed", err);
             }
         };
 
         checkMessages();
-        const interval = setInterval(checkMessages, 15000);
-        return () => clearInterval(interval);
-    }, [user]);
+        // Recount when a message arrives rather than on a timer
+        return subscribe((event) => {
+            if (event.type === 'message') checkMessages();
+        });
+    }, [user, subscribe]);
 
     const getLinks = () => {
         if (!user) return [
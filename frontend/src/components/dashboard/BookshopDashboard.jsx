@@ -5,12 +5,15 @@ import {
     deleteListing,
     uploadListingCsv,
     createTextbook,
-    getMyDeliveries
+    getMyDeliveries,
+    downloadExport
 } from '../../utils/api';
 import { Link, useNavigate } from 'react-router-dom';
+import { useNotification } from '../../context/NotificationContext';
 
 const BookshopDashboard = ({ user }) => {
     const navigate = useNavigate();
+    const { subscribe } = useNotification();
     const [listings, setListings] = useState([]);
     const [deliveries, setDeliveries] = useState([]);
     const [loading, setLoading] = useState(true);
@@ -20,7 +23,11 @@ const BookshopDashboard = ({ user }) => {
 
     useEffect(() => {
         fetchData();
-    }, []);
+        // New orders, payments and riders show up without a reload
+        return subscribe((event) => {
+            if (['order_placed', 'payment_confirmed', 'rider_assigned', 'delivery_updated'].includes(event.type)) fetchData();
+        });
+    }, [subscribe]);
 
     const fetchData = async () => {
         setLoading(true);
@@ -90,6 +97,14 @@ const BookshopDashboard = ({ user }) => {
         }
     };
 
+    const handleExport = async (kind, fileFormat) => {
+        try {
+            await downloadExport(kind, fileFormat);
+        } catch (err) {
+            alert("Export failed.");
+        }
+    };
+
     const getStatusBadge = (status) => {
         const styles = {
             pending: 'bg-yellow-100 text-yellow-800',
@@ -134,6 +149,17 @@ const BookshopDashboard = ({ user }) => {
             </div>
 
 
+            <div className="flex flex-wrap justify-end gap-2 mb-4 text-sm">
+                <span className="self-center text-gray-500 font-medium">Download:</span>
+                {[['inventory', 'Inventory'], ['orders', 'Orders'], ['ledger', 'Wallet Ledger']].map(([kind, label]) => (
+                    <div key={kind} className="flex rounded-md border bg-white overflow-hidden">
+                        <span className="px-3 py-1 text-gray-700">{label}</span>
+                        <button onClick={() => handleExport(kind, 'csv')} className="px-2 py-1 border-l text-purple-700 hover:bg-purple-50">CSV</button>
+                        <button onClick={() => handleExport(kind, 'xlsx')} className="px-2 py-1 border-l text-green-700 hover:bg-green-50">XLSX</button>
+                    </div>
+                ))}
+            </div>
+
             {activeTab === 'inventory' && (
                 <div className="bg-white rounded-xl shadow-sm border border-gray-200 overflow-hidden">
                     <table className="min-w-full divide-y divide-gray-200">
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Link, useNavigate } from 'react-router-dom';
 import { getMyListings, getConversations, getMySwaps, acceptSwap, rejectSwap, getMyDeliveries } from '../../utils/api';
 import DeliveryCard from './DeliveryCard';
+import { useNotification } from '../../context/NotificationContext';
 
 const ParentDashboard = ({ user }) => {
     const [listings, setListings] = useState([]);
@@ -9,6 +10,7 @@ const ParentDashboard = ({ user }) => {
     const [swaps, setSwaps] = useState([]);
     const [deliveries, setDeliveries] = useState([]);
     const navigate = useNavigate();
+    const { subscribe } = useNotification();
 
     useEffect(() => {
         const loadData = async () => {
@@ -29,7 +31,10 @@ const ParentDashboard = ({ user }) => {
             }
         };
         loadData();
-    }, []);
+        return subscribe((event) => {
+            if (event.type !== 'message') loadData();
+        });
+    }, [subscribe]);
 
     const handleSwapAction = async (id, action) => {
         try {
@@ -28,10 +28,23 @@ export const CartProvider = ({ children }) => {
         }
     };
 
-    const addToCart = async (listingId) => {
+    // Add/remove return only { item_id, total, count }, so apply the change
+    // locally instead of re-downloading the whole cart
+    const addToCart = async (listingId, listing = null) => {
         try {
-            const response = await apiAddToCart(listingId);
-            setCart(response.data);
+            const { data } = await apiAddToCart(listingId);
+            const alreadyInCart = cart?.items?.some(item => item.id === data.item_id);
+
+            if (listing && !alreadyInCart) {
+                setCart(prev => ({
+                    ...prev,
+                    items: [...(prev?.items || []), { id: data.item_id, listing, added_at: new Date().toISOString() }],
+                    total: data.total,
+                    count: data.count
+                }));
+            } else if (!alreadyInCart) {
+                await fetchCart();
+            }
             notify("Added to cart!", "success");
         } catch (error) {
             const errorMsg = error.response?.data?.error || "Failed to add to cart";
@@ -41,8 +54,13 @@ export const CartProvider = ({ children }) => {
 
     const removeFromCart = async (cartItemId) => {
         try {
-            const response = await apiRemoveFromCart(cartItemId);
-            setCart(response.data);
+            const { data } = await apiRemoveFromCart(cartItemId);
+            setCart(prev => ({
+                ...prev,
+                items: (prev?.items || []).filter(item => item.id !== cartItemId),
+                total: data.total,
+                count: data.count
+            }));
             notify("Removed from cart.", "info");
         } catch (error) {
             console.error("Failed to remove item", error);
@@ -53,6 +71,7 @@ export const CartProvider = ({ children }) => {
     const value = {
         cart,
         loading,
+        setCart,
         addToCart,
         removeFromCart
     };
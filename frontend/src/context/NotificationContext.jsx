@@ -1,11 +1,27 @@
-import React, { createContext, useContext, useState, useCallback } from 'react';
+import React, { createContext, useContext, useState, useCallback, useEffect, useRef } from 'react';
+import { useAuth } from './AuthContext';
 
 const NotificationContext = createContext();
 
 export const useNotification = () => useContext(NotificationContext);
 
+// Server events from ws/notifications/ that deserve a toast; the rest only
+// reach subscribers (see subscribe below)
+const EVENT_TOASTS = {
+    swap_received: (e) => [`🔄 ${e.sender || 'A parent'} sent you a swap request`, 'info'],
+    swap_accepted: () => ['🔄 Your swap request was accepted', 'success'],
+    swap_rejected: () => ['Your swap request was declined', 'error'],
+    order_placed: (e) => [`📦 ${e.buyer} ordered ${e.count} book${e.count === 1 ? '' : 's'}`, 'success'],
+    payment_confirmed: () => ['💳 Payment confirmed', 'success'],
+    rider_assigned: (e) => [`🏍️ ${e.rider} is picking up your delivery`, 'info'],
+};
+
+const RECONNECT_MS = 5000;
+
 export const NotificationProvider = ({ children }) => {
+    const { user } = useAuth();
     const [notifications, setNotifications] = useState([]);
+    const listeners = useRef(new Set());
 
     const notify = useCallback((message, type = 'info') => {
         const id = Date.now();
@@ -20,8 +36,45 @@ export const NotificationProvider = ({ children }) => {
         setNotifications(prev => prev.filter(n => n.id !== id));
     };
 
+    // Pages register a handler for live server events instead of polling.
+    // Returns the unsubscribe function, so it can be an effect's cleanup.
+    const subscribe = useCallback((handler) => {
+        listeners.current.add(handler);
+        return () => listeners.current.delete(handler);
+    }, []);
+
+    // One socket per signed-in client for every server-side event
+    useEffect(() => {
+        if (!user) return;
+        let socket = null;
+        let retry = null;
+        let closed = false;
+
+        const connect = () => {
+            const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+            const token = localStorage.getItem('access_token');
+            socket = new WebSocket(`${protocol}//${window.location.hostname}:8000/ws/notifications/?token=${token}`);
+            socket.onmessage = (e) => {
+                const event = JSON.parse(e.data);
+                const toast = EVENT_TOASTS[event.type];
+                if (toast) notify(...toast(event));
+                listeners.current.forEach((handler) => handler(event));
+            };
+            socket.onclose = () => {
+                if (!closed) retry = setTimeout(connect, RECONNECT_MS);
+            };
+        };
+
+        connect();
+        return () => {
+            closed = true;
+            clearTimeout(retry);
+            if (socket) socket.close();
+        };
+    }, [user, notify]);
+
     return (
-        <NotificationContext.Provider value={{ notify }}>
+        <NotificationContext.Provider value={{ notify, subscribe }}>
             {children}
             <div className="fixed bottom-5 right-5 z-[3000] flex flex-col gap-3">
                 {notifications.map(({ id, message, type }) => (
@@ -17,7 +17,7 @@ const CartPage = () => {
     if (loading && !cart) return <div className="p-8 text-center">Loading cart...</div>;
 
     const items = cart?.items || [];
-    const total = items.reduce((sum, item) => sum + Number(item.listing.price), 0);
+    const total = Number(cart?.total ?? items.reduce((sum, item) => sum + Number(item.listing.price), 0));
 
     const requestRemove = (itemId) => {
         setConfirmModal({
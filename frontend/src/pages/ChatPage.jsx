@@ -1,10 +1,18 @@
 import React, { useState, useEffect, useRef, useMemo } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { getConversations, getMessages } from '../utils/api';
+import { useNotification } from '../context/NotificationContext';
+import { getConversations } from '../utils/api';
+import {
+    addLiveMessage, applyReadReceipt, cachedMessages, chatSocketUrl, hasOlderMessages, lastIncomingId, loadHistory, loadOlderMessages
+} from '../utils/messageHistory';
+
+const TYPING_SHOWN_MS = 4000;
+const TYPING_RESEND_MS = 3000;
 
 const ChatPage = () => {
     const { user } = useAuth();
+    const { subscribe } = useNotification();
     const { conversationId } = useParams();
     const navigate = useNavigate();
 
@@ -13,9 +21,15 @@ const ChatPage = () => {
     const [messages, setMessages] = useState([]);
     const [inputText, setInputText] = useState('');
     const [loading, setLoading] = useState(true);
+    const [hasOlder, setHasOlder] = useState(false);
+    const [connected, setConnected] = useState(false);
+    const [online, setOnline] = useState([]);
+    const [typing, setTyping] = useState({});
 
     const wsRef = useRef(null);
     const messageListRef = useRef(null);
+    const lastReadSent = useRef(null);
+    const lastTypingSent = useRef(0);
 
 
     const participantMap = useMemo(() => {
@@ -92,6 +106,18 @@ const ChatPage = () => {
             .catch(() => setLoading(false));
     }, []);
 
+    // Messages in other chats arrive on the notification socket
+    useEffect(() => subscribe((event) => {
+        if (event.type !== 'message' || event.conversation_id === activeChat?.id) return;
+        if (!conversations.some((chat) => chat.id === event.conversation_id)) {
+            getConversations().then(res => setConversations(res.data));
+            return;
+        }
+        setConversations((prev) => prev.map((chat) => (chat.id === event.conversation_id
+            ? { ...chat, last_message: event.preview, unread_count: (chat.unread_count || 0) + 1 }
+            : chat)));
+    }), [activeChat, conversations, subscribe]);
+
 
     useEffect(() => {
         if (conversationId && conversations.length > 0) {
@@ -104,43 +130,91 @@ const ChatPage = () => {
     useEffect(() => {
         if (!activeChat) return;
 
-        setMessages([]);
-        getMessages(activeChat.id).then(res => {
-            setMessages(res.data);
+        const chatId = activeChat.id;
+        setMessages(cachedMessages(chatId));
+        setHasOlder(hasOlderMessages(chatId));
+        loadHistory(chatId).then(history => {
+            setMessages(history);
+            setHasOlder(hasOlderMessages(chatId));
             scrollToBottom();
         });
 
         if (wsRef.current) wsRef.current.close();
 
-        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.hostname}:8000/ws/chat/${activeChat.id}/`;
-        const ws = new WebSocket(wsUrl);
+        setOnline([]);
+        setTyping({});
+        lastReadSent.current = null;
+        const ws = new WebSocket(chatSocketUrl(chatId));
+
+        ws.onopen = () => setConnected(true);
+        ws.onclose = () => setConnected(false);
 
         ws.onmessage = (event) => {
             const data = JSON.parse(event.data);
-            setMessages((prev) => [...prev, {
-                id: Date.now(),
-                content: data.message,
-                sender: { id: data.sender_id },
-                timestamp: new Date().toISOString()
-            }]);
-            scrollToBottom();
+            if (data.type === 'presence') {
+                setOnline(data.user_ids);
+            } else if (data.type === 'typing') {
+                showTyping(data);
+            } else if (data.type === 'read') {
+                setMessages((prev) => applyReadReceipt(chatId, data, prev));
+            } else {
+                setMessages((prev) => addLiveMessage(chatId, data, prev));
+                scrollToBottom();
+            }
         };
 
         wsRef.current = ws;
         return () => ws.close();
     }, [activeChat]);
 
+    // Tell the room how far we've read; the server batches these into one update
+    useEffect(() => {
+        if (!activeChat || !connected) return;
+        const lastId = lastIncomingId(messages, user?.id);
+        if (lastId && lastId !== lastReadSent.current && wsRef.current?.readyState === WebSocket.OPEN) {
+            wsRef.current.send(JSON.stringify({ type: 'read', message_id: lastId }));
+            lastReadSent.current = lastId;
+            setConversations((prev) => prev.map((chat) => (chat.id === activeChat.id ? { ...chat, unread_count: 0 } : chat)));
+        }
+    }, [messages, activeChat, connected]);
+
+    const showTyping = (data) => {
+        if (String(data.user_id) === String(user?.id)) return;
+        setTyping((prev) => ({ ...prev, [data.user_id]: data.is_typing ? Date.now() : undefined }));
+        setTimeout(() => {
+            setTyping((prev) => (prev[data.user_id] && Date.now() - prev[data.user_id] >= TYPING_SHOWN_MS ? { ...prev, [data.user_id]: undefined } : prev));
+        }, TYPING_SHOWN_MS);
+    };
+
+    const sendTyping = (isTyping) => {
+        if (wsRef.current?.readyState !== WebSocket.OPEN) return;
+        if (isTyping && Date.now() - lastTypingSent.current < TYPING_RESEND_MS) return;
+        wsRef.current.send(JSON.stringify({ type: 'typing', is_typing: isTyping }));
+        lastTypingSent.current = isTyping ? Date.now() : 0;
+    };
+
+    const typingNames = Object.keys(typing).filter((id) => typing[id]).map((id) => getSenderInfo(id).name);
+    const othersOnline = online.filter((id) => String(id) !== String(user?.id)).length;
+
     const scrollToBottom = () => {
         setTimeout(() => {
             if (messageListRef.current) messageListRef.current.scrollTop = messageListRef.current.scrollHeight;
         }, 100);
     };
 
+    const showOlder = () => {
+        const chatId = activeChat.id;
+        loadOlderMessages(chatId).then(history => {
+            setMessages(history);
+            setHasOlder(hasOlderMessages(chatId));
+        });
+    };
+
     const handleSend = (e) => {
         e.preventDefault();
         if (!inputText.trim() || !wsRef.current) return;
-        wsRef.current.send(JSON.stringify({ message: inputText, sender_id: user.id }));
+        wsRef.current.send(JSON.stringify({ message: inputText }));
+        sendTyping(false);
         setInputText('');
     };
 
@@ -158,7 +232,10 @@ const ChatPage = () => {
                                     <span className="font-bold text-gray-900 truncate pr-2">
                                         {chat.delivery ? `Order #${chat.delivery.tracking_code}` : (chat.other_user?.username || 'User')}
                                     </span>
-                                    <span className="text-[10px] text-gray-400 shrink-0">{new Date(chat.updated_at).toLocaleDateString()}</span>
+                                    <span className="text-[10px] text-gray-400 shrink-0">
+                                        {chat.unread_count > 0 && <span className="bg-green-600 text-white rounded-full px-1.5 mr-1 font-bold">{chat.unread_count}</span>}
+                                        {new Date(chat.updated_at).toLocaleDateString()}
+                                    </span>
                                 </div>
                                 <div className="text-xs text-green-700 font-bold mb-1 truncate">
                                     {chat.delivery ? "📦 Delivery Chat" : (chat.listing?.textbook?.title || "Inquiry")}
@@ -180,17 +257,24 @@ const ChatPage = () => {
                                         {activeChat.delivery ? `Order #${activeChat.delivery.tracking_code}` : (activeChat.other_user?.username || 'Chat')}
                                     </h3>
                                     {activeChat.delivery && <span className="text-xs bg-purple-100 text-purple-700 px-2 py-0.5 rounded font-bold">Group Chat</span>}
+                                    {othersOnline > 0 && <span className="text-xs text-green-600 ml-2">● {othersOnline} online</span>}
+                                    {typingNames.length > 0 && <p className="text-xs text-gray-500 italic">{typingNames.join(', ')} typing...</p>}
                                 </div>
                             </div>
 
                             <div ref={messageListRef} className="flex-1 overflow-y-auto p-4 space-y-4 bg-[#e5ddd5] bg-opacity-30">
+                                {hasOlder && (
+                                    <button onClick={showOlder} className="block mx-auto text-xs text-gray-500 hover:text-gray-800 underline">
+                                        Load earlier messages
+                                    </button>
+                                )}
                                 {messages.map((msg, idx) => {
                                     const senderId = msg.sender?.id || msg.sender_id;
                                     const isMe = parseInt(senderId) === parseInt(user.id);
                                     const { name, role, color } = getSenderInfo(senderId);
 
                                     return (
-                                        <div key={idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
+                                        <div key={msg.id || idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
                                             <div className={`max-w-[75%] px-4 py-2 rounded-lg shadow-sm text-sm ${isMe ? 'bg-green-600 text-white' : 'bg-white text-gray-800'}`}>
 
                                                 {!isMe && (
@@ -202,6 +286,7 @@ const ChatPage = () => {
                                                 <p className="break-words leading-snug">{msg.content}</p>
                                                 <span className={`text-[10px] block text-right mt-1 opacity-70 ${isMe ? 'text-green-100' : 'text-gray-400'}`}>
                                                     {new Date(msg.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })}
+                                                    {isMe && msg.is_read ? ' ✓✓' : ''}
                                                 </span>
                                             </div>
                                         </div>
@@ -210,7 +295,7 @@ const ChatPage = () => {
                             </div>
 
                             <form onSubmit={handleSend} className="p-4 border-t bg-gray-50 flex gap-2">
-                                <input className="flex-1 border rounded-full px-4 py-2" value={inputText} onChange={e => setInputText(e.target.value)} placeholder="Type a message..." />
+                                <input className="flex-1 border rounded-full px-4 py-2" value={inputText} onChange={e => { setInputText(e.target.value); sendTyping(true); }} placeholder="Type a message..." />
                                 <button type="submit" className="bg-green-600 text-white p-2 rounded-full w-10 h-10 shadow">➤</button>
                             </form>
                         </>
@@ -1,14 +1,19 @@
 import React, { useState, useEffect } from 'react';
-import { getMyEarnings, requestWithdrawal } from '../utils/api';
+import { getMyEarnings, requestWithdrawal, getEarningsHistory, getEarningsSummary } from '../utils/api';
 
 const EarningsPage = () => {
     const [data, setData] = useState({ balance: 0, history: [] });
+    const [summary, setSummary] = useState({ week: null, month: null });
+    const [nextPage, setNextPage] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
-        getMyEarnings()
-            .then(res => {
-                setData(res.data);
+        Promise.all([getMyEarnings(), getEarningsHistory(), getEarningsSummary('week'), getEarningsSummary('month')])
+            .then(([wallet, history, weekly, monthly]) => {
+                setData({ balance: wallet.data.balance, history: history.data.results });
+                setNextPage(history.data.next);
+                setSummary({ week: weekly.data.results[0] || null, month: monthly.data.results[0] || null });
                 setLoading(false);
             })
             .catch(err => {
@@ -18,6 +23,17 @@ const EarningsPage = () => {
             });
     }, []);
 
+    const loadMore = () => {
+        setLoadingMore(true);
+        getEarningsHistory(nextPage)
+            .then(res => {
+                setData(prev => ({ ...prev, history: [...prev.history, ...res.data.results] }));
+                setNextPage(res.data.next);
+            })
+            .catch(err => console.error("Error fetching history:", err))
+            .finally(() => setLoadingMore(false));
+    };
+
     const handleWithdraw = () => {
         const amount = prompt("Enter amount to withdraw (KSh):");
         if (amount) {
@@ -57,6 +73,18 @@ const EarningsPage = () => {
                 </button>
             </div>
 
+            <div className="grid grid-cols-2 gap-4 mb-8">
+                {[['This Week', summary.week], ['This Month', summary.month]].map(([label, totals]) => (
+                    <div key={label} className="bg-white rounded-xl shadow-sm border border-gray-100 p-5">
+                        <p className="text-xs font-bold uppercase text-gray-500">{label}</p>
+                        <p className="text-2xl font-bold text-green-600 mt-1">KSh {Number(totals?.credit_total || 0).toLocaleString()}</p>
+                        <p className="text-xs text-gray-500 mt-1">
+                            {totals?.credit_count || 0} payments · KSh {Number(totals?.debit_total || 0).toLocaleString()} withdrawn
+                        </p>
+                    </div>
+                ))}
+            </div>
+
             <h3 className="font-bold text-gray-700 mb-4">Transaction History</h3>
             <div className="bg-white rounded-xl shadow-sm border border-gray-100 overflow-hidden">
                 {data.history.length === 0 ? (
@@ -75,6 +103,15 @@ const EarningsPage = () => {
                     ))
                 )}
             </div>
+            {nextPage && (
+                <button
+                    onClick={loadMore}
+                    disabled={loadingMore}
+                    className="mt-4 w-full py-2 text-sm font-bold text-gray-600 bg-gray-100 hover:bg-gray-200 rounded-lg transition disabled:opacity-50"
+                >
+                    {loadingMore ? 'Loading...' : 'Load older transactions'}
+                </button>
+            )}
         </div>
     );
 };
@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { Link, useLocation } from 'react-router-dom';
-import api from '../utils/api';
+import api, { getRecommendedListings } from '../utils/api';
 import { useAuth } from '../context/AuthContext';
 import ListingCard from '../components/ListingCard';
 import Hero from '../components/Hero';
@@ -8,6 +8,7 @@ import Hero from '../components/Hero';
 const HomePage = () => {
     const { user } = useAuth();
     const [listings, setListings] = useState([]);
+    const [recommended, setRecommended] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
 
@@ -47,6 +48,14 @@ const HomePage = () => {
         fetchListings();
     }, [location.search, isMarketUser]);
 
+    useEffect(() => {
+        if (!user || user.user_type !== 'parent') return;
+
+        getRecommendedListings()
+            .then(response => setRecommended(response.data.slice(0, 8)))
+            .catch(err => console.error("Failed to fetch recommendations:", err));
+    }, [user]);
+
     return (
         <div className="pb-12 bg-gray-50 min-h-screen">
             <Hero />
@@ -137,6 +146,21 @@ const HomePage = () => {
             )}
 
 
+            {isMarketUser && recommended.length > 0 && !new URLSearchParams(location.search).get('q') && (
+                <div className="container mx-auto px-4 mt-8">
+                    <h2 className="text-2xl font-bold text-gray-900">Recommended for Your Children</h2>
+                    <p className="text-gray-500 text-sm mt-1 mb-6">
+                        Books on your children's class lists, best value and closest first.
+                    </p>
+                    <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-3 lg:grid-cols-4 gap-8">
+                        {recommended.map(listing => (
+                            <ListingCard key={listing.id} listing={listing} />
+                        ))}
+                    </div>
+                </div>
+            )}
+
+
             {isMarketUser && (
                 <div className="container mx-auto px-4 mt-8">
                     <div className="flex flex-col md:flex-row justify-between items-center mb-8 gap-4">
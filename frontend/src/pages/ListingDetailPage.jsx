@@ -66,7 +66,7 @@ const ListingDetailPage = () => {
     const handleAddToCart = async () => {
         if (!user) { navigate('/login'); return; }
         setIsAddingToCart(true);
-        try { await addToCart(listing.id); }
+        try { await addToCart(listing.id, listing); }
         finally { setIsAddingToCart(false); }
     };
 
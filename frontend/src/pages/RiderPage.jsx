@@ -31,7 +31,7 @@ const RecenterMap = ({ lat, lng }) => {
 const RiderPage = () => {
     const [isOnline, setIsOnline] = useState(false);
     const [activeJob, setActiveJob] = useState(null);
-    const { notify } = useNotification();
+    const { notify, subscribe } = useNotification();
     const [showCompleteModal, setShowCompleteModal] = useState(false);
     const [jobs, setJobs] = useState([]);
     const [myLocation, setMyLocation] = useState(null);
@@ -65,12 +65,10 @@ const RiderPage = () => {
         return () => stopTracking();
     }, []);
 
-    useEffect(() => {
-        const interval = setInterval(() => {
-            if (isOnline && !activeJob) loadJobs();
-        }, 8000);
-        return () => clearInterval(interval);
-    }, [isOnline, activeJob]);
+    // The job board refreshes when a job opens up or another rider takes one
+    useEffect(() => subscribe((event) => {
+        if ((event.type === 'job_available' || event.type === 'job_taken') && isOnline && !activeJob) loadJobs();
+    }), [isOnline, activeJob, subscribe]);
 
     useEffect(() => {
         if (activeJob) {
@@ -13,7 +13,7 @@ const TrackingPage = () => {
     const { id } = useParams();
     const navigate = useNavigate();
     const { user } = useAuth();
-    const { notify } = useNotification();
+    const { notify, subscribe } = useNotification();
     const [showCancelModal, setShowCancelModal] = useState(false);
     const ws = useRef(null);
 
@@ -64,9 +64,11 @@ const TrackingPage = () => {
         };
 
         fetchData();
-        const interval = setInterval(fetchData, 8000);
-        return () => clearInterval(interval);
-    }, [id, routePath]);
+        // Reload when the server says this delivery changed (paid, rider assigned, delivered...)
+        return subscribe((event) => {
+            if (event.delivery_id === id) fetchData();
+        });
+    }, [id, routePath, subscribe]);
 
     useEffect(() => {
         if (!id) return;
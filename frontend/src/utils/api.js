@@ -27,6 +27,7 @@ export const registerUser = (userData) => api.post('auth/register/', userData);
 export const getCurrentUser = () => api.get('auth/user/');
 export const getListings = (query = '') => api.get(`listings/?q=${query}`);
 export const getListingById = (id) => api.get(`listings/${id}/`);
+export const getRecommendedListings = () => api.get('listings/recommended/');
 export const createListing = (data) => api.post('listings/', data);
 export const getTextbooks = () => api.get('textbooks/');
 export const createTextbook = (data) => api.post('textbooks/', data);
@@ -60,7 +61,8 @@ export const searchTextbooks = (query) => api.get(`textbooks/?search=${query}`)
 export const createAndAddBook = (listId, bookData) => api.post(`my-booklists/${listId}/create_and_add_book/`, bookData);
 
 export const getConversations = () => api.get('conversations/');
-export const getMessages = (conversationId) => api.get(`conversations/${conversationId}/messages/`);
+export const getMessages = (conversationId, params = {}) => api.get(`conversations/${conversationId}/messages/`, { params });
+export const getMessagesPage = (cursorUrl) => api.get(cursorUrl);
 export const findOrCreateConversation = (userId, listingId) => {
     return api.post('conversations/find_or_create/', { user_id: userId, listing_id: listingId });
 };
@@ -76,6 +78,9 @@ export const getMySwaps = () => api.get('swaps/');
 export const createSwapRequest = (data) => api.post('swaps/', data);
 export const acceptSwap = (id) => api.post(`swaps/${id}/accept/`);
 export const rejectSwap = (id) => api.post(`swaps/${id}/reject/`);
+export const getMyChildren = () => api.get('my-children/');
+export const addChild = (data) => api.post('my-children/', data);
+export const removeChild = (id) => api.delete(`my-children/${id}/`);
 
 export const getDelivery = (id) => api.get(`deliveries/${id}/`);
 export const updateDelivery = (id, data) => api.patch(`/deliveries/${id}/`, data);
@@ -105,6 +110,17 @@ export const verifyPaystackPayment = async (reference) => {
 
 export const getMyEarnings = () => api.get('earnings/');
 export const requestWithdrawal = (amount) => api.post('earnings/withdraw/', { amount });
+export const getEarningsHistory = (cursorUrl = null) => cursorUrl ? api.get(cursorUrl) : api.get('earnings/history/');
+export const downloadExport = async (kind, fileFormat = 'csv') => {
+    const response = await api.get(`exports/${kind}/`, { params: { file_format: fileFormat }, responseType: 'blob' });
+    const url = window.URL.createObjectURL(response.data);
+    const link = document.createElement('a');
+    link.href = url;
+    link.download = `${kind}.${fileFormat}`;
+    link.click();
+    window.URL.revokeObjectURL(url);
+};
+export const getEarningsSummary = (period = 'week') => api.get('earnings/summary/', { params: { period } });
 
 export const getAvailableDeliveries = () => api.get('deliveries/?view=rider');
 export const acceptDeliveryJob = (id) => api.post(`deliveries/${id}/accept_job/`);
@@ -0,0 +1,94 @@
+import { getMessages, getMessagesPage } from './api';
+
+// Chat history kept for the session, oldest first. The first open loads the
+// newest page; reopening a chat only fetches what arrived since the last
+// message we hold (?since=<id>). Older pages load on demand via the cursor.
+const histories = new Map();
+
+const merge = (messages, incoming) => {
+    const known = new Set(messages.map((msg) => msg.id));
+    return [...messages, ...incoming.filter((msg) => !known.has(msg.id))];
+};
+
+export const cachedMessages = (conversationId) => histories.get(conversationId)?.messages || [];
+
+export const hasOlderMessages = (conversationId) => Boolean(histories.get(conversationId)?.older);
+
+export const loadHistory = async (conversationId) => {
+    const history = histories.get(conversationId);
+    if (!history) {
+        const res = await getMessages(conversationId);
+        histories.set(conversationId, { messages: [...res.data.results].reverse(), older: res.data.next });
+        return cachedMessages(conversationId);
+    }
+
+    let hasMore = history.messages.length > 0;
+    while (hasMore) {
+        const since = history.messages[history.messages.length - 1].id;
+        const res = await getMessages(conversationId, { since });
+        history.messages = merge(history.messages, res.data.results);
+        hasMore = res.data.has_more;
+    }
+    if (!history.messages.length) {
+        histories.delete(conversationId);
+        return loadHistory(conversationId);
+    }
+    return history.messages;
+};
+
+export const loadOlderMessages = async (conversationId) => {
+    const history = histories.get(conversationId);
+    if (!history?.older) return cachedMessages(conversationId);
+
+    const res = await getMessagesPage(history.older);
+    history.messages = merge([...res.data.results].reverse(), history.messages);
+    history.older = res.data.next;
+    return history.messages;
+};
+
+// Messages pushed over the websocket, shaped like the REST ones. `shown` is
+// what the component currently displays, used until the history has loaded.
+export const addLiveMessage = (conversationId, data, shown) => {
+    const message = {
+        id: data.id || `live-${Date.now()}`,
+        content: data.message,
+        sender: { id: data.sender_id },
+        timestamp: data.timestamp || new Date().toISOString(),
+    };
+    const history = histories.get(conversationId);
+    // Only real ids can anchor the next ?since= sync, so don't cache the others
+    if (!history || !data.id) return merge(shown, [message]);
+    history.messages = merge(history.messages, [message]);
+    return history.messages;
+};
+
+// A participant's read marker: everyone else's messages up to it are read
+export const applyReadReceipt = (conversationId, data, shown) => {
+    const markRead = (messages) => {
+        const upTo = messages.findIndex((msg) => msg.id === data.message_id);
+        if (upTo === -1) return messages;
+        return messages.map((msg, idx) => (
+            idx <= upTo && !msg.is_read && String(msg.sender?.id) !== String(data.user_id) ? { ...msg, is_read: true } : msg
+        ));
+    };
+    const history = histories.get(conversationId);
+    if (!history) return markRead(shown);
+    history.messages = markRead(history.messages);
+    return history.messages;
+};
+
+// The newest message from someone else that the server knows about
+export const lastIncomingId = (messages, userId) => {
+    for (let idx = messages.length - 1; idx >= 0; idx--) {
+        const msg = messages[idx];
+        if (String(msg.sender?.id) !== String(userId) && !String(msg.id).startsWith('live-')) return msg.id;
+    }
+    return null;
+};
+
+export const chatSocketUrl = (conversationId) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    // The token tells the room who is reading, typing and online
+    const token = localStorage.getItem('access_token');
+    return `${protocol}//${window.location.hostname}:8000/ws/chat/${conversationId}/?token=${token}`;
+};